@@ -0,0 +1,159 @@
+# airline_search.py
+# In-process autocomplete over the cached airline table.
+#
+# Names and codes are folded (NFKD, combining marks dropped, casefolded,
+# punctuation collapsed), so "aeromexico", "AEROMÉXICO" and "Aero-México"
+# all look the same. Two structures are built from the folded strings:
+#   - a sorted term array (full name, code, and each name word) for prefix
+#     matches via bisect, and
+#   - a trigram inverted index for typo-tolerant matches, scored with
+#     pg_trgm-style similarity (shared / union of trigram sets).
+# The index is rebuilt lazily when REFERENCE hands back a new airline
+# snapshot (TTL expiry, /reference/invalidate, or an ORM write to Airline),
+# so a keystroke never touches the database.
+import bisect
+import heapq
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+from reference_cache import REFERENCE
+
+SEARCH_MIN_SIMILARITY = float(os.getenv("AIRLINE_SEARCH_MIN_SIMILARITY", "0.3"))
+SEARCH_MAX_LIMIT = 50
+
+SearchHit = namedtuple("SearchHit", ["airline", "score", "match"])
+
+# match kind -> base score; fuzzy hits score FUZZY * similarity
+EXACT_CODE, EXACT_NAME, CODE_PREFIX, NAME_PREFIX, WORD_PREFIX, FUZZY = 100, 95, 80, 70, 60, 50
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def fold(value):
+    """'  Aero-México ' -> 'aero mexico'"""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", stripped.casefold()).strip()
+
+
+def trigrams(folded):
+    """pg_trgm-style: each word padded with two leading spaces and one trailing."""
+    grams = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class AirlineSearchIndex:
+    def __init__(self, airlines):
+        self.airlines = airlines
+        entries = []  # (term, position, kind)
+        self.grams = {}  # trigram -> list of positions
+        self.gram_counts = []
+        self.exact_name = {}
+        for pos, a in enumerate(airlines):
+            name, code = fold(a.airline_name), fold(a.airline_code)
+            self.exact_name.setdefault(name, pos)
+            entries.append((code, pos, "code"))
+            entries.append((name, pos, "name"))
+            for word in name.split()[1:]:
+                entries.append((word, pos, "word"))
+            grams = trigrams(f"{name} {code}")
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.grams.setdefault(gram, []).append(pos)
+        entries.sort()
+        self.terms = [e[0] for e in entries]
+        self.entries = entries
+
+    def exact(self, name):
+        pos = self.exact_name.get(fold(name))
+        return self.airlines[pos] if pos is not None else None
+
+    def _prefix(self, q, best):
+        i = bisect.bisect_left(self.terms, q)
+        while i < len(self.terms) and self.terms[i].startswith(q):
+            term, pos, kind = self.entries[i]
+            if kind == "code":
+                score, match = (EXACT_CODE, "code") if term == q else (CODE_PREFIX, "code_prefix")
+            elif kind == "name":
+                score, match = (EXACT_NAME, "name") if term == q else (NAME_PREFIX, "name_prefix")
+            else:
+                score, match = WORD_PREFIX, "word_prefix"
+            if score > best.get(pos, (0, None))[0]:
+                best[pos] = (score, match)
+            i += 1
+
+    def _fuzzy(self, q, best):
+        query = trigrams(q)
+        if not query:
+            return
+        shared = Counter()
+        for gram in query:
+            for pos in self.grams.get(gram, ()):
+                shared[pos] += 1
+        for pos, n in shared.items():
+            similarity = n / (len(query) + self.gram_counts[pos] - n)
+            if similarity < SEARCH_MIN_SIMILARITY:
+                continue
+            score = round(FUZZY * similarity, 2)
+            if score > best.get(pos, (0, None))[0]:
+                best[pos] = (score, "fuzzy")
+
+    def search(self, query, limit=10):
+        q = fold(query)
+        if not q:
+            return []
+        best = {}  # position -> (score, match)
+        self._prefix(q, best)
+        self._fuzzy(q, best)
+        ranked = heapq.nsmallest(
+            max(1, min(limit, SEARCH_MAX_LIMIT)), best.items(),
+            key=lambda kv: (-kv[1][0], len(self.airlines[kv[0]].airline_name), self.airlines[kv[0]].airline_name),
+        )
+        return [SearchHit(self.airlines[pos], score, match) for pos, (score, match) in ranked]
+
+
+class AirlineSearch:
+    """Process-wide index over REFERENCE's airline snapshot, rebuilt when the snapshot changes."""
+
+    def __init__(self, reference=REFERENCE):
+        self.reference = reference
+        self._index = None
+        self._source = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def index(self, db=None):
+        airlines = self.reference.list_airlines(db)
+        index = self._index
+        if index is not None and self._source is airlines:
+            return index
+        with self._lock:
+            if self._index is None or self._source is not airlines:
+                self._index = AirlineSearchIndex(airlines)
+                self._source = airlines
+                self.builds += 1
+            return self._index
+
+    def search(self, query, limit=10, db=None):
+        return self.index(db).search(query, limit)
+
+    def exact(self, name, db=None):
+        """Accent/punctuation-insensitive exact name match."""
+        return self.index(db).exact(name)
+
+    def stats(self):
+        index = self._index
+        return {
+            "builds": self.builds,
+            "airlines": len(index.airlines) if index else 0,
+            "terms": len(index.terms) if index else 0,
+            "trigrams": len(index.grams) if index else 0,
+        }
+
+
+AIRLINE_SEARCH = AirlineSearch()
@@ -0,0 +1,212 @@
+# analytics.py
+# Per-flight / per-airline / per-product reporting over bottle_records,
+# served from bottle_record_summaries instead of GROUP BY on the full table.
+#
+# refresh_summaries() folds new records in by record_id range
+# (last_record_id, target] with one INSERT ... SELECT ... GROUP BY ...
+# ON CONFLICT DO UPDATE (add counts/sums) per chunk. The watermark row is
+# locked FOR UPDATE, so concurrent refreshers serialize instead of double
+# counting.
+#
+# record_ids are allocated at INSERT time but become visible at COMMIT, so
+# a slow transaction can commit an id below one we already summarized. To
+# avoid skipping it, each refresh only advances to the max(record_id) it
+# saw SUMMARY_SETTLE_SECONDS ago. That is comfortably longer than any
+# web-request statement allowed by DB_STATEMENT_TIMEOUT_MS (the concurrent
+# writers are web workers; CLIs run without a timeout).
+#
+#   python analytics.py refresh               # cron / systemd timer
+#   python analytics.py refresh --loop 60     # long-running refresher
+#   python analytics.py refresh --no-settle   # one-off backfill (no concurrent writers)
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import String, cast, func, literal, select, union_all
+from db import SessionLocal, dialect_insert
+from metrics import span
+from models import BottleRecord, RecordSummary, SummaryWatermark
+
+SUMMARY_NAME = "bottle_record_summaries"
+SUMMARY_CHUNK = int(os.getenv("SUMMARY_CHUNK", "100000"))
+SUMMARY_SETTLE_SECONDS = float(os.getenv("SUMMARY_SETTLE_SECONDS", "30"))
+PAGE_LIMIT_MAX = 500
+
+# scope name in URLs -> (stored scope, BottleRecord column, key parser)
+SCOPES = {
+    "flights": ("flight", BottleRecord.flight_id, int),
+    "airlines": ("airline", BottleRecord.airline_id, int),
+    "products": ("product", BottleRecord.product_barcode, str),
+}
+SUMMARY_COLUMNS = ("scope", "scope_key", "recommended_action", "cleanliness_score",
+                   "record_count", "fill_level_sum")
+
+
+def summary_delta(lo, hi):
+    """Aggregates of records with lo < record_id <= hi, one SELECT per scope."""
+    in_range = (BottleRecord.record_id > lo, BottleRecord.record_id <= hi)
+    parts = [
+        select(
+            literal(scope, String(10)),
+            cast(column, String(50)),
+            BottleRecord.recommended_action,
+            BottleRecord.cleanliness_score,
+            func.count(),
+            func.sum(BottleRecord.fill_level),
+        ).where(*in_range).group_by(column, BottleRecord.recommended_action, BottleRecord.cleanliness_score)
+        for scope, column, _ in SCOPES.values()
+    ]
+    return union_all(*parts)
+
+
+def apply_delta(db, lo, hi):
+    stmt = dialect_insert(db, RecordSummary).from_select(SUMMARY_COLUMNS, summary_delta(lo, hi))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope", "scope_key", "recommended_action", "cleanliness_score"],
+        set_={
+            "record_count": RecordSummary.record_count + stmt.excluded.record_count,
+            "fill_level_sum": RecordSummary.fill_level_sum + stmt.excluded.fill_level_sum,
+        },
+    )
+    db.execute(stmt)
+
+
+def lock_watermark(db):
+    db.execute(
+        dialect_insert(db, SummaryWatermark)
+        .values(name=SUMMARY_NAME, last_record_id=0)
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    return db.execute(
+        select(SummaryWatermark).where(SummaryWatermark.name == SUMMARY_NAME).with_for_update()
+    ).scalar_one()
+
+
+def refresh_summaries(chunk=SUMMARY_CHUNK, settle=SUMMARY_SETTLE_SECONDS):
+    """Fold settled new records into the summaries. Each chunk commits on its own."""
+    started = time.perf_counter()
+    applied_from = None
+    with SessionLocal() as db:
+        while True:
+            with span("summary_refresh_chunk"):
+                wm = lock_watermark(db)
+                if applied_from is None:
+                    applied_from = wm.last_record_id
+                now = datetime.utcnow()
+                if settle <= 0:
+                    target = db.scalar(select(func.max(BottleRecord.record_id))) or 0
+                elif wm.pending_record_id is not None and now - wm.pending_since >= timedelta(seconds=settle):
+                    target = wm.pending_record_id
+                else:
+                    target = wm.last_record_id
+
+                if wm.last_record_id < target:
+                    hi = min(wm.last_record_id + chunk, target)
+                    apply_delta(db, wm.last_record_id, hi)
+                    wm.last_record_id = hi
+                    db.commit()
+                    continue
+
+                # caught up: remember what exists now; it is applied once settled
+                if settle > 0 and (wm.pending_record_id is None or wm.pending_record_id <= wm.last_record_id):
+                    latest = db.scalar(select(func.max(BottleRecord.record_id))) or 0
+                    if latest > wm.last_record_id:
+                        wm.pending_record_id, wm.pending_since = latest, now
+                result = {
+                    "from_record_id": applied_from,
+                    "through_record_id": wm.last_record_id,
+                    "pending_record_id": wm.pending_record_id,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+                db.commit()
+                return result
+
+
+def watermark(db):
+    wm = db.get(SummaryWatermark, SUMMARY_NAME)
+    return wm.last_record_id if wm else 0
+
+
+def fold(rows):
+    """Summary rows of one scope key -> report dict."""
+    total = 0
+    fill_sum = 0.0
+    by_action, cleanliness = {}, {}
+    for action, score, count, fill in rows:
+        total += count
+        fill_sum += float(fill or 0)
+        by_action[action] = by_action.get(action, 0) + count
+        cleanliness[str(score)] = cleanliness.get(str(score), 0) + count
+    discarded = sum(c for a, c in by_action.items() if (a or "").lower() == "discard")
+    return {
+        "records": total,
+        "by_action": by_action,
+        "avg_fill_level": round(fill_sum / total, 2) if total else None,
+        "discard_rate": round(discarded / total, 4) if total else None,
+        "cleanliness": dict(sorted(cleanliness.items(), key=lambda kv: int(kv[0]))),
+    }
+
+
+def _rows_for(db, scope, keys):
+    stmt = select(
+        RecordSummary.scope_key, RecordSummary.recommended_action, RecordSummary.cleanliness_score,
+        RecordSummary.record_count, RecordSummary.fill_level_sum,
+    ).where(RecordSummary.scope == scope, RecordSummary.scope_key.in_(keys))
+    grouped = {}
+    for key, *rest in db.execute(stmt):
+        grouped.setdefault(key, []).append(rest)
+    return grouped
+
+
+def summary_for(db, scope_name, key):
+    """Report for one flight/airline/product, or None if it has no summarized records."""
+    scope, _, parse = SCOPES[scope_name]
+    rows = _rows_for(db, scope, [str(key)]).get(str(key))
+    if not rows:
+        return None
+    return {"key": parse(key), **fold(rows), "as_of_record_id": watermark(db)}
+
+
+def summaries_page(db, scope_name, after=None, limit=50):
+    """
+    Keyset page of reports ordered by scope_key: keys come straight off the
+    primary-key index (WHERE scope = ? AND scope_key > ?), so page N costs
+    the same as page 1. Pass the returned next_after to get the next page.
+    """
+    scope, _, parse = SCOPES[scope_name]
+    limit = max(1, min(int(limit), PAGE_LIMIT_MAX))
+    keys_stmt = select(RecordSummary.scope_key).where(RecordSummary.scope == scope)
+    if after is not None:
+        keys_stmt = keys_stmt.where(RecordSummary.scope_key > str(after))
+    keys_stmt = keys_stmt.group_by(RecordSummary.scope_key).order_by(RecordSummary.scope_key).limit(limit + 1)
+    keys = list(db.scalars(keys_stmt))
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+    grouped = _rows_for(db, scope, keys) if keys else {}
+    return {
+        "items": [{"key": parse(k), **fold(grouped.get(k, []))} for k in keys],
+        "next_after": keys[-1] if has_more else None,
+        "as_of_record_id": watermark(db),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the bottle_records analytics summaries")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="fold new bottle_records into the summaries")
+    refresh.add_argument("--chunk", type=int, default=SUMMARY_CHUNK, help="record_ids per transaction")
+    refresh.add_argument("--no-settle", action="store_true",
+                         help="apply up to the current max(record_id) (backfill with no concurrent writers)")
+    refresh.add_argument("--loop", type=float, default=0, help="repeat every N seconds")
+    args = parser.parse_args()
+
+    while True:
+        print(json.dumps(refresh_summaries(args.chunk, 0 if args.no_settle else SUMMARY_SETTLE_SECONDS)), flush=True)
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
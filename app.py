@@ -1,28 +1,85 @@
 # app.py
-from flask import Flask, request, jsonify
-from datetime import date, datetime
-from db import SessionLocal
-from models import Airline, Product, Flight, GuidelineTemplate, BottleRecord
-from logic_evaluator import evaluate_action
-from sqlalchemy import select
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from datetime import date, datetime, timedelta
+from collections import namedtuple
+import json
+import os
+import uuid
+from db import SessionLocal, STATION_MODE, apply_statement_timeout, engine, dialect_insert
+from metrics import span, timed, begin_request, end_request, render_all, update_pool_gauges
+from models import Flight, BottleRecord
+from logic_evaluator import evaluate_action, GUIDELINES
+from reference_cache import REFERENCE, LRUTTLCache
+from airline_search import AIRLINE_SEARCH
+from scan_session import SESSIONS, HTTP_SESSIONS, describe_barcode
+from policy_model import POLICY
+from write_behind import WRITE_BEHIND
+from station_sync import STATION
+from analytics import SCOPES, refresh_summaries, summaries_page, summary_for
+from export_records import FORMATS, FormatUnavailable, export_stream, export_filename
+from guideline_replay import BASELINES, normalize_draft, replay
+from sqlalchemy import select, event
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
-import cv2, numpy as np, base64
-from pyzbar.pyzbar import decode
+from flask_sock import Sock
+from barcode_decode import read_image_bytes, decode_barcodes, first_barcode_value, ImagePayloadError
+from bottle_analysis import analyze_image
+from http_cache import BodyCache, cached_response, install_json_provider
 
 app = Flask(__name__)
+install_json_provider(app)
 
 # Broad CORS (also see @after_request below to cover error responses)
 CORS(app, resources={r"/*": {"origins": ["*", "null"]}}, supports_credentials=False)
+sock = Sock(app)
 
 # ───────────────────── Global CORS for *all* responses (incl. 4xx/5xx) ─────────────────────
+# Keep simple. If you need credentials, set a specific origin instead of "*"
+CORS_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type, Authorization"),
+)
+
+
 @app.after_request
 def apply_cors_headers(response):
-    # Keep simple. If you need credentials, set a specific origin instead of "*"
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+    # flask-cors already covers most responses; only fill in what is missing
+    headers = response.headers
+    for name, value in CORS_HEADERS:
+        if name not in headers:
+            headers[name] = value
+    return response
+
+# ───────────────────── Request metrics ─────────────────────
+@app.before_request
+def start_request_metrics():
+    g.metrics = begin_request()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop("metrics", None)
+    if started:
+        elapsed, db_seconds = end_request(*started, request.endpoint, response.status_code)
+        response.headers["Server-Timing"] = f"db;dur={db_seconds * 1000:.2f}, total;dur={elapsed * 1000:.2f}"
     return response
 
+
+@app.teardown_request
+def abort_request_metrics(exc):
+    # after_request is skipped on unhandled exceptions
+    started = g.pop("metrics", None)
+    if started:
+        end_request(*started, request.endpoint, 500)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics."""
+    update_pool_gauges(engine)
+    return Response(render_all(), mimetype="text/plain; version=0.0.4")
+
 # ───────────────────── Utilities ─────────────────────
 
 def parse_percentage_like(value):
@@ -45,36 +102,64 @@ def parse_int_like(value):
     except Exception:
         return 0
 
+def parse_flight_date(value):
+    """ISO date string -> date; defaults to today. Raises ValueError on bad input."""
+    if not value:
+        return date.today()
+    return datetime.fromisoformat(value).date()
+
+def parse_qualitative(qualitative):
+    """Normalizes operator-entered bottle details into BottleRecord columns."""
+    qualitative = qualitative or {}
+    return {
+        "fill_level": parse_percentage_like(qualitative.get("fill_level", 0)),
+        "cleanliness_score": parse_int_like(qualitative.get("cleanliness", 0)),  # 1–10 scale
+        "seal_status": (qualitative.get("seal_status") or qualitative.get("seal") or "unknown").lower(),
+        "bottle_condition": (qualitative.get("bottle_condition") or qualitative.get("condition") or "unknown").lower(),
+        "label_status": (qualitative.get("label_status") or "intact").lower(),
+    }
+
+def product_payload(prod):
+    return {
+        "barcode": prod.product_barcode,
+        "name": prod.product_name,
+        "category": prod.category,
+        "brand": prod.brand,
+        "bottle_size": prod.bottle_size
+    }
+
+def flight_payload(flight):
+    return {
+        "flight_id": flight.flight_id,
+        "number": flight.flight_number,
+        "origin": flight.origin,
+        "destination": flight.destination,
+        "date": str(flight.flight_date),
+        "service_class": flight.service_class
+    }
+
 # ───────────────────── IMAGE SCAN ENDPOINT ─────────────────────
 
 @app.route("/scan-barcode-image", methods=["POST", "OPTIONS"])
 def scan_barcode_image():
-    """Decodes a barcode from a base64-encoded image and returns product info."""
+    """Decodes a barcode from an uploaded image (raw, multipart or base64 JSON) and returns product info."""
     if request.method == "OPTIONS":
         # Preflight handled by @after_request too
         return jsonify({"status": "ok"}), 200
 
     try:
-        data = request.get_json(force=True)
-        image_b64 = data.get("image")
-        if not image_b64:
-            return jsonify({"error": "No image data provided"}), 400
-
-        # Decode the base64 image
-        image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        try:
+            barcodes = decode_barcodes(read_image_bytes(request))
+        except ImagePayloadError as e:
+            return jsonify({"error": str(e)}), 400
 
-        barcodes = decode(frame)
         if not barcodes:
             return jsonify({"success": False, "message": "No barcode detected"}), 404
 
-        barcode_value = barcodes[0].data.decode("utf-8").strip()
+        barcode_value = first_barcode_value(barcodes)
 
-        with SessionLocal() as db:
-            product = db.execute(
-                select(Product).where(Product.product_barcode == barcode_value)
-            ).scalars().first()
+        with span("product_lookup"):
+            product = REFERENCE.get_product(barcode_value)
 
         if not product:
             return jsonify({
@@ -97,34 +182,193 @@ def scan_barcode_image():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/analyze-image", methods=["POST", "OPTIONS"])
+def analyze_bottle_image():
+    """
+    One photo -> barcode + product, bottle boxes and an estimated fill level.
+    The image is decoded once and every analysis runs on that buffer.
+    Query flags: ?detect=0 skips bottle detection, ?fill=0 skips the fill estimate.
+    """
+    if request.method == "OPTIONS":
+        return jsonify({"status": "ok"}), 200
+
+    try:
+        try:
+            result = analyze_image(
+                read_image_bytes(request),
+                detect=request.args.get("detect", "1") != "0",
+                fill=request.args.get("fill", "1") != "0",
+            )
+        except ImagePayloadError as e:
+            return jsonify({"error": str(e)}), 400
+
+        barcode = result["barcodes"][0] if result["barcodes"] else None
+        with span("product_lookup"):
+            product = describe_barcode(barcode) if barcode else None
+
+        return jsonify({
+            "success": True,
+            "barcode": barcode,
+            "product": product,
+            "bottle": result["bottles"][0] if result["bottles"] else None,
+            "bottles": result["bottles"],
+            # fill.fill_level uses the same "85%" form /barcode/register accepts
+            "fill": result["fill"],
+            "image": result["size"],
+            # set (and "bottles" null) when the bottle model could not be loaded
+            "detector_error": result["detector_error"],
+        }), 200
+
+    except Exception as e:
+        app.logger.exception("Error analyzing image")
+        return jsonify({"error": str(e)}), 500
+
+
+# ───────────────────── STREAMING SCAN SESSIONS ─────────────────────
+
+def session_options(data):
+    options = {}
+    if data.get("debounce_seconds") is not None:
+        options["debounce_seconds"] = parse_percentage_like(data.get("debounce_seconds"))
+    return options
+
+
+@app.post("/scan-session")
+def open_scan_session():
+    """Start a streaming scan session; frames then go to /scan-session/<id>/frame or the WebSocket."""
+    data = request.get_json(silent=True) or {}
+    session = HTTP_SESSIONS.create(**session_options(data))
+    return jsonify({"session_id": session.session_id, **session.stats()}), 201
+
+
+@app.post("/scan-session/<string:session_id>/frame")
+def scan_session_frame(session_id):
+    """Submit one frame (raw image body preferred); only new barcodes are returned."""
+    try:
+        result = HTTP_SESSIONS.process(session_id, read_image_bytes(request))
+        if result is None:
+            return jsonify({"error": "Scan session not found"}), 404
+        return jsonify(result), 200
+    except ImagePayloadError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.exception("Error processing session frame")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/scan-session/<string:session_id>")
+def scan_session_stats(session_id):
+    session = HTTP_SESSIONS.get(session_id)
+    if not session:
+        return jsonify({"error": "Scan session not found"}), 404
+    return jsonify(session.stats()), 200
+
+
+@app.delete("/scan-session/<string:session_id>")
+def close_scan_session(session_id):
+    session = HTTP_SESSIONS.close(session_id)
+    if not session:
+        return jsonify({"error": "Scan session not found"}), 404
+    return jsonify({"status": "closed", **session.stats()}), 200
+
+
+@sock.route("/scan-stream")
+def scan_stream(ws):
+    """
+    WebSocket scan session. Binary messages are encoded frames; a text message
+    may carry JSON options ({"debounce_seconds": 2}). Each frame gets a JSON reply.
+    """
+    session = SESSIONS.create()
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            if isinstance(message, str):
+                try:
+                    options = session_options(json.loads(message))
+                    session.debounce_seconds = options.get("debounce_seconds", session.debounce_seconds)
+                    ws.send(json.dumps({"session_id": session.session_id, **session.stats()}))
+                except ValueError:
+                    ws.send(json.dumps({"error": "Invalid JSON message"}))
+                continue
+            try:
+                ws.send(json.dumps(session.process(message)))
+            except ImagePayloadError as e:
+                ws.send(json.dumps({"error": str(e)}))
+    finally:
+        SESSIONS.close(session.session_id)
+
+
 # ───────────────────── HELPERS ─────────────────────
 
+FlightRef = namedtuple(
+    "FlightRef", ["flight_id", "flight_number", "origin", "destination", "flight_date", "service_class"]
+)
+FLIGHT_COLUMNS = (
+    Flight.flight_id, Flight.flight_number, Flight.origin,
+    Flight.destination, Flight.flight_date, Flight.service_class
+)
+FLIGHT_KEY = ("airline_id", "flight_number", "flight_date", "service_class")
+
+# (airline_id, flight_number, flight_date, service_class) -> FlightRef
+FLIGHTS = LRUTTLCache(
+    maxsize=int(os.getenv("FLIGHT_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("FLIGHT_CACHE_TTL", "86400"))
+)
+
+
+@timed("get_or_create_flight")
 def get_or_create_flight(db, *, airline_id, flight_number, origin, destination, flight_date, service_class):
-    """Fetch or create a flight entry."""
-    stmt = select(Flight).where(
+    """
+    Fetch or create a flight entry inside the caller's transaction (no commit).
+    Creation is an INSERT ... ON CONFLICT DO NOTHING on the natural key, so
+    concurrent workers converge on the same row. Known flights come from FLIGHTS.
+    """
+    key = (airline_id, flight_number, flight_date, service_class)
+    flight = FLIGHTS.get(key, None)
+    if flight is not None:
+        return flight
+
+    match = select(*FLIGHT_COLUMNS).where(
         Flight.airline_id == airline_id,
         Flight.flight_number == flight_number,
         Flight.flight_date == flight_date,
         Flight.service_class == service_class
     )
-    flight = db.execute(stmt).scalars().first()
-    if flight:
-        return flight
+    row = db.execute(match).first()
+    if row is None:
+        stmt = dialect_insert(db, Flight).values(
+            airline_id=airline_id,
+            flight_number=flight_number,
+            origin=origin or "UNKNOWN",
+            destination=destination or "UNKNOWN",
+            flight_date=flight_date,
+            service_class=service_class
+        ).on_conflict_do_nothing(index_elements=FLIGHT_KEY).returning(*FLIGHT_COLUMNS)
+        row = db.execute(stmt).first()
+        if row is not None:
+            # Only cache once the caller's transaction commits (see below)
+            db.info.setdefault("new_flights", []).append((key, FlightRef(*row)))
+            return FlightRef(*row)
+        row = db.execute(match).first()  # lost the race to another worker
 
-    flight = Flight(
-        airline_id=airline_id,
-        flight_number=flight_number,
-        origin=origin or "UNKNOWN",
-        destination=destination or "UNKNOWN",
-        flight_date=flight_date,
-        service_class=service_class
-    )
-    db.add(flight)
-    db.commit()
-    db.refresh(flight)
+    flight = FlightRef(*row)
+    FLIGHTS.set(key, flight)
     return flight
 
 
+@event.listens_for(SessionLocal, "after_commit")
+def cache_committed_flights(session):
+    for key, flight in session.info.pop("new_flights", ()):
+        FLIGHTS.set(key, flight)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def drop_uncommitted_flights(session):
+    session.info.pop("new_flights", None)
+
+
 # ───────────────────── BASE ROUTES ─────────────────────
 
 @app.get("/health")
@@ -137,60 +381,210 @@ def health_check():
 
 # ───────────────────── AIRLINE ENDPOINTS ─────────────────────
 
+# Serialized bodies, re-rendered only when the underlying reference data changes
+AIRLINE_BODIES = BodyCache(maxsize=4)
+PRODUCT_BODIES = BodyCache()
+
+
+def render_airlines(rows):
+    return [
+        {"airline_id": a.airline_id, "airline_code": a.airline_code, "airline_name": a.airline_name}
+        for a in rows
+    ]
+
+
 @app.get("/airlines")
 def list_airlines():
-    """Return all airlines for dropdown/autocomplete."""
-    with SessionLocal() as db:
-        rows = db.query(Airline).all()
-        return jsonify([
-            {"airline_id": a.airline_id, "airline_code": a.airline_code, "airline_name": a.airline_name}
-            for a in rows
-        ]), 200
+    """Return all airlines for dropdown/autocomplete (ETag / 304 aware)."""
+    rows = REFERENCE.list_airlines()
+    return cached_response(AIRLINE_BODIES.get("all", rows, render_airlines))
+
+
+@app.get("/airlines/search")
+def search_airlines():
+    """Ranked autocomplete: /airlines/search?q=emir&limit=10 (prefix on names/codes, then typo-tolerant)."""
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    query = request.args.get("q", "")
+    hits = AIRLINE_SEARCH.search(query, limit)
+    return jsonify({
+        "query": query,
+        "results": [
+            {
+                "airline_id": h.airline.airline_id,
+                "airline_code": h.airline.airline_code,
+                "airline_name": h.airline.airline_name,
+                "score": h.score,
+                "match": h.match,
+            }
+            for h in hits
+        ],
+    }), 200
 
 
 @app.get("/airline/by-name/<string:name>")
 def airline_by_name(name):
-    """Return a single airline by its name (case-insensitive)."""
-    with SessionLocal() as db:
-        airline = db.query(Airline).filter(Airline.airline_name.ilike(name)).first()
+    """Return a single airline by its name (case- and accent-insensitive)."""
+    airline = REFERENCE.airline_by_name(name) or AIRLINE_SEARCH.exact(name)
+    if not airline:
+        return jsonify({"error": "Airline not found"}), 404
+    return jsonify({
+        "airline_id": airline.airline_id,
+        "airline_code": airline.airline_code,
+        "airline_name": airline.airline_name
+    }), 200
+
+
+# ───────────────────── REFERENCE CACHE ─────────────────────
+
+@app.get("/reference/stats")
+def reference_stats():
+    """Hit/miss/eviction counters for the product and airline caches."""
+    return jsonify({
+        **REFERENCE.stats(),
+        "bodies": {"airlines": AIRLINE_BODIES.stats(), "products": PRODUCT_BODIES.stats()},
+        "airline_search": AIRLINE_SEARCH.stats(),
+    }), 200
+
+
+@app.post("/reference/invalidate")
+def reference_invalidate():
+    """Drop cached products/airlines, e.g. after editing them outside this API."""
+    data = request.get_json(silent=True) or {}
+    version = REFERENCE.invalidate(
+        barcode=data.get("barcode"),
+        airlines=data.get("airlines", True),
+        products=data.get("products", True)
+    )
+    return jsonify({"status": "invalidated", "version": version}), 200
+
+
+# ───────────────────── GUIDELINE ENDPOINTS ─────────────────────
+
+@app.get("/guidelines/index")
+def guideline_index_stats():
+    """Report the state of the in-memory guideline index."""
+    return jsonify(GUIDELINES.stats()), 200
+
+
+@app.post("/guidelines/reload")
+def reload_guidelines():
+    """
+    Rebuild this worker's guideline index now. Other workers notice the
+    change on their next check (GUIDELINE_CHECK_SECONDS).
+    """
+    try:
+        GUIDELINES.invalidate()
+        with SessionLocal() as db:
+            GUIDELINES.load(db)
+        return jsonify({"status": "reloaded", **GUIDELINES.stats()}), 200
+    except Exception as e:
+        app.logger.exception("Error reloading guidelines")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/guidelines/replay")
+def replay_guidelines():
+    """
+    What-if for unsaved guidelines: classify past bottle_records under the
+    drafts and count old -> new actions (see guideline_replay.py).
+    Body: {"drafts": [...guideline rows with airline_code...], "since", "until",
+    "airline_code", "baseline": "current" | "recorded"}; the range defaults
+    to the last 365 days.
+    """
+    data = request.get_json(force=True)
+    drafts = data.get("drafts")
+    if not isinstance(drafts, list) or not drafts:
+        return jsonify({"error": "drafts must be a non-empty list"}), 400
+    baseline = data.get("baseline") or "current"
+    if baseline not in BASELINES:
+        return jsonify({"error": f"baseline must be one of {', '.join(BASELINES)}"}), 400
+    try:
+        until = datetime.fromisoformat(data["until"]) if data.get("until") else datetime.utcnow()
+        since = datetime.fromisoformat(data["since"]) if data.get("since") else until - timedelta(days=365)
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO dates"}), 400
+
+    airline_id = None
+    if data.get("airline_code"):
+        airline = REFERENCE.airline_by_code(data["airline_code"].strip())
         if not airline:
-            return jsonify({"error": "Airline not found"}), 404
-        return jsonify({
-            "airline_id": airline.airline_id,
-            "airline_code": airline.airline_code,
-            "airline_name": airline.airline_name
-        }), 200
+            return jsonify({"error": "Airline not found", "airline_code": data["airline_code"]}), 404
+        airline_id = airline.airline_id
+
+    rows = []
+    for i, draft in enumerate(drafts):
+        try:
+            rows.append(normalize_draft(draft))
+        except ValueError as e:
+            return jsonify({"error": f"drafts[{i}]: {e}"}), 400
+
+    try:
+        return jsonify(replay(rows, since, until, airline_id, baseline)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.exception("Error replaying guidelines")
+        return jsonify({"error": str(e)}), 500
 
 
 # ───────────────────── BARCODE ENDPOINTS ─────────────────────
 
+def render_product_check(product):
+    return {
+        "exists": True,
+        "barcode": product.product_barcode,
+        "product_name": product.product_name,
+        "category": product.category,
+        "brand": product.brand,
+        "bottle_size": product.bottle_size
+    }
+
+
 @app.get("/barcode/check/<string:barcode>")
 def check_barcode(barcode):
     """Check if barcode exists in the database."""
     try:
-        with SessionLocal() as db:
-            product = db.execute(
-                select(Product).where(Product.product_barcode == barcode)
-            ).scalars().first()
-            if product:
-                return jsonify({
-                    "exists": True,
-                    "barcode": product.product_barcode,
-                    "product_name": product.product_name,
-                    "category": product.category,
-                    "brand": product.brand,
-                    "bottle_size": product.bottle_size
-                }), 200
-            return jsonify({"exists": False, "barcode": barcode, "message": "Not found"}), 404
+        with span("product_lookup"):
+            product = REFERENCE.get_product(barcode)
+        if product:
+            return cached_response(PRODUCT_BODIES.get(barcode, product, render_product_check))
+        return jsonify({"exists": False, "barcode": barcode, "message": "Not found"}), 404
     except Exception as e:
         app.logger.exception("Error checking barcode")
         return jsonify({"error": str(e)}), 500
 
 
+# Answer /barcode/register before the record is committed (see write_behind.py)
+REGISTER_DEFERRED = os.getenv("REGISTER_DEFERRED", "0") == "1"
+
+
+def parse_scan_id(value):
+    """Client-supplied idempotency key (UUID string) -> canonical form, or None."""
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
 @app.post("/barcode/register")
 def register_barcode():
-    """Registers a bottle scan, evaluates it, and returns an action recommendation."""
+    """
+    Registers a bottle scan, evaluates it, and returns an action recommendation.
+    With ?deferred=1 (or "deferred": true, or REGISTER_DEFERRED=1) the record is
+    journaled locally and committed in the background: the reply is 202 with
+    the record's scan_id and no record_id.
+    """
     data = request.get_json(force=True)
+    deferred = request.args.get("deferred", "1" if REGISTER_DEFERRED else "0") == "1" or data.get("deferred") is True
+    client_scan_id = parse_scan_id(data.get("scan_id"))
+    if data.get("scan_id") and client_scan_id is None:
+        return jsonify({"error": "scan_id must be a UUID"}), 400
+    scan_id = client_scan_id or str(uuid.uuid4())
 
     barcode = (data.get("barcode") or "").strip()
     airline_code = (data.get("airline_code") or "").strip()
@@ -198,27 +592,24 @@ def register_barcode():
     service_class = (data.get("service_class") or "").strip()
     origin = data.get("origin")
     destination = data.get("destination")
-    flight_date_str = data.get("flight_date")
 
     if not barcode or not airline_code or not flight_number or not service_class:
         return jsonify({"error": "Missing required fields"}), 400
 
     # Parse date safely
-    if flight_date_str:
-        try:
-            fdate = datetime.fromisoformat(flight_date_str).date()
-        except ValueError:
-            return jsonify({"error": "Invalid flight_date format"}), 400
-    else:
-        fdate = date.today()
+    try:
+        fdate = parse_flight_date(data.get("flight_date"))
+    except ValueError:
+        return jsonify({"error": "Invalid flight_date format"}), 400
 
     try:
         with SessionLocal() as db:
-            prod = db.execute(select(Product).where(Product.product_barcode == barcode)).scalars().first()
+            with span("product_lookup"):
+                prod = REFERENCE.get_product(barcode, db)
             if not prod:
                 return jsonify({"error": "Product not found", "barcode": barcode}), 404
 
-            airline = db.execute(select(Airline).where(Airline.airline_code == airline_code)).scalars().first()
+            airline = REFERENCE.airline_by_code(airline_code, db)
             if not airline:
                 return jsonify({"error": "Airline not found", "airline_code": airline_code}), 404
 
@@ -233,42 +624,82 @@ def register_barcode():
             )
 
             # ────────────── Bottle Evaluation ──────────────
-            qualitative = data.get("qualitative", {}) or {}
-
-            fill_level = parse_percentage_like(qualitative.get("fill_level", 0))
-            cleanliness = parse_int_like(qualitative.get("cleanliness", 0))  # Now 1–10 scale
-            seal = (qualitative.get("seal_status") or qualitative.get("seal") or "unknown").lower()
-            condition = (qualitative.get("bottle_condition") or qualitative.get("condition") or "unknown").lower()
+            q = parse_qualitative(data.get("qualitative"))
 
             guideline = evaluate_action(
                 db,
                 airline_id=airline.airline_id,
                 liquor_type=prod.category,
                 service_class=service_class,
-                fill_level=fill_level,
-                cleanliness_score=cleanliness,
-                seal_status=seal,
-                bottle_condition=condition
+                fill_level=q["fill_level"],
+                cleanliness_score=q["cleanliness_score"],
+                seal_status=q["seal_status"],
+                bottle_condition=q["bottle_condition"]
             )
 
             action = guideline.get("action", "UNKNOWN")
             matched_guideline_id = guideline.get("guideline_id")
 
+            if deferred:
+                if db.info.get("new_flights"):
+                    # a brand-new flight must exist before its records are flushed
+                    with span("commit"):
+                        db.commit()
+                with span("journal"):
+                    WRITE_BEHIND.submit({
+                        "scan_uuid": scan_id,
+                        "product_barcode": prod.product_barcode,
+                        "airline_id": airline.airline_id,
+                        "flight_id": flight.flight_id,
+                        "guideline_id": matched_guideline_id,
+                        "recommended_action": action,
+                        "scan_timestamp": datetime.utcnow().isoformat(),
+                        **q
+                    })
+                return jsonify({
+                    "status": "accepted",
+                    "recommended_action": action,
+                    "guideline_id": matched_guideline_id,
+                    "record_id": None,
+                    "scan_id": scan_id,
+                    "product": product_payload(prod),
+                    "flight": flight_payload(flight)
+                }), 202
+
             # Save record if guideline found
             record = BottleRecord(
                 product_barcode=prod.product_barcode,
                 airline_id=airline.airline_id,
                 flight_id=flight.flight_id,
                 guideline_id=matched_guideline_id,
-                fill_level=fill_level,
-                seal_status=seal,
-                cleanliness_score=cleanliness,
-                label_status=qualitative.get("label_status", "intact").lower(),
-                bottle_condition=condition,
-                recommended_action=action
+                recommended_action=action,
+                scan_uuid=scan_id,
+                **q
             )
             db.add(record)
-            db.commit()
+            try:
+                with span("commit"):
+                    db.commit()
+            except IntegrityError:
+                if client_scan_id is None:
+                    raise
+                # retried request: report the record the first attempt created
+                db.rollback()
+                record_id = db.execute(
+                    select(BottleRecord.record_id).where(BottleRecord.scan_uuid == scan_id)
+                ).scalar()
+                if record_id is None:
+                    raise
+                return jsonify({
+                    "status": "success",
+                    "duplicate": True,
+                    "recommended_action": action,
+                    "guideline_id": matched_guideline_id,
+                    "record_id": record_id,
+                    "scan_id": scan_id,
+                    "product": product_payload(prod),
+                    "flight": flight_payload(flight)
+                }), 200
             db.refresh(record)
 
             return jsonify({
@@ -276,21 +707,9 @@ def register_barcode():
                 "recommended_action": action,
                 "guideline_id": matched_guideline_id,
                 "record_id": record.record_id,
-                "product": {
-                    "barcode": prod.product_barcode,
-                    "name": prod.product_name,
-                    "category": prod.category,
-                    "brand": prod.brand,
-                    "bottle_size": prod.bottle_size
-                },
-                "flight": {
-                    "flight_id": flight.flight_id,
-                    "number": flight.flight_number,
-                    "origin": flight.origin,
-                    "destination": flight.destination,
-                    "date": str(flight.flight_date),
-                    "service_class": flight.service_class
-                }
+                "scan_id": scan_id,
+                "product": product_payload(prod),
+                "flight": flight_payload(flight)
             }), 200
 
     except Exception as e:
@@ -298,9 +717,315 @@ def register_barcode():
         return jsonify({"error": str(e)}), 500
 
 
+@app.post("/barcode/register-batch")
+def register_barcode_batch():
+    """
+    Registers every bottle of one galley cart in a single transaction.
+    Body: flight context (same fields as /barcode/register, minus barcode)
+    plus "items": [{"barcode": ..., "scan_id": ..., "qualitative": {...}}, ...].
+    Returns one result per item, in input order; bad items get an "error"
+    and do not abort the rest of the batch. As with /barcode/register, an
+    item's scan_id makes it idempotent: a retried cart reports the existing
+    record ("duplicate": true) instead of inserting it again.
+    """
+    data = request.get_json(force=True)
+
+    airline_code = (data.get("airline_code") or "").strip()
+    flight_number = (data.get("flight_number") or "").strip()
+    service_class = (data.get("service_class") or "").strip()
+    items = data.get("items")
+
+    if not airline_code or not flight_number or not service_class:
+        return jsonify({"error": "Missing required fields"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+
+    try:
+        fdate = parse_flight_date(data.get("flight_date"))
+    except ValueError:
+        return jsonify({"error": "Invalid flight_date format"}), 400
+
+    try:
+        with SessionLocal() as db:
+            airline = REFERENCE.airline_by_code(airline_code, db)
+            if not airline:
+                return jsonify({"error": "Airline not found", "airline_code": airline_code}), 404
+
+            barcodes = {(item.get("barcode") or "").strip() for item in items if isinstance(item, dict)}
+            barcodes.discard("")
+            with span("product_lookup"):
+                products = REFERENCE.get_products(barcodes, db)
+
+            flight = get_or_create_flight(
+                db,
+                airline_id=airline.airline_id,
+                flight_number=flight_number,
+                origin=data.get("origin"),
+                destination=data.get("destination"),
+                flight_date=fdate,
+                service_class=service_class
+            )
+
+            results = []
+            rows = []
+            for i, item in enumerate(items):
+                if not isinstance(item, dict):
+                    results.append({"index": i, "error": "Item must be an object"})
+                    continue
+                barcode = (item.get("barcode") or "").strip()
+                if not barcode:
+                    results.append({"index": i, "error": "Missing barcode"})
+                    continue
+                client_scan_id = parse_scan_id(item.get("scan_id"))
+                if item.get("scan_id") and client_scan_id is None:
+                    results.append({"index": i, "barcode": barcode, "error": "scan_id must be a UUID"})
+                    continue
+                scan_id = client_scan_id or str(uuid.uuid4())
+                prod = products.get(barcode)
+                if not prod:
+                    results.append({"index": i, "barcode": barcode, "error": "Product not found"})
+                    continue
+
+                q = parse_qualitative(item.get("qualitative"))
+                guideline = evaluate_action(
+                    db,
+                    airline_id=airline.airline_id,
+                    liquor_type=prod.category,
+                    service_class=service_class,
+                    fill_level=q["fill_level"],
+                    cleanliness_score=q["cleanliness_score"],
+                    seal_status=q["seal_status"],
+                    bottle_condition=q["bottle_condition"]
+                )
+                action = guideline.get("action", "UNKNOWN")
+                rows.append({
+                    "product_barcode": barcode,
+                    "airline_id": airline.airline_id,
+                    "flight_id": flight.flight_id,
+                    "guideline_id": guideline.get("guideline_id"),
+                    "recommended_action": action,
+                    "scan_timestamp": datetime.utcnow(),
+                    "scan_uuid": scan_id,
+                    **q
+                })
+                results.append({
+                    "index": i,
+                    "barcode": barcode,
+                    "scan_id": scan_id,
+                    "recommended_action": action,
+                    "guideline_id": guideline.get("guideline_id"),
+                })
+
+            saved = 0
+            if rows:
+                # One multi-row INSERT ... RETURNING; scan_ids already stored
+                # (a retried cart) are skipped and reported as duplicates
+                record_ids = dict(db.execute(
+                    dialect_insert(db, BottleRecord)
+                    .on_conflict_do_nothing(index_elements=["scan_uuid"])
+                    .returning(BottleRecord.scan_uuid, BottleRecord.record_id),
+                    rows
+                ).all())
+                saved = len(record_ids)
+                repeated = [row["scan_uuid"] for row in rows if row["scan_uuid"] not in record_ids]
+                existing = dict(db.execute(
+                    select(BottleRecord.scan_uuid, BottleRecord.record_id)
+                    .where(BottleRecord.scan_uuid.in_(repeated))
+                ).all()) if repeated else {}
+                for r in results:
+                    if "error" in r:
+                        continue
+                    if r["scan_id"] in record_ids:
+                        r["record_id"] = record_ids.pop(r["scan_id"])  # a scan_id repeated in the cart counts once
+                    else:
+                        r["record_id"] = existing.get(r["scan_id"])
+                        r["duplicate"] = True
+            with span("commit"):
+                db.commit()
+
+            return jsonify({
+                "status": "success",
+                "saved": saved,
+                "duplicates": len(rows) - saved,
+                "failed": len(results) - len(rows),
+                "flight": flight_payload(flight),
+                "results": results
+            }), 200
+
+    except Exception as e:
+        app.logger.exception("Error registering bottle batch")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/write-behind/stats")
+def write_behind_stats():
+    """Journal depth, flush counters and last error of this worker's write-behind queue."""
+    return jsonify(WRITE_BEHIND.stats()), 200
+
+
+# ───────────────────── STATION SYNC ─────────────────────
+
+@app.get("/station/status")
+def station_status():
+    """Replica row counts, unpushed records and last sync outcome (STATION_MODE=1 only)."""
+    if not STATION_MODE:
+        return jsonify({"station_mode": False}), 200
+    return jsonify(STATION.stats()), 200
+
+
+@app.post("/station/sync")
+def station_sync_now():
+    """Push pending records and pull reference changes now. ?full=1 also reconciles deletions."""
+    if not STATION_MODE:
+        return jsonify({"error": "Not running in station mode"}), 409
+    try:
+        pushed = STATION.push()
+        pulled = STATION.pull(full=True if request.args.get("full") == "1" else None)
+        return jsonify({"pushed": pushed, "pull": pulled}), 200
+    except Exception as e:
+        app.logger.exception("Station sync failed")
+        return jsonify({"error": str(e), "status": STATION.stats()}), 503
+
+
+# ───────────────────── ANALYTICS ─────────────────────
+
+@app.get("/analytics/<string:scope>")
+def analytics_list(scope):
+    """Keyset-paginated summaries: /analytics/flights?after=<next_after>&limit=50"""
+    if scope not in SCOPES:
+        return jsonify({"error": "Unknown scope", "scopes": list(SCOPES)}), 404
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    with SessionLocal() as db:
+        return jsonify(summaries_page(db, scope, after=request.args.get("after"), limit=limit)), 200
+
+
+@app.get("/analytics/<string:scope>/<string:key>")
+def analytics_detail(scope, key):
+    """Counts by action, average fill, discard rate and cleanliness distribution for one key."""
+    if scope not in SCOPES:
+        return jsonify({"error": "Unknown scope", "scopes": list(SCOPES)}), 404
+    with SessionLocal() as db:
+        summary = summary_for(db, scope, key)
+    if summary is None:
+        return jsonify({"error": "No records", "scope": scope, "key": key}), 404
+    return jsonify(summary), 200
+
+
+@app.post("/analytics/refresh")
+def analytics_refresh():
+    """Fold settled new bottle_records into the summaries now (normally run by `analytics.py refresh`)."""
+    try:
+        return jsonify(refresh_summaries()), 200
+    except Exception as e:
+        app.logger.exception("Error refreshing analytics summaries")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/export/bottle-records")
+def export_bottle_records():
+    """
+    Streams bottle_records joined with product/flight/airline.
+    ?format=csv|ndjson|parquet &airline_code=EK &since=2025-01-01 &until=2025-02-01 &gzip=1
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": "Unknown format", "formats": list(FORMATS)}), 400
+    gzip = request.args.get("gzip") == "1"
+
+    airline_code = (request.args.get("airline_code") or "").strip() or None
+    airline_id = None
+    if airline_code:
+        airline = REFERENCE.airline_by_code(airline_code)
+        if not airline:
+            return jsonify({"error": "Airline not found", "airline_code": airline_code}), 404
+        airline_id = airline.airline_id
+
+    try:
+        since = datetime.fromisoformat(request.args["since"]) if request.args.get("since") else None
+        until = datetime.fromisoformat(request.args["until"]) if request.args.get("until") else None
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO dates"}), 400
+
+    try:
+        body = export_stream(fmt, airline_id=airline_id, since=since, until=until, gzip=gzip)
+    except FormatUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+    return Response(
+        stream_with_context(body),
+        mimetype="application/gzip" if gzip else FORMATS[fmt][0],
+        headers={
+            "Content-Disposition": f'attachment; filename="{export_filename(fmt, gzip, airline_code)}"',
+            "X-Accel-Buffering": "no",  # let proxies pass chunks through as they are produced
+        },
+    )
+
+
+# ───────────────────── POLICY MODEL ─────────────────────
+
+@app.get("/policy/model")
+def policy_model_info():
+    """Which policy model artifacts this worker serves."""
+    return jsonify(POLICY.info()), 200
+
+
+@app.post("/policy/reload")
+def policy_reload():
+    """Load the version named by models/CURRENT now instead of at the next check."""
+    try:
+        swapped = POLICY.reload(force=bool((request.get_json(silent=True) or {}).get("force")))
+        return jsonify({"swapped": swapped, **POLICY.info()}), 200
+    except Exception as e:
+        app.logger.exception("Error reloading policy model")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/policy/predict")
+def policy_predict():
+    """
+    Predict Recommended_Action for one bottle.
+    Body: {"features": {"Customer_Code": "EK", "Category": "Wine", "Fill_Level": "75%", ...}}
+    using the database.csv column names the model was trained on.
+    """
+    data = request.get_json(force=True)
+    features = data.get("features", data)
+    if not isinstance(features, dict):
+        return jsonify({"error": "features must be an object"}), 400
+    try:
+        with span("policy_predict_one"):
+            return jsonify(POLICY.model.predict_one(features)), 200
+    except Exception as e:
+        app.logger.exception("Error predicting policy action")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/policy/predict-batch")
+def policy_predict_batch():
+    """Body: {"items": [{...features...}, ...]}; results are returned in input order."""
+    data = request.get_json(force=True)
+    items = data.get("items")
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify({"error": "items must be a list of objects"}), 400
+    try:
+        with span("policy_predict_batch"):
+            return jsonify({"results": POLICY.model.predict_batch(items)}), 200
+    except Exception as e:
+        app.logger.exception("Error predicting policy actions")
+        return jsonify({"error": str(e)}), 500
+
+
 
 # ───────────────────── MAIN ─────────────────────
 
 if __name__ == "__main__":
-    print("Flask API running on http://127.0.0.1:6060 ...")
-    app.run(host="0.0.0.0", port=6060, debug=True)
+    port = int(os.getenv("PORT", "6060"))
+    debug = os.getenv("FLASK_DEBUG", "1") == "1"
+    print(f"Flask API running on http://127.0.0.1:{port} ...")
+    apply_statement_timeout(engine)
+    # with the debug reloader, only the serving child process syncs
+    if STATION_MODE and (not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        print("Station mode: local replica, syncing in the background")
+        STATION.start()
+    app.run(host="0.0.0.0", port=port, debug=debug)
@@ -0,0 +1,169 @@
+# barcode_decode.py
+# Shared image intake + barcode decoding for the scan endpoints.
+# Accepts raw image bodies, multipart uploads and the legacy base64 JSON,
+# and decodes on a reduced grayscale frame first, retrying full size only
+# when nothing is found.
+import base64
+import os
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode, ZBarSymbol
+from metrics import span
+
+# 1, 2, 4 or 8: let libjpeg downscale while decoding (IMREAD_REDUCED_GRAYSCALE_*)
+SCAN_REDUCE = int(os.getenv("SCAN_REDUCE", "2"))
+# Cap on the fast-path frame width after reduction (0 = no cap)
+SCAN_MAX_WIDTH = int(os.getenv("SCAN_MAX_WIDTH", "960"))
+# Optional fractional ROI "x0,y0,x1,y1", e.g. "0.1,0.25,0.9,0.75"
+SCAN_ROI = os.getenv("SCAN_ROI", "")
+SCAN_SYMBOLOGIES = os.getenv("SCAN_SYMBOLOGIES", "CODE128,CODE39,EAN13,EAN8,UPCA,UPCE,QRCODE")
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+IMAGE_CONTENT_TYPES = ("image/jpeg", "image/png", "image/webp", "application/octet-stream")
+
+
+def parse_roi(value):
+    if not value:
+        return None
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value.split(","))
+    except ValueError:
+        return None
+    if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+        return None
+    return x0, y0, x1, y1
+
+
+def parse_symbols(value):
+    symbols = [getattr(ZBarSymbol, name.strip().upper(), None) for name in value.split(",")]
+    return [s for s in symbols if s is not None] or None
+
+
+ROI = parse_roi(SCAN_ROI)
+SYMBOLS = parse_symbols(SCAN_SYMBOLOGIES)
+
+
+class ImagePayloadError(ValueError):
+    pass
+
+
+def read_image_bytes(request):
+    """
+    Returns the encoded image bytes from a Flask request:
+    raw image/* body, multipart field "image", or JSON {"image": "<data URL>"}.
+    """
+    content_type = (request.mimetype or "").lower()
+
+    if content_type in IMAGE_CONTENT_TYPES:
+        with span("read_body"):
+            body = request.get_data(cache=False)
+        if not body:
+            raise ImagePayloadError("No image data provided")
+        return body
+
+    if content_type == "multipart/form-data":
+        upload = request.files.get("image")
+        if upload is None:
+            raise ImagePayloadError("No image data provided")
+        with span("read_body"):
+            return upload.read()
+
+    with span("read_body"):
+        data = request.get_json(force=True, silent=True) or {}
+    image_b64 = data.get("image")
+    if not image_b64:
+        raise ImagePayloadError("No image data provided")
+    # Strip an optional "data:image/jpeg;base64," prefix
+    with span("base64_decode"):
+        return base64.b64decode(image_b64.rpartition(",")[2])
+
+
+def prepare_fast_frame(buf):
+    """
+    Reduced grayscale decode + ROI crop + width cap.
+    Returns (frame, reduced) where `reduced` says whether it differs from full size.
+    """
+    flag = _REDUCED_FLAGS.get(SCAN_REDUCE, cv2.IMREAD_GRAYSCALE)
+    with span("imdecode"):
+        gray = cv2.imdecode(buf, flag)
+    if gray is None:
+        return None, False
+    reduced = flag != cv2.IMREAD_GRAYSCALE or ROI is not None
+
+    if ROI:
+        h, w = gray.shape[:2]
+        x0, y0, x1, y1 = ROI
+        gray = gray[int(y0 * h):int(y1 * h), int(x0 * w):int(x1 * w)]
+
+    if SCAN_MAX_WIDTH and gray.shape[1] > SCAN_MAX_WIDTH:
+        scale = SCAN_MAX_WIDTH / gray.shape[1]
+        with span("resize"):
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        reduced = True
+    return gray, reduced
+
+
+def decode_frame(gray):
+    """pyzbar restricted to the configured symbologies."""
+    return decode(gray, symbols=SYMBOLS)
+
+
+def decode_barcodes(image_bytes):
+    """
+    Encoded image bytes -> list of pyzbar results.
+    Fast path on a reduced grayscale frame; full-resolution retry only on a miss.
+    Raises ImagePayloadError if the bytes are not a decodable image.
+    """
+    buf = np.frombuffer(image_bytes, np.uint8)
+
+    gray, reduced = prepare_fast_frame(buf)
+    if gray is None:
+        raise ImagePayloadError("Could not decode image")
+    return decode_prepared(buf, gray, reduced)
+
+
+def decode_prepared(buf, gray, reduced):
+    """Decode an already prepared fast frame, falling back to full size of `buf`."""
+    with span("pyzbar"):
+        barcodes = decode_frame(gray)
+    if barcodes or not reduced:
+        return barcodes
+
+    with span("imdecode_full"):
+        full = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+    if full is None:
+        return []
+    with span("pyzbar_full"):
+        return decode_frame(full)
+
+
+def decode_array(gray):
+    """
+    Same fast/full strategy for a grayscale array that is already decoded
+    (e.g. shared with other analyses): ROI + width cap first, then full size.
+    """
+    fast = gray
+    if ROI:
+        h, w = fast.shape[:2]
+        x0, y0, x1, y1 = ROI
+        fast = fast[int(y0 * h):int(y1 * h), int(x0 * w):int(x1 * w)]
+    if SCAN_MAX_WIDTH and fast.shape[1] > SCAN_MAX_WIDTH:
+        scale = SCAN_MAX_WIDTH / fast.shape[1]
+        with span("resize"):
+            fast = cv2.resize(fast, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    with span("pyzbar"):
+        barcodes = decode_frame(fast)
+    if barcodes or fast is gray:
+        return barcodes
+    with span("pyzbar_full"):
+        return decode_frame(gray)
+
+
+def first_barcode_value(barcodes):
+    return barcodes[0].data.decode("utf-8").strip() if barcodes else None
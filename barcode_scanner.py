@@ -1,45 +1,29 @@
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from db import SessionLocal
-from models import Product
-from sqlalchemy import select
-import cv2
-import numpy as np
-import base64
-from pyzbar.pyzbar import decode
+from reference_cache import REFERENCE
+from barcode_decode import read_image_bytes, decode_barcodes, first_barcode_value, ImagePayloadError
 
 app = Flask(__name__)
 CORS(app)
 
 @app.post("/scan-barcode-image")
 def scan_barcode_image():
-    """Receives a base64-encoded image, decodes the barcode, and checks DB."""
+    """Receives an image (raw, multipart or base64 JSON), decodes the barcode, and checks DB."""
     try:
-        data = request.get_json(force=True)
-        image_b64 = data.get("image")
+        try:
+            barcodes = decode_barcodes(read_image_bytes(request))
+        except ImagePayloadError as e:
+            return jsonify({"error": str(e)}), 400
 
-        if not image_b64:
-            return jsonify({"error": "No image data provided"}), 400
-
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-        # Detect barcodes
-        barcodes = decode(frame)
         if not barcodes:
             return jsonify({"success": False, "message": "No barcode detected"}), 404
 
         # Take first detected barcode
-        barcode_value = barcodes[0].data.decode("utf-8").strip()
+        barcode_value = first_barcode_value(barcodes)
 
-        # Check product in DB
-        db = SessionLocal()
-        product = db.execute(
-            select(Product).where(Product.product_barcode == barcode_value)
-        ).scalars().first()
-        db.close()
+        # Check product (cached; only hits the DB on a miss)
+        product = REFERENCE.get_product(barcode_value)
 
         if not product:
             return jsonify({
@@ -70,4 +54,4 @@ def health():
 
 if __name__ == "__main__":
     print("🚀 Flask backend running at http://127.0.0.1:6060")
-    app.run(host="0.0.0.0", port=6060, debug=True)
+    app.run(host="0.0.0.0", port=6060, debug=os.getenv("FLASK_DEBUG", "1") == "1")
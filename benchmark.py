@@ -0,0 +1,437 @@
+# benchmark.py
+# Reproducible load + latency benchmark for the scanner API.
+#
+#   python benchmark.py seed --db sqlite:///bench.db          # build a stand-in DB from database.csv
+#   python benchmark.py load --db sqlite:///bench.db -c 16 -d 30 -o run.json
+#   python benchmark.py micro -o micro.json                    # in-process hot functions
+#   python benchmark.py compare before.json after.json
+#
+# `load` starts app.py (or gunicorn with --server gunicorn) against --db,
+# drives a weighted mix of endpoints and reports throughput and p50/p95/p99
+# per endpoint as JSON. Point --db at a PostgreSQL URL to use a real server
+# (seed it first; seeding is idempotent only on an empty database).
+import argparse
+import csv
+import http.client
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime
+from policy_model import CLEANLINESS_WORDS  # database.csv uses words; the API a 1–10 scale
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(HERE, "database.csv")
+IMAGES = [os.path.join(HERE, "frame_capture.jpg"), os.path.join(HERE, "frame_debug.jpg")]
+
+# Synthetic guideline ladder seeded for every (airline, category, class)
+GUIDELINE_LADDER = [
+    # min_clean, seals, conditions, min_fill, action
+    (7, "sealed", "excellent|acceptable", 95, "Keep"),
+    (5, "sealed|resealed|opened", "excellent|acceptable", 60, "Refill"),
+    (3, "sealed|resealed|opened", "excellent|acceptable|poor", 30, "Replace"),
+]
+
+DEFAULT_MIX = {"check": 40, "register": 25, "scan": 15, "airlines": 20}
+
+
+def read_manifest(path=CSV_PATH):
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        return list(csv.DictReader(fh))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values), 3) if values else None,
+        "p50_ms": round(percentile(values, 50), 3) if values else None,
+        "p95_ms": round(percentile(values, 95), 3) if values else None,
+        "p99_ms": round(percentile(values, 99), 3) if values else None,
+        "max_ms": round(values[-1], 3) if values else None,
+    }
+
+
+# ───────────────────── SEED ─────────────────────
+
+def seed(db_url, csv_path=CSV_PATH):
+    """Create the schema and load airlines/products/guidelines/flights from the manifest."""
+    os.environ["DATABASE_URL"] = db_url
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from db import engine_options
+    from models import Base, Airline, Product, GuidelineTemplate, Flight
+
+    engine = create_engine(db_url, **engine_options(db_url))
+    Base.metadata.create_all(engine)
+    rows = read_manifest(csv_path)
+
+    with Session(engine) as db:
+        airlines = {}
+        for r in rows:
+            code = r["Customer_Code"]
+            if code not in airlines:
+                airlines[code] = Airline(airline_code=code, airline_name=r["Customer_Name"])
+        db.add_all(airlines.values())
+        db.flush()
+
+        products = {}
+        for r in rows:
+            products.setdefault(r["Bottle_ID"], Product(
+                product_barcode=r["Bottle_ID"],
+                product_name=r["Product_Name"],
+                category=r["Category"],
+                brand=r["Brand"],
+                bottle_size=r["Bottle_Size"],
+            ))
+        db.add_all(products.values())
+
+        keys = {(r["Customer_Code"], r["Category"], r["Service_Class"]) for r in rows}
+        for code, category, service_class in sorted(keys):
+            for min_clean, seals, conditions, min_fill, action in GUIDELINE_LADDER:
+                db.add(GuidelineTemplate(
+                    airline_id=airlines[code].airline_id,
+                    liquor_type=category,
+                    service_class=service_class,
+                    min_cleanliness_score=min_clean,
+                    allowed_seal_status=seals,
+                    allowed_bottle_condition=conditions,
+                    min_fill_level_threshold=min_fill,
+                    recommended_action=action,
+                    is_active=True,
+                ))
+
+        flights = {(r["Customer_Code"], r["Inbound_Flight"], r["Service_Class"]): r for r in rows}
+        for (code, number, service_class), r in flights.items():
+            db.add(Flight(
+                airline_id=airlines[code].airline_id,
+                flight_number=number,
+                origin=r["Origin"],
+                destination=r["Destination"],
+                flight_date=date.today(),
+                service_class=service_class,
+            ))
+        db.commit()
+
+    return {"airlines": len(airlines), "products": len(products),
+            "guidelines": len(keys) * len(GUIDELINE_LADDER), "flights": len(flights)}
+
+
+# ───────────────────── LOAD ─────────────────────
+
+class Scenario:
+    """Builds randomized but seeded requests from the manifest."""
+
+    def __init__(self, rows, rng):
+        self.rows = rows
+        self.rng = rng
+        self.images = [open(p, "rb").read() for p in IMAGES if os.path.exists(p)]
+
+    def request(self, kind):
+        r = self.rng.choice(self.rows)
+        if kind == "check":
+            barcode = r["Bottle_ID"] if self.rng.random() < 0.9 else f"MISS_{self.rng.randint(0, 999)}"
+            return "GET", f"/barcode/check/{barcode}", None, {}
+        if kind == "airlines":
+            return "GET", "/airlines", None, {}
+        if kind == "scan":
+            body = self.rng.choice(self.images)
+            return "POST", "/scan-barcode-image", body, {"Content-Type": "image/jpeg"}
+        if kind == "register":
+            payload = {
+                "barcode": r["Bottle_ID"],
+                "airline_code": r["Customer_Code"],
+                "flight_number": r["Inbound_Flight"],
+                "service_class": r["Service_Class"],
+                "origin": r["Origin"],
+                "destination": r["Destination"],
+                "flight_date": date.today().isoformat(),
+                "qualitative": {
+                    "fill_level": r["Fill_Level"],
+                    "seal_status": r["Seal_Status"],
+                    "cleanliness": CLEANLINESS_WORDS.get(r["Cleanliness_Score"].lower(), 5),
+                    "bottle_condition": r["Bottle_Condition"],
+                    "label_status": r["Label_Status"],
+                },
+            }
+            return "POST", "/barcode/register", json.dumps(payload).encode(), {"Content-Type": "application/json"}
+        raise ValueError(kind)
+
+
+def worker(host, port, scenario, kinds, weights, deadline, results, lock):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    local = {}
+    while time.perf_counter() < deadline:
+        kind = scenario.rng.choices(kinds, weights)[0]
+        method, path, body, headers = scenario.request(kind)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            ok = resp.status < 500
+        except Exception:
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        lat, errors = local.setdefault(kind, ([], [0]))
+        lat.append(elapsed)
+        if not ok:
+            errors[0] += 1
+    conn.close()
+    with lock:
+        for kind, (lat, errors) in local.items():
+            agg = results.setdefault(kind, ([], [0]))
+            agg[0].extend(lat)
+            agg[1][0] += errors[0]
+
+
+def wait_for_health(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection(host, port, timeout=2)
+        try:
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except Exception:
+            pass
+        finally:
+            conn.close()
+        # also back off on 5xx while the app warms up, not just on refused connections
+        time.sleep(0.2)
+    return False
+
+
+def start_server(db_url, port, server):
+    env = {**os.environ, "DATABASE_URL": db_url, "FLASK_DEBUG": "0", "PORT": str(port), "BIND": f"127.0.0.1:{port}"}
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_load(args):
+    mix = dict(DEFAULT_MIX)
+    for item in args.mix or []:
+        name, _, weight = item.partition("=")
+        mix[name] = int(weight)
+    kinds = [k for k, w in mix.items() if w > 0]
+    weights = [mix[k] for k in kinds]
+
+    proc = None
+    if not args.no_server:
+        proc = start_server(args.db, args.port, args.server)
+    try:
+        if not wait_for_health(args.host, args.port):
+            raise SystemExit("API did not become healthy")
+
+        rows = read_manifest()
+        results, lock = {}, threading.Lock()
+        # Warm caches so the measured window is steady state
+        warm = Scenario(rows, random.Random(args.seed))
+        for kind in kinds:
+            for _ in range(5):
+                worker(args.host, args.port, warm, [kind], [1], time.perf_counter() + 0.05, {}, lock)
+
+        deadline = time.perf_counter() + args.duration
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker, args=(
+                args.host, args.port, Scenario(rows, random.Random(args.seed + i)),
+                kinds, weights, deadline, results, lock))
+            for i in range(args.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    endpoints = {}
+    total = 0
+    for kind, (lat, errors) in sorted(results.items()):
+        total += len(lat)
+        endpoints[kind] = {**summarize(lat), "errors": errors[0], "rps": round(len(lat) / wall, 2)}
+    return {
+        "kind": "load",
+        "meta": meta(args, concurrency=args.concurrency, duration_s=args.duration, mix=mix, server=args.server),
+        "total_rps": round(total / wall, 2),
+        "endpoints": endpoints,
+    }
+
+
+# ───────────────────── MICRO ─────────────────────
+
+def time_calls(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def run_micro(args):
+    db_url = "sqlite:///" + os.path.join(HERE, ".bench_micro.db")
+    if os.path.exists(db_url[len("sqlite:///"):]):
+        os.remove(db_url[len("sqlite:///"):])
+    seed(db_url)
+
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    from models import Airline
+    from logic_evaluator import evaluate_action, GUIDELINES
+    from sla_engine import evaluate_sla
+
+    rows = read_manifest()
+    rng = random.Random(args.seed)
+    out = {}
+
+    engine = create_engine(db_url)
+    with Session(engine) as db:
+        airline_ids = {a.airline_code: a.airline_id for a in db.execute(select(Airline)).scalars()}
+        GUIDELINES.invalidate()
+        GUIDELINES.load(db)
+
+        def one_eval():
+            r = rng.choice(rows)
+            evaluate_action(
+                db,
+                airline_id=airline_ids[r["Customer_Code"]],
+                liquor_type=r["Category"],
+                service_class=r["Service_Class"],
+                fill_level=r["Fill_Level"].rstrip("%"),
+                cleanliness_score=CLEANLINESS_WORDS.get(r["Cleanliness_Score"].lower(), 5),
+                seal_status=r["Seal_Status"],
+                bottle_condition=r["Bottle_Condition"],
+            )
+        out["evaluate_action"] = time_calls(one_eval, args.iterations)
+
+    def one_sla():
+        r = rng.choice(rows)
+        evaluate_sla(r["Customer_Code"], r["SLA_Reuse_Policy"], r["Fill_Level"].rstrip("%"),
+                     r["Seal_Status"], r["Cleanliness_Score"])
+    out["evaluate_sla"] = time_calls(one_sla, args.iterations)
+
+    import cv2
+    import numpy as np
+    from pyzbar.pyzbar import decode
+    from barcode_decode import decode_barcodes
+    for path in IMAGES:
+        if not os.path.exists(path):
+            continue
+        data = open(path, "rb").read()
+        name = os.path.basename(path)
+        iterations = max(1, args.iterations // 100)
+        out[f"decode_fast_path[{name}]"] = time_calls(lambda: decode_barcodes(data), iterations)
+        out[f"decode_full_color[{name}]"] = time_calls(
+            lambda: decode(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)), iterations)
+
+    os.remove(db_url[len("sqlite:///"):])
+    return {"kind": "micro", "meta": meta(args, iterations=args.iterations), "functions": out}
+
+
+# ───────────────────── REPORTING ─────────────────────
+
+def meta(args, **extra):
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        **extra,
+    }
+
+
+def compare(before_path, after_path):
+    before = json.load(open(before_path))
+    after = json.load(open(after_path))
+    section = "endpoints" if after.get("kind") == "load" else "functions"
+    print(f"{'name':40} {'metric':8} {'before':>10} {'after':>10} {'change':>8}")
+    for name, stats in after.get(section, {}).items():
+        old = before.get(section, {}).get(name)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            if metric in stats and old.get(metric):
+                change = (stats[metric] - old[metric]) / old[metric] * 100
+                print(f"{name:40} {metric:8} {old[metric]:>10} {stats[metric]:>10} {change:>+7.1f}%")
+
+
+def emit(result, output):
+    text = json.dumps(result, indent=2)
+    if output:
+        with open(output, "w") as fh:
+            fh.write(text + "\n")
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scanner API benchmarks")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed for request mixes")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("seed", help="create and fill a stand-in database from database.csv")
+    p.add_argument("--db", default="sqlite:///bench.db")
+
+    p = sub.add_parser("load", help="HTTP load test")
+    p.add_argument("--db", default="sqlite:///bench.db")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=6060)
+    p.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    p.add_argument("--no-server", action="store_true", help="use an already running API")
+    p.add_argument("-c", "--concurrency", type=int, default=8)
+    p.add_argument("-d", "--duration", type=float, default=20)
+    p.add_argument("--mix", nargs="*", help="override weights, e.g. scan=0 register=50")
+    p.add_argument("-o", "--output")
+
+    p = sub.add_parser("micro", help="in-process microbenchmarks")
+    p.add_argument("-n", "--iterations", type=int, default=20000)
+    p.add_argument("-o", "--output")
+
+    p = sub.add_parser("compare", help="diff two result files")
+    p.add_argument("before")
+    p.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        print(json.dumps(seed(args.db)))
+    elif args.command == "load":
+        emit(run_load(args), args.output)
+    elif args.command == "micro":
+        emit(run_micro(args), args.output)
+    elif args.command == "compare":
+        compare(args.before, args.after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# bottle_analysis.py
+# One-photo analysis: the uploaded image is decoded once into a BGR ndarray.
+# On that same buffer we run
+#   - pyzbar (grayscale view, fast/full strategy from barcode_decode),
+#   - YOLO bottle detection on CPU: OpenCV DNN for an exported .onnx model,
+#     or ultralytics for a .pt checkpoint, and
+#   - a fill-level estimate from the liquid line inside the best bottle box.
+#
+# Export the ONNX model once with:  yolo export model=yolov8n.pt format=onnx
+import os
+import threading
+import cv2
+import numpy as np
+from barcode_decode import decode_array, ImagePayloadError
+from metrics import span
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOTTLE_MODEL = os.getenv(
+    "BOTTLE_MODEL",
+    os.path.join(HERE, "yolov8n.onnx") if os.path.exists(os.path.join(HERE, "yolov8n.onnx")) else "yolov8n.pt",
+)
+BOTTLE_CONF = float(os.getenv("BOTTLE_CONF", "0.35"))
+BOTTLE_IMGSZ = int(os.getenv("BOTTLE_IMGSZ", "640"))
+BOTTLE_NMS = 0.45
+COCO_BOTTLE = 39
+
+
+class DetectorUnavailable(RuntimeError):
+    """The bottle model could not be loaded (missing weights or backend)."""
+
+# Fraction of the box height taken by neck/cap; the fill scale is the body below it.
+FILL_NECK_FRACTION = float(os.getenv("FILL_NECK_FRACTION", "0.25"))
+FILL_MIN_CONFIDENCE = float(os.getenv("FILL_MIN_CONFIDENCE", "0.35"))
+
+
+def letterbox(img, size):
+    """Resize keeping aspect ratio onto a size x size canvas -> (canvas, scale, pad_x, pad_y)."""
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = round(h * scale), round(w * scale)
+    canvas = np.full((size, size, 3), 114, np.uint8)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    canvas[top:top + nh, left:left + nw] = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return canvas, scale, left, top
+
+
+class BottleDetector:
+    """
+    Lazily loaded, process-wide bottle detector. Neither backend is safe
+    for concurrent forward passes, so calls are serialized.
+    """
+
+    def __init__(self, weights=BOTTLE_MODEL, conf=BOTTLE_CONF, imgsz=BOTTLE_IMGSZ):
+        self.weights = weights
+        self.conf = conf
+        self.imgsz = imgsz
+        self._net = None
+        self._yolo = None
+        self._bottle_class = COCO_BOTTLE
+        self._lock = threading.Lock()
+        self.load_error = None  # remembered so a missing backend is not retried per request
+
+    @property
+    def backend(self):
+        return "onnx" if self.weights.lower().endswith(".onnx") else "ultralytics"
+
+    def _load(self):
+        if self._net is not None or self._yolo is not None:
+            return
+        if self.load_error is not None:
+            raise DetectorUnavailable(self.load_error)
+        try:
+            with span("bottle_model_load"):
+                if self.backend == "onnx":
+                    net = cv2.dnn.readNetFromONNX(self.weights)
+                    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+                    net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+                    self._net = net
+                else:
+                    from ultralytics import YOLO  # optional: only for .pt checkpoints
+                    yolo = YOLO(self.weights)
+                    self._bottle_class = next(i for i, n in yolo.names.items() if n == "bottle")
+                    self._yolo = yolo
+        except Exception as e:
+            self.load_error = f"{self.weights}: {type(e).__name__}: {e}"
+            raise DetectorUnavailable(self.load_error) from e
+
+    def detect(self, bgr):
+        """-> [{"box": [x1, y1, x2, y2], "conf": float}, ...] sorted by confidence."""
+        with self._lock:
+            self._load()
+            with span("bottle_detect"):
+                if self._net is not None:
+                    found = self._detect_onnx(bgr)
+                else:
+                    found = self._detect_ultralytics(bgr)
+        return sorted(found, key=lambda d: -d["conf"])
+
+    def _detect_onnx(self, bgr):
+        canvas, scale, pad_x, pad_y = letterbox(bgr, self.imgsz)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, (self.imgsz, self.imgsz), swapRB=True)
+        self._net.setInput(blob)
+        pred = self._net.forward()[0].T  # (anchors, 4 + classes): cx, cy, w, h, scores...
+        scores = pred[:, 4 + self._bottle_class]
+        keep = scores >= self.conf
+        if not keep.any():
+            return []
+        pred, scores = pred[keep], scores[keep]
+        xywh = np.stack([
+            (pred[:, 0] - pred[:, 2] / 2 - pad_x) / scale,
+            (pred[:, 1] - pred[:, 3] / 2 - pad_y) / scale,
+            pred[:, 2] / scale,
+            pred[:, 3] / scale,
+        ], axis=1)
+        h, w = bgr.shape[:2]
+        out = []
+        for i in np.asarray(cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), self.conf, BOTTLE_NMS)).flatten():
+            x, y, bw, bh = xywh[i]
+            out.append({
+                "box": [max(0, int(x)), max(0, int(y)), min(w, int(x + bw)), min(h, int(y + bh))],
+                "conf": round(float(scores[i]), 4),
+            })
+        return out
+
+    def _detect_ultralytics(self, bgr):
+        result = self._yolo(bgr, verbose=False, conf=self.conf, imgsz=self.imgsz,
+                            classes=[self._bottle_class])[0]
+        return [
+            {"box": [int(v) for v in box.xyxy[0]], "conf": round(float(box.conf[0]), 4)}
+            for box in result.boxes
+        ]
+
+
+def estimate_fill(bgr, box):
+    """
+    Image-based fill estimate inside a bottle box.
+
+    Takes the central vertical strip of the bottle and builds a per-row
+    "liquid-ness" profile (saturation minus brightness). The liquid line
+    is the strongest step in that profile below the neck. Fill is where
+    that line sits between the shoulder and the base, rounded to 5%.
+    Returns None when the box is too small or no clear line is found.
+    """
+    x1, y1, x2, y2 = box
+    h, w = y2 - y1, x2 - x1
+    if h < 40 or w < 10:
+        return None
+    strip = bgr[y1:y2, x1 + int(w * 0.3):x2 - int(w * 0.3)]
+    if strip.size == 0:
+        return None
+
+    hsv = cv2.cvtColor(strip, cv2.COLOR_BGR2HSV)
+    feature = hsv[..., 1].astype(np.float32) - hsv[..., 2].astype(np.float32)
+    profile = np.median(feature, axis=1)
+    k = max(3, h // 40)
+    profile = np.convolve(profile, np.ones(k, np.float32) / k, mode="same")
+
+    # positive where the rows below look more like liquid than the rows above
+    step = profile[k:] - profile[:-k]
+    top, bottom = int(h * FILL_NECK_FRACTION), int(h * 0.95)
+    search = step[top:bottom - k]
+    if search.size == 0:
+        return None
+    i = int(np.argmax(search))
+    strength = float(search[i])
+    confidence = float(np.clip(strength / (6 * (np.abs(step).mean() + 1e-6)), 0, 1))
+    if confidence < FILL_MIN_CONFIDENCE:
+        return {"fill_level": None, "confidence": round(confidence, 2), "message": "No liquid line found"}
+
+    level = top + i + k // 2
+    pct = float(np.clip((bottom - level) / (bottom - top) * 100, 0, 100))
+    pct = int(round(pct / 5) * 5)
+    return {
+        "fill_level": f"{pct}%",
+        "fill_percent": pct,
+        "confidence": round(confidence, 2),
+        "level_y": y1 + level,
+    }
+
+
+DETECTOR = BottleDetector()
+
+
+def analyze_image(image_bytes, detect=True, fill=True, detector=DETECTOR):
+    """
+    Encoded image bytes -> {"size", "barcodes", "bottles", "fill", "detector_error"}.
+    If the detector cannot load, "bottles" is None and "detector_error" says
+    why; the barcode result is still returned.
+    Raises ImagePayloadError if the bytes are not a decodable image.
+    """
+    buf = np.frombuffer(image_bytes, np.uint8)
+    with span("imdecode"):
+        bgr = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ImagePayloadError("Could not decode image")
+
+    with span("grayscale"):
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    barcodes = decode_array(gray)
+
+    bottles, detector_error = [], None
+    if detect:
+        try:
+            bottles = detector.detect(bgr)
+        except DetectorUnavailable as e:
+            bottles, detector_error = None, str(e)
+    estimate = None
+    if fill and bottles:
+        with span("fill_estimate"):
+            estimate = estimate_fill(bgr, bottles[0]["box"])
+
+    return {
+        "size": {"width": bgr.shape[1], "height": bgr.shape[0]},
+        "barcodes": [b.data.decode("utf-8").strip() for b in barcodes],
+        "bottles": bottles,
+        "fill": estimate,
+        "detector_error": detector_error,
+    }
@@ -1,54 +1,349 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
 import cv2
-from ultralytics import YOLO
 
-# 1️⃣ Load a pretrained YOLO model (has 'bottle' class)
-model = YOLO("yolov8n.pt")  # or yolov8s.pt for better accuracy
+# Pipelined YOLO bottle detector.
+#
+#   capture thread ──► frames queue ──► inference thread ──► results queue ──► render/emit (main thread)
+#
+# Rendering stays on the main thread because HighGUI windows must be
+# driven from the thread that created them.
+#
+# Live camera queues drop the oldest frame when full, so inference never
+# makes capture fall behind. File and directory sources block instead,
+# so every frame gets processed. Full detection runs every --detect-every
+# frames (optionally batched). In between, boxes are carried forward by a
+# small IoU tracker, or re-detected in a padded crop around the last boxes
+# (--roi).
+#
+#   python bottle_fill_detector.py                              # camera preview
+#   python bottle_fill_detector.py --source clip.mp4 --headless --output results.jsonl
+#   python bottle_fill_detector.py --source frames/ --headless --batch 4
 
-def main():
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+_STOP = object()
+
+
+def load_model(weights="yolov8n.pt"):
+    # 1️⃣ Load a pretrained YOLO model (has 'bottle' class)
+    from ultralytics import YOLO
+    return YOLO(weights)  # or yolov8s.pt for better accuracy
+
+
+class DropOldestQueue:
+    """Bounded queue; when full, put() discards the oldest item instead of blocking."""
+
+    def __init__(self, maxsize, drop=True):
+        self._q = queue.Queue(maxsize=maxsize)
+        self.drop = drop
+        self.dropped = 0
+
+    def put(self, item):
+        if not self.drop or item is _STOP:
+            self._q.put(item)
+            return
+        while True:
+            try:
+                self._q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._q.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self._q.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self._q.get_nowait()
+
+
+# ───────────────────── Sources ─────────────────────
+
+def open_source(source):
+    """-> (iterator of frames, is_live)"""
+    if os.path.isdir(source):
+        paths = sorted(p for p in glob.glob(os.path.join(source, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+        return (cv2.imread(p) for p in paths), False
+    if source.isdigit():
+        return _video_frames(int(source)), True
+    return _video_frames(source), False
+
+
+def _video_frames(source):
+    if isinstance(source, int) and os.name == "nt":
+        cap = cv2.VideoCapture(source, cv2.CAP_DSHOW)
+    else:
+        cap = cv2.VideoCapture(source)
     if not cap.isOpened():
-        print("❌ No se pudo abrir la cámara.")
+        print(f"❌ No se pudo abrir la fuente: {source}")
         return
+    if isinstance(source, int):
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                if isinstance(source, int):
+                    continue
+                break
+            yield frame
+    finally:
+        cap.release()
 
-    print("\n📸 Mostrando cámara (presiona 'q' para salir)...")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+def capture_loop(frames, out_q, stop):
+    for index, frame in enumerate(frames):
+        if stop.is_set():
+            break
+        if frame is None:
             continue
+        out_q.put((index, time.perf_counter(), frame))
+    out_q.put(_STOP)
 
-        # 2️⃣ Run YOLO detection on the frame
-        results = model(frame, verbose=False)
-        bottle_found = False
 
-        for box in results[0].boxes:
-            cls_id = int(box.cls)
-            cls_name = model.names[cls_id]
+# ───────────────────── Tracking ─────────────────────
 
-            if cls_name == "bottle":
-                bottle_found = True
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                conf = float(box.conf[0])
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class BoxTracker:
+    """Greedy IoU association so boxes keep stable ids between detections."""
 
-                # 3️⃣ Draw bounding box
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(frame, f"Bottle ({conf*100:.1f}%)", (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    def __init__(self, min_iou=0.3, max_missed=5):
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.tracks = {}  # id -> {"box", "conf", "missed"}
+        self._next_id = 1
 
-        if not bottle_found:
-            cv2.putText(frame, "No bottle detected", (20, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    def update(self, detections):
+        unmatched = set(self.tracks)
+        for box, conf in sorted(detections, key=lambda d: -d[1]):
+            best, best_iou = None, self.min_iou
+            for tid in unmatched:
+                overlap = iou(box, self.tracks[tid]["box"])
+                if overlap >= best_iou:
+                    best, best_iou = tid, overlap
+            if best is None:
+                best = self._next_id
+                self._next_id += 1
+            else:
+                unmatched.discard(best)
+            self.tracks[best] = {"box": box, "conf": conf, "missed": 0}
+        for tid in unmatched:
+            self.tracks[tid]["missed"] += 1
+            if self.tracks[tid]["missed"] > self.max_missed:
+                del self.tracks[tid]
+        return self.boxes()
 
-        # 4️⃣ Show result
-        cv2.imshow("YOLO Bottle Detector", frame)
+    def boxes(self):
+        return [{"id": tid, "box": t["box"], "conf": t["conf"]} for tid, t in self.tracks.items()]
 
-        # Press q to quit
-        if cv2.waitKey(1) & 0xFF == ord("q"):
+    def roi(self, shape, pad=0.25):
+        """Padded union of current boxes, or None."""
+        if not self.tracks:
+            return None
+        h, w = shape[:2]
+        x1 = min(t["box"][0] for t in self.tracks.values())
+        y1 = min(t["box"][1] for t in self.tracks.values())
+        x2 = max(t["box"][2] for t in self.tracks.values())
+        y2 = max(t["box"][3] for t in self.tracks.values())
+        px, py = int((x2 - x1) * pad), int((y2 - y1) * pad)
+        return max(0, x1 - px), max(0, y1 - py), min(w, x2 + px), min(h, y2 + py)
+
+
+# ───────────────────── Inference ─────────────────────
+
+class Detector:
+    def __init__(self, model, conf=0.35, imgsz=640, roi_imgsz=320):
+        self.model = model
+        self.conf = conf
+        self.imgsz = imgsz
+        self.roi_imgsz = roi_imgsz
+        self.bottle_class = next(i for i, n in model.names.items() if n == "bottle")
+
+    def detect(self, frames, imgsz=None, offset=(0, 0)):
+        """Batched YOLO over a list of frames -> list of [(box, conf), ...] per frame."""
+        # 2️⃣ Run YOLO detection only for the bottle class
+        results = self.model(frames, verbose=False, conf=self.conf, imgsz=imgsz or self.imgsz,
+                             classes=[self.bottle_class])
+        ox, oy = offset
+        out = []
+        for r in results:
+            dets = []
+            for box in r.boxes:
+                x1, y1, x2, y2 = map(int, box.xyxy[0])
+                dets.append(((x1 + ox, y1 + oy, x2 + ox, y2 + oy), float(box.conf[0])))
+            out.append(dets)
+        return out
+
+
+def inference_loop(detector, in_q, out_q, stop, detect_every=1, batch=1, roi=False):
+    tracker = BoxTracker()
+    since_detect = detect_every  # force a full detection on the first frame
+    done = False
+    while not done and not stop.is_set():
+        item = in_q.get()
+        if item is _STOP:
             break
 
-    cap.release()
-    cv2.destroyAllWindows()
-    print("📴 Cámara cerrada.")
+        # Full detection: gather up to `batch` already-queued frames
+        if since_detect >= detect_every or not tracker.tracks:
+            items = [item]
+            while len(items) < batch:
+                try:
+                    nxt = in_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    done = True
+                    break
+                items.append(nxt)
+            start = time.perf_counter()
+            detections = detector.detect([f for _, _, f in items])
+            infer_ms = (time.perf_counter() - start) * 1000 / len(items)
+            for (index, captured, frame), dets in zip(items, detections):
+                out_q.put((index, captured, frame, tracker.update(dets), "detect", infer_ms))
+            since_detect = 1
+            continue
+
+        index, captured, frame = item
+        since_detect += 1
+        region = tracker.roi(frame.shape) if roi else None
+        if region is not None:
+            x1, y1, x2, y2 = region
+            start = time.perf_counter()
+            dets = detector.detect([frame[y1:y2, x1:x2]], imgsz=detector.roi_imgsz, offset=(x1, y1))[0]
+            out_q.put((index, captured, frame, tracker.update(dets), "roi",
+                       (time.perf_counter() - start) * 1000))
+        else:
+            out_q.put((index, captured, frame, tracker.boxes(), "track", 0.0))
+    out_q.put(_STOP)
+
+
+# ───────────────────── Render / emit ─────────────────────
+
+def draw(frame, boxes):
+    if not boxes:
+        cv2.putText(frame, "No bottle detected", (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    for b in boxes:
+        x1, y1, x2, y2 = b["box"]
+        # 3️⃣ Draw bounding box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(frame, f"Bottle #{b['id']} ({b['conf']*100:.1f}%)", (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    return frame
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 2)
+
+
+def run(args):
+    frames, live = open_source(args.source)
+    detector = Detector(load_model(args.model), conf=args.conf, imgsz=args.imgsz)
+
+    stop = threading.Event()
+    frame_q = DropOldestQueue(args.queue_size, drop=live)
+    result_q = DropOldestQueue(args.queue_size, drop=live and not args.headless)
+    threads = [
+        threading.Thread(target=capture_loop, args=(frames, frame_q, stop), daemon=True),
+        threading.Thread(target=inference_loop, args=(detector, frame_q, result_q, stop),
+                         kwargs={"detect_every": args.detect_every, "batch": args.batch, "roi": args.roi},
+                         daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    out = open(args.output, "w") if args.output else (sys.stdout if args.headless else None)
+    latencies, modes = [], {}
+    processed = 0
+    started = time.perf_counter()
+    if not args.headless:
+        print("\n📸 Mostrando cámara (presiona 'q' para salir)...")
+
+    try:
+        while True:
+            item = result_q.get()
+            if item is _STOP:
+                break
+            index, captured, frame, boxes, mode, infer_ms = item
+            processed += 1
+            latency = (time.perf_counter() - captured) * 1000
+            latencies.append(latency)
+            modes[mode] = modes.get(mode, 0) + 1
+
+            if out is not None:
+                out.write(json.dumps({
+                    "frame": index, "mode": mode,
+                    "latency_ms": round(latency, 2), "inference_ms": round(infer_ms, 2),
+                    "bottles": [{"id": b["id"], "box": list(b["box"]), "conf": round(b["conf"], 3)} for b in boxes],
+                }) + "\n")
+
+            if not args.headless:
+                # 4️⃣ Show result
+                cv2.imshow("YOLO Bottle Detector", draw(frame, boxes))
+                # Press q to quit
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        elapsed = time.perf_counter() - started
+        stats = {
+            "frames": processed,
+            "fps": round(processed / elapsed, 2) if elapsed else None,
+            "latency_ms_p50": percentile(latencies, 50),
+            "latency_ms_p95": percentile(latencies, 95),
+            "modes": modes,
+            "dropped_capture": frame_q.dropped,
+            "dropped_render": result_q.dropped,
+        }
+        print(json.dumps({"stats": stats}), file=sys.stderr)
+        if out is not None and out is not sys.stdout:
+            out.close()
+        if not args.headless:
+            cv2.destroyAllWindows()
+            print("📴 Cámara cerrada.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pipelined YOLO bottle detector")
+    parser.add_argument("--source", default=os.getenv("CAMERA_INDEX", "0"),
+                        help="camera index, video file or image directory")
+    parser.add_argument("--model", default="yolov8n.pt")
+    parser.add_argument("--headless", action="store_true", help="no preview; emit JSON lines")
+    parser.add_argument("--output", help="write JSON lines here instead of stdout")
+    parser.add_argument("--detect-every", type=int, default=3, help="full detection every N frames")
+    parser.add_argument("--batch", type=int, default=1, help="frames per full-detection batch")
+    parser.add_argument("--roi", action="store_true", help="re-detect in a crop around tracked boxes between full detections")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--conf", type=float, default=0.35)
+    parser.add_argument("--queue-size", type=int, default=4)
+    return parser.parse_args(argv)
+
+
+def main():
+    run(parse_args())
+
 
 if __name__ == "__main__":
     main()
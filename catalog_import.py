@@ -0,0 +1,325 @@
+# catalog_import.py
+# Bulk import of products, airlines and guideline templates from CSV.
+#
+#   python catalog_import.py manifest database.csv        # airlines + products from a manifest
+#   python catalog_import.py products supplier_skus.csv
+#   python catalog_import.py airlines airlines.csv
+#   python catalog_import.py guidelines guidelines.csv
+#
+# The CSV is read as a stream. A BOM-prefixed header is handled, "90%"
+# becomes 90.00, allow-lists are lowercased and sorted into canonical
+# pipe-joined form, and qualitative cleanliness words map to scores. Rows
+# are deduped in memory on the natural key (last row wins), then COPYed
+# into an ON COMMIT DROP temp table. One statement upserts into the live
+# table, and it only touches rows whose values changed. Re-running the
+# same file is therefore a no-op, and the scan path never waits behind a
+# long lock: the write is one short transaction with lock_timeout set.
+#
+# Guidelines sync per (airline, liquor_type, service_class) present in the
+# file. Rows in the file are inserted or reactivated. Active rows for those
+# keys that are missing from the file are deactivated; they are never
+# deleted, because bottle_records reference them.
+#
+# Every API worker rebuilds its guideline index within GUIDELINE_CHECK_SECONDS
+# (it checks guideline_templates.updated_at; see logic_evaluator.py), and
+# picks up products and airlines after PRODUCT_CACHE_TTL / AIRLINE_TABLE_TTL.
+# POST /reference/invalidate only clears the worker that serves it, so it is
+# no shortcut under gunicorn; restart the workers if stale products for up to
+# the TTL are not acceptable.
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from db import engine
+from logic_evaluator import parse_allow_list
+from policy_model import CLEANLINESS_WORDS
+
+IMPORT_LOCK_TIMEOUT = os.getenv("IMPORT_LOCK_TIMEOUT", "2s")
+TRUE_WORDS = {"1", "true", "t", "yes", "y"}
+
+
+# ───────────────────── Normalization ─────────────────────
+
+class RowError(ValueError):
+    pass
+
+
+def text(value, limit):
+    value = (value or "").strip()
+    if not value:
+        raise RowError("empty value")
+    if len(value) > limit:
+        raise RowError(f"longer than {limit} characters: {value[:20]}…")
+    return value
+
+
+def percent(value):
+    """'90%' / '90' / '87.5 %' -> Decimal('90.00')"""
+    try:
+        number = Decimal((value or "").strip().rstrip("%").strip())
+    except InvalidOperation:
+        raise RowError(f"not a percentage: {value!r}")
+    if not 0 <= number <= 100:
+        raise RowError(f"percentage out of range: {value!r}")
+    return number.quantize(Decimal("0.01"))
+
+
+def allow_list(value, limit=100):
+    """'Sealed | Resealed|sealed' -> 'resealed|sealed'"""
+    canonical = "|".join(sorted(parse_allow_list(value)))
+    return text(canonical, limit)
+
+
+def cleanliness(value):
+    value = (value or "").strip()
+    if value.lower() in CLEANLINESS_WORDS:
+        return CLEANLINESS_WORDS[value.lower()]
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"not a cleanliness score: {value!r}")
+
+
+def flag(value):
+    return (value or "1").strip().lower() in TRUE_WORDS
+
+
+# target column -> (accepted header names, normalizer); headers match case-insensitively
+PRODUCT_FIELDS = {
+    "product_barcode": (("product_barcode", "barcode", "bottle_id"), lambda v: text(v, 50)),
+    "product_name": (("product_name", "name"), lambda v: text(v, 100)),
+    "category": (("category", "liquor_type"), lambda v: text(v, 50)),
+    "brand": (("brand",), lambda v: text(v, 50)),
+    "bottle_size": (("bottle_size", "size"), lambda v: text(v, 20)),
+}
+AIRLINE_FIELDS = {
+    "airline_code": (("airline_code", "customer_code", "code"), lambda v: text(v, 10).upper()),
+    "airline_name": (("airline_name", "customer_name", "name"), lambda v: text(v, 100)),
+}
+GUIDELINE_FIELDS = {
+    "airline_code": (("airline_code", "customer_code"), lambda v: text(v, 10).upper()),
+    "liquor_type": (("liquor_type", "category"), lambda v: text(v, 50)),
+    "service_class": (("service_class",), lambda v: text(v, 20)),
+    "min_cleanliness_score": (("min_cleanliness_score", "cleanliness_score"), cleanliness),
+    "allowed_seal_status": (("allowed_seal_status", "seal_status"), allow_list),
+    "allowed_bottle_condition": (("allowed_bottle_condition", "bottle_condition"), allow_list),
+    "min_fill_level_threshold": (("min_fill_level_threshold", "fill_level"), percent),
+    "recommended_action": (("recommended_action", "action"), lambda v: text(v, 20)),
+    "is_active": (("is_active", "active"), flag),
+}
+OPTIONAL = {"is_active"}
+
+
+def read_rows(path, fields, key):
+    """
+    Stream `path`, normalize each row into `fields` order and dedupe on `key`.
+    -> (rows by key, stats)
+    """
+    rows = {}
+    stats = {"read": 0, "rejected": 0, "errors": []}
+    with open(path, newline="", encoding="utf-8-sig") as fh:  # utf-8-sig drops the BOM
+        reader = csv.reader(fh)
+        header = [h.strip().lower() for h in next(reader)]
+        positions = {}
+        for column, (names, _) in fields.items():
+            found = next((header.index(n) for n in names if n in header), None)
+            if found is None and column not in OPTIONAL:
+                raise SystemExit(f"{path}: no column for {column} (expected one of {', '.join(names)})")
+            positions[column] = found
+
+        for line_no, raw in enumerate(reader, start=2):
+            if not any(raw):
+                continue
+            stats["read"] += 1
+            try:
+                row = tuple(
+                    normalize(raw[positions[c]] if positions[c] is not None and positions[c] < len(raw) else None)
+                    for c, (_, normalize) in fields.items()
+                )
+            except RowError as e:
+                stats["rejected"] += 1
+                if len(stats["errors"]) < 10:
+                    stats["errors"].append(f"line {line_no}: {e}")
+                continue
+            rows[key(row)] = row
+    stats["unique"] = len(rows)
+    return rows, stats
+
+
+# ───────────────────── Load ─────────────────────
+
+PRODUCTS_STAGE = """
+CREATE TEMP TABLE stg_products (
+    product_barcode varchar(50), product_name varchar(100), category varchar(50),
+    brand varchar(50), bottle_size varchar(20)
+) ON COMMIT DROP
+"""
+PRODUCTS_UPSERT = """
+WITH up AS (
+    INSERT INTO products AS p (product_barcode, product_name, category, brand, bottle_size)
+    SELECT product_barcode, product_name, category, brand, bottle_size FROM stg_products
+    ON CONFLICT (product_barcode) DO UPDATE SET
+        product_name = EXCLUDED.product_name, category = EXCLUDED.category,
+        brand = EXCLUDED.brand, bottle_size = EXCLUDED.bottle_size
+    WHERE (p.product_name, p.category, p.brand, p.bottle_size)
+          IS DISTINCT FROM (EXCLUDED.product_name, EXCLUDED.category, EXCLUDED.brand, EXCLUDED.bottle_size)
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM up
+"""
+
+AIRLINES_STAGE = """
+CREATE TEMP TABLE stg_airlines (airline_code varchar(10), airline_name varchar(100)) ON COMMIT DROP
+"""
+# airline_code has no unique constraint, so this is UPDATE + INSERT ... WHERE NOT EXISTS
+# in one statement (the import lock below keeps concurrent imports out).
+AIRLINES_UPSERT = """
+WITH updated AS (
+    UPDATE airlines a SET airline_name = s.airline_name
+    FROM stg_airlines s
+    WHERE a.airline_code = s.airline_code AND a.airline_name IS DISTINCT FROM s.airline_name
+    RETURNING a.airline_id
+), inserted AS (
+    INSERT INTO airlines (airline_code, airline_name)
+    SELECT s.airline_code, s.airline_name FROM stg_airlines s
+    WHERE NOT EXISTS (SELECT 1 FROM airlines a WHERE a.airline_code = s.airline_code)
+    RETURNING airline_id
+)
+SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM updated)
+"""
+
+GUIDELINES_STAGE = """
+CREATE TEMP TABLE stg_guidelines (
+    airline_code varchar(10), liquor_type varchar(50), service_class varchar(20),
+    min_cleanliness_score integer, allowed_seal_status varchar(100), allowed_bottle_condition varchar(100),
+    min_fill_level_threshold numeric(5, 2), recommended_action varchar(20), is_active boolean
+) ON COMMIT DROP
+"""
+GUIDELINE_MATCH = """
+    g.airline_id = src.airline_id AND g.liquor_type = src.liquor_type
+    AND g.service_class = src.service_class AND g.min_cleanliness_score = src.min_cleanliness_score
+    AND lower(g.allowed_seal_status) = src.allowed_seal_status
+    AND lower(g.allowed_bottle_condition) = src.allowed_bottle_condition
+    AND g.min_fill_level_threshold = src.min_fill_level_threshold
+    AND g.recommended_action = src.recommended_action
+"""
+GUIDELINES_UPSERT = f"""
+WITH src AS (
+    SELECT a.airline_id, s.*
+    FROM stg_guidelines s
+    JOIN (SELECT DISTINCT ON (airline_code) airline_code, airline_id
+          FROM airlines ORDER BY airline_code, airline_id) a USING (airline_code)
+), scope AS (
+    SELECT DISTINCT airline_id, liquor_type, service_class FROM src
+), deactivated AS (
+    UPDATE guideline_templates g SET is_active = false
+    FROM scope
+    WHERE g.airline_id = scope.airline_id AND g.liquor_type = scope.liquor_type
+      AND g.service_class = scope.service_class AND g.is_active
+      AND NOT EXISTS (SELECT 1 FROM src WHERE src.is_active AND {GUIDELINE_MATCH})
+    RETURNING g.guideline_id
+), reactivated AS (
+    UPDATE guideline_templates g SET is_active = true
+    FROM src
+    WHERE src.is_active AND g.is_active IS NOT TRUE AND {GUIDELINE_MATCH}
+    RETURNING g.guideline_id
+), inserted AS (
+    INSERT INTO guideline_templates (
+        airline_id, liquor_type, service_class, min_cleanliness_score, allowed_seal_status,
+        allowed_bottle_condition, min_fill_level_threshold, recommended_action, is_active)
+    SELECT src.airline_id, src.liquor_type, src.service_class, src.min_cleanliness_score,
+           src.allowed_seal_status, src.allowed_bottle_condition, src.min_fill_level_threshold,
+           src.recommended_action, src.is_active
+    FROM src
+    WHERE NOT EXISTS (SELECT 1 FROM guideline_templates g WHERE {GUIDELINE_MATCH})
+    RETURNING guideline_id
+)
+SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM reactivated),
+       (SELECT count(*) FROM deactivated),
+       (SELECT count(*) FROM stg_guidelines) - (SELECT count(*) FROM src)
+"""
+
+TABLES = {
+    "products": (PRODUCT_FIELDS, lambda r: r[0], "stg_products", PRODUCTS_STAGE, PRODUCTS_UPSERT,
+                 ("inserted", "updated")),
+    "airlines": (AIRLINE_FIELDS, lambda r: r[0], "stg_airlines", AIRLINES_STAGE, AIRLINES_UPSERT,
+                 ("inserted", "updated")),
+    "guidelines": (GUIDELINE_FIELDS, lambda r: r[:-1], "stg_guidelines", GUIDELINES_STAGE, GUIDELINES_UPSERT,
+                   ("inserted", "reactivated", "deactivated", "unknown_airline")),
+}
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY rows into `table` (psycopg2 copy_expert or psycopg 3 copy)."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cursor, "copy_expert"):
+        cursor.copy_expert(sql, buf)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buf.getvalue())
+
+
+def import_table(kind, path):
+    fields, key, stage_table, stage_sql, upsert_sql, outcome = TABLES[kind]
+    timings = {}
+    started = time.perf_counter()
+    rows, stats = read_rows(path, fields, key)
+    timings["parse"] = time.perf_counter() - started
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("catalog_import.py needs PostgreSQL (COPY); use `benchmark.py seed` for SQLite.")
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        # fail fast rather than queue behind / in front of scan traffic
+        cur.execute(f"SET LOCAL lock_timeout = '{IMPORT_LOCK_TIMEOUT}'")
+        cur.execute("SET LOCAL statement_timeout = 0")
+        # one import per table at a time (airlines has no unique key to conflict on)
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"catalog_import:{kind}",))
+        cur.execute(stage_sql)
+        t = time.perf_counter()
+        copy_rows(cur, stage_table, list(fields), rows.values())
+        timings["copy"] = time.perf_counter() - t
+        t = time.perf_counter()
+        cur.execute(upsert_sql)
+        counts = dict(zip(outcome, cur.fetchone()))
+        conn.commit()
+        timings["upsert"] = time.perf_counter() - t
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    timings["total"] = time.perf_counter() - started
+    return {
+        "table": kind,
+        "file": path,
+        **stats,
+        **counts,
+        "unchanged": stats["unique"] - counts.get("inserted", 0) - counts.get("updated", 0)
+                     - counts.get("reactivated", 0) - counts.get("unknown_airline", 0),
+        "seconds": {k: round(v, 3) for k, v in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="COPY-based import of products, airlines and guidelines")
+    parser.add_argument("kind", choices=["manifest", *TABLES], help="manifest = airlines + products")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    kinds = ["airlines", "products"] if args.kind == "manifest" else [args.kind]
+    for kind in kinds:
+        print(json.dumps(import_table(kind, args.path), ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
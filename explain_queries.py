@@ -0,0 +1,110 @@
+# explain_queries.py
+# Prints the PostgreSQL plan of every query the API issues, using real
+# sample values from the database, so missing indexes show up as Seq Scans.
+#
+#   python explain_queries.py              # EXPLAIN
+#   python explain_queries.py --analyze    # EXPLAIN ANALYZE (runs the queries)
+#   python explain_queries.py --fail-on-seqscan   # exit 1 if a Seq Scan appears
+import argparse
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, text
+from db import engine, SessionLocal
+from models import Airline, Product, Flight, GuidelineTemplate, BottleRecord, RecordSummary
+from analytics import summary_delta
+
+# Queries that read a whole table on purpose; a Seq Scan there is the right
+# plan, so --fail-on-seqscan ignores them.
+FULL_READS = {"active guidelines (index load)", "guideline change check"}
+
+
+def sample_values(db):
+    """Pick existing keys so the planner sees realistic selectivity."""
+    product = db.execute(select(Product.product_barcode).limit(1)).scalar() or "UNKNOWN"
+    airline = db.execute(select(Airline).limit(1)).scalars().first()
+    guideline = db.execute(select(GuidelineTemplate).limit(1)).scalars().first()
+    flight = db.execute(select(Flight).limit(1)).scalars().first()
+    return {
+        "barcode": product,
+        "airline_id": airline.airline_id if airline else 0,
+        "airline_code": airline.airline_code if airline else "XX",
+        "airline_name": airline.airline_name if airline else "Unknown",
+        "liquor_type": guideline.liquor_type if guideline else "Spirits",
+        "service_class": guideline.service_class if guideline else "Business",
+        "flight": flight,
+    }
+
+
+def app_queries(v):
+    flight = v["flight"]
+    since = datetime.utcnow() - timedelta(days=30)
+    return {
+        "product by barcode": select(Product).where(Product.product_barcode == v["barcode"]),
+        "products by barcode IN": select(Product).where(Product.product_barcode.in_([v["barcode"], "X1", "X2"])),
+        "airline by code": select(Airline).where(Airline.airline_code == v["airline_code"]),
+        "airline by lower(name)": select(Airline).where(func.lower(Airline.airline_name) == v["airline_name"].lower()),
+        "airline table": select(Airline),
+        "active guidelines (index load)": select(GuidelineTemplate).where(GuidelineTemplate.is_active == True),
+        "guideline change check": select(
+            func.max(GuidelineTemplate.updated_at), func.count()
+        ).select_from(GuidelineTemplate),
+        "guidelines by key": select(GuidelineTemplate).where(
+            GuidelineTemplate.airline_id == v["airline_id"],
+            GuidelineTemplate.liquor_type == v["liquor_type"],
+            GuidelineTemplate.service_class == v["service_class"],
+            GuidelineTemplate.is_active == True
+        ),
+        "flight by natural key": select(Flight).where(
+            Flight.airline_id == (flight.airline_id if flight else 0),
+            Flight.flight_number == (flight.flight_number if flight else "XX000"),
+            Flight.flight_date == (flight.flight_date if flight else since.date()),
+            Flight.service_class == (flight.service_class if flight else "Business")
+        ),
+        "bottle records by flight": select(BottleRecord).where(
+            BottleRecord.flight_id == (flight.flight_id if flight else 0)
+        ).order_by(BottleRecord.scan_timestamp),
+        "bottle records by airline + date range": select(BottleRecord).where(
+            BottleRecord.airline_id == v["airline_id"],
+            BottleRecord.scan_timestamp >= since
+        ).order_by(BottleRecord.scan_timestamp),
+        "bottle records by date range": select(BottleRecord).where(
+            BottleRecord.scan_timestamp >= since
+        ).order_by(BottleRecord.scan_timestamp).limit(500),
+        "analytics delta by record_id range": summary_delta(0, 100000),
+        "analytics keyset page": select(RecordSummary.scope_key).where(
+            RecordSummary.scope == "flight", RecordSummary.scope_key > "0"
+        ).group_by(RecordSummary.scope_key).order_by(RecordSummary.scope_key).limit(51),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print query plans for the API's queries.")
+    parser.add_argument("--analyze", action="store_true", help="use EXPLAIN ANALYZE")
+    parser.add_argument("--fail-on-seqscan", action="store_true",
+                        help="exit 1 if any plan scans bottle_records, flights or guideline_templates"
+                             " sequentially (whole-table reads in FULL_READS excepted)")
+    args = parser.parse_args()
+
+    prefix = "EXPLAIN (ANALYZE, BUFFERS)" if args.analyze else "EXPLAIN"
+    watched = ("bottle_records", "flights", "guideline_templates")
+    offenders = []
+
+    with SessionLocal() as db:
+        queries = app_queries(sample_values(db))
+        for name, stmt in queries.items():
+            sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[0] for row in db.execute(text(f"{prefix} {sql}"))]
+            print(f"── {name}")
+            print("\n".join(f"   {line}" for line in plan))
+            print()
+            if name not in FULL_READS and any("Seq Scan on" in line and any(t in line for t in watched) for line in plan):
+                offenders.append(name)
+
+    if offenders:
+        print("Sequential scans on large tables:", ", ".join(offenders))
+        if args.fail_on_seqscan:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# export_records.py
+# Streaming export of bottle_records joined with product, flight and airline
+# for audits, as CSV, NDJSON or Parquet, optionally gzip-compressed.
+#
+# Rows come off a server-side cursor (stream_results + yield_per) one chunk
+# at a time. Each chunk is encoded and yielded before the next is fetched,
+# so memory stays flat and the first bytes leave immediately. Parquet emits
+# one row group per chunk.
+#
+#   python export_records.py --airline EK --since 2025-01-01 --until 2025-02-01 -o ek_jan.csv.gz
+#   python export_records.py --format parquet -o all.parquet
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import select
+from db import engine
+from models import Airline, BottleRecord, Flight, Product
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# output column -> source column
+COLUMNS = {
+    "record_id": BottleRecord.record_id,
+    "scan_uuid": BottleRecord.scan_uuid,
+    "scan_timestamp": BottleRecord.scan_timestamp,
+    "airline_code": Airline.airline_code,
+    "flight_number": Flight.flight_number,
+    "flight_date": Flight.flight_date,
+    "service_class": Flight.service_class,
+    "origin": Flight.origin,
+    "destination": Flight.destination,
+    "product_barcode": BottleRecord.product_barcode,
+    "product_name": Product.product_name,
+    "brand": Product.brand,
+    "category": Product.category,
+    "bottle_size": Product.bottle_size,
+    "fill_level": BottleRecord.fill_level,
+    "seal_status": BottleRecord.seal_status,
+    "cleanliness_score": BottleRecord.cleanliness_score,
+    "label_status": BottleRecord.label_status,
+    "bottle_condition": BottleRecord.bottle_condition,
+    "recommended_action": BottleRecord.recommended_action,
+    "guideline_id": BottleRecord.guideline_id,
+    "notes": BottleRecord.notes,
+}
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+
+def export_query(airline_id=None, since=None, until=None):
+    stmt = (
+        select(*COLUMNS.values())
+        .join(Product, Product.product_barcode == BottleRecord.product_barcode)
+        .join(Flight, Flight.flight_id == BottleRecord.flight_id)
+        .join(Airline, Airline.airline_id == BottleRecord.airline_id)
+    )
+    if airline_id is not None:
+        stmt = stmt.where(BottleRecord.airline_id == airline_id)
+    if since:
+        stmt = stmt.where(BottleRecord.scan_timestamp >= since)
+    if until:
+        stmt = stmt.where(BottleRecord.scan_timestamp < until)
+    # (airline_id, scan_timestamp) / (scan_timestamp) indexes serve this order
+    return stmt.order_by(BottleRecord.scan_timestamp, BottleRecord.record_id)
+
+
+def stream_chunks(stmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of rows from a server-side cursor; the connection closes with the generator."""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt)
+        for rows in result.partitions():
+            yield rows
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows([_plain(v) for v in row] for row in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def encode_ndjson(chunks):
+    names = list(COLUMNS)
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(names, map(_plain, row))), separators=(",", ":")) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object for ParquetWriter whose contents we drain after each row group."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    types = {
+        "record_id": pa.int64(), "scan_timestamp": pa.timestamp("us"), "flight_date": pa.date32(),
+        "fill_level": pa.float64(), "cleanliness_score": pa.int32(), "guideline_id": pa.int64(),
+    }
+    return pa.schema([(name, types.get(name, pa.string())) for name in COLUMNS])
+
+
+def encode_parquet(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = [
+                pa.array([float(v) if v is not None else None for v in col] if field.name == "fill_level" else col,
+                         type=field.type)
+                for field, col in zip(schema, columns)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))  # one row group per chunk
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # footer
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "parquet": encode_parquet}
+# format -> optional module it needs
+REQUIRES = {"parquet": "pyarrow"}
+
+
+class FormatUnavailable(RuntimeError):
+    """The format's optional dependency is not installed."""
+
+
+def check_format(fmt):
+    """Fail before any bytes are sent rather than mid-stream."""
+    module = REQUIRES.get(fmt)
+    if module is None:
+        return
+    try:
+        __import__(module)
+    except ImportError:
+        raise FormatUnavailable(f"format {fmt!r} needs {module} (pip install {module})")
+
+
+def gzip_stream(parts, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(fmt="csv", airline_id=None, since=None, until=None, gzip=False, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Generator of encoded bytes for the requested export."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(ENCODERS)}")
+    check_format(fmt)
+    parts = ENCODERS[fmt](stream_chunks(export_query(airline_id, since, until), chunk_rows))
+    return gzip_stream(parts) if gzip else parts
+
+
+def export_filename(fmt, gzip=False, airline_code=None):
+    stem = f"bottle_records_{airline_code}" if airline_code else "bottle_records"
+    return stem + FORMATS[fmt][1] + (".gz" if gzip else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream bottle_records (joined) to CSV / NDJSON / Parquet")
+    parser.add_argument("--format", choices=list(ENCODERS), help="default: from --output's extension, else csv")
+    parser.add_argument("--airline", help="airline code")
+    parser.add_argument("--since", help="scan_timestamp >= this ISO date/time")
+    parser.add_argument("--until", help="scan_timestamp < this ISO date/time")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output (implied by a .gz output name)")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK_ROWS, help="rows per fetch / row group")
+    parser.add_argument("-o", "--output", help="file to write (default stdout)")
+    args = parser.parse_args()
+
+    gzip = args.gzip or (args.output or "").endswith(".gz")
+    fmt = args.format
+    if fmt is None:
+        name = (args.output or "").removesuffix(".gz")
+        fmt = next((f for f, (_, ext) in FORMATS.items() if name.endswith(ext)), "csv")
+
+    airline_id = None
+    if args.airline:
+        with engine.connect() as conn:
+            airline_id = conn.execute(
+                select(Airline.airline_id).where(Airline.airline_code == args.airline)
+            ).scalar()
+        if airline_id is None:
+            raise SystemExit(f"Unknown airline code {args.airline!r}")
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    until = datetime.fromisoformat(args.until) if args.until else None
+    try:
+        check_format(fmt)
+    except FormatUnavailable as e:
+        raise SystemExit(f"❌ {e}")
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    started = time.perf_counter()
+    written = 0
+    try:
+        for part in export_stream(fmt, airline_id, since, until, gzip, args.chunk):
+            out.write(part)
+            written += len(part)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"✅ {written:,} bytes ({fmt}{', gzip' if gzip else ''}) in {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# guideline_replay.py
+# What-if replay: how would past bottle_records have been classified under
+# draft guidelines that are not saved yet?
+#
+# Records in [since, until) are loaded off a server-side cursor into column
+# arrays. There is one numpy array each for fill level and cleanliness,
+# and integer codes for seal status, bottle condition and the
+# (airline, liquor type, service class) key. Rows are sorted by key, so
+# each key's rows are one contiguous slice. Each rule is then applied to
+# its slice as vectorized comparisons. Allow-list membership becomes a
+# boolean lookup table indexed by the category codes. Rules run in
+# GuidelineIndex order, and the first match wins, with the same DISCARD /
+# UNKNOWN fallbacks as logic_evaluator.match_rules.
+#
+# Drafts replace the active rules of every key they mention (as
+# catalog_import.py's guideline sync would); all other keys keep their
+# current rules. By default the baseline is the current active guideline
+# set. With baseline="recorded", it is the action stored on each record.
+#
+# Ranges of REPLAY_PARALLEL_DAYS or more are split into time slices. The
+# slices are loaded and evaluated in a process pool. Each process returns
+# only counts, so no arrays cross process boundaries.
+#
+#   python guideline_replay.py drafts.csv --since 2025-01-01 --until 2026-01-01
+#   python guideline_replay.py drafts.json --airline EK --baseline recorded
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from sqlalchemy import Float, cast, select
+from catalog_import import GUIDELINE_FIELDS, RowError, read_rows
+from db import SessionLocal, engine
+from logic_evaluator import GUIDELINES
+from models import BottleRecord, Flight, GuidelineTemplate, Product
+from reference_cache import REFERENCE
+
+REPLAY_CHUNK_ROWS = int(os.getenv("REPLAY_CHUNK_ROWS", "50000"))
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", str(min(8, os.cpu_count() or 1))))
+REPLAY_PARALLEL_DAYS = float(os.getenv("REPLAY_PARALLEL_DAYS", "31"))
+REPLAY_SAMPLE = 20
+BASELINES = ("current", "recorded")
+DISCARD, UNKNOWN = "DISCARD", "UNKNOWN"
+
+
+# ───────────────────── Rule sets ─────────────────────
+
+def current_index(db):
+    """Active guidelines compiled exactly as GUIDELINES would, without touching its cache."""
+    rows = db.execute(select(GuidelineTemplate).where(GuidelineTemplate.is_active == True)).scalars().all()
+    return GUIDELINES.build(rows)
+
+
+def normalize_draft(draft):
+    """JSON draft -> values in GUIDELINE_FIELDS order, normalized like a catalog_import CSV row."""
+    if not isinstance(draft, dict):
+        raise RowError("draft must be an object")
+    lowered = {str(k).strip().lower(): v for k, v in draft.items()}
+    row = []
+    for column, (names, normalize) in GUIDELINE_FIELDS.items():
+        value = next((lowered[n] for n in names if n in lowered), None)
+        try:
+            row.append(normalize(None if value is None else str(value)))
+        except RowError as e:
+            raise RowError(f"{column}: {e}")
+    return tuple(row)
+
+
+def draft_index(base, rows, db=None):
+    """Overlay normalized draft rows on `base`; every key present in `rows` is replaced outright."""
+    drafts, keys = [], set()
+    for row in rows:
+        values = dict(zip(GUIDELINE_FIELDS, row))
+        airline = REFERENCE.airline_by_code(values.pop("airline_code"), db)
+        if airline is None:
+            raise RowError(f"unknown airline code in draft: {row[0]!r}")
+        key = (airline.airline_id, values["liquor_type"], values["service_class"])
+        keys.add(key)
+        if values.pop("is_active"):
+            drafts.append(SimpleNamespace(guideline_id=None, airline_id=airline.airline_id, **values))
+    index = {k: rules for k, rules in base.items() if k not in keys}
+    index.update(GUIDELINES.build(drafts))
+    return index, keys
+
+
+# ───────────────────── Columnar load ─────────────────────
+
+def replay_query(since, until, airline_id=None):
+    stmt = (
+        select(
+            BottleRecord.record_id,
+            BottleRecord.airline_id,
+            Product.category,
+            Flight.service_class,
+            cast(BottleRecord.fill_level, Float),
+            BottleRecord.cleanliness_score,
+            BottleRecord.seal_status,
+            BottleRecord.bottle_condition,
+            BottleRecord.recommended_action,
+        )
+        .join(Product, Product.product_barcode == BottleRecord.product_barcode)
+        .join(Flight, Flight.flight_id == BottleRecord.flight_id)
+        .where(BottleRecord.scan_timestamp >= since, BottleRecord.scan_timestamp < until)
+    )
+    if airline_id is not None:
+        stmt = stmt.where(BottleRecord.airline_id == airline_id)
+    return stmt
+
+
+def _factorize(values, normalize=None):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    uniques = [normalize(u) if normalize else u for u in uniques]
+    return codes.astype(np.int32), uniques
+
+
+def _norm(value):
+    return (value or "").strip().lower()
+
+
+def load_columns(since, until, airline_id=None, chunk_rows=REPLAY_CHUNK_ROWS):
+    """
+    Records in [since, until) as column arrays sorted by guideline key.
+    `bounds[g]:bounds[g + 1]` is the slice of rows whose key is `keys[g]`.
+    """
+    parts = [[] for _ in range(9)]
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+            replay_query(since, until, airline_id)
+        )
+        for rows in result.partitions():
+            for part, column in zip(parts, zip(*rows)):
+                part.extend(column)
+    record_id, airline, category, service_class, fill, clean, seal, condition, recorded = parts
+
+    airline_codes, airlines = _factorize(airline)
+    category_codes, categories = _factorize(category)
+    class_codes, classes = _factorize(service_class)
+    combined = (airline_codes.astype(np.int64) * len(categories) + category_codes) * len(classes) + class_codes
+    group, combos = pd.factorize(combined)
+    keys = [
+        (airlines[c // (len(categories) * len(classes))], categories[(c // len(classes)) % len(categories)],
+         classes[c % len(classes)])
+        for c in combos
+    ]
+    order = np.argsort(group, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(group, minlength=len(keys)))))
+
+    seal_codes, seal_values = _factorize(seal, _norm)
+    condition_codes, condition_values = _factorize(condition, _norm)
+    recorded_codes, recorded_values = _factorize(recorded)
+    return SimpleNamespace(
+        rows=len(record_id),
+        record_id=np.asarray(record_id, dtype=np.int64)[order],
+        fill=np.asarray(fill, dtype=np.float64)[order],
+        clean=np.asarray(clean, dtype=np.int64)[order],
+        seal=seal_codes[order],
+        seal_values=seal_values,
+        condition=condition_codes[order],
+        condition_values=condition_values,
+        recorded=recorded_codes[order],
+        recorded_values=recorded_values,
+        keys=keys,
+        bounds=bounds,
+    )
+
+
+# ───────────────────── Vectorized evaluation ─────────────────────
+
+def _member(values, allowed):
+    return np.fromiter((v in allowed for v in values), dtype=bool, count=len(values))
+
+
+def evaluate_columns(cols, index, actions):
+    """
+    Action codes (into `actions`, extended in place) for every row under
+    `index`, matching logic_evaluator.match_rules rule for rule.
+    """
+    code = {a: i for i, a in enumerate(actions)}
+
+    def code_of(action):
+        if action not in code:
+            code[action] = len(actions)
+            actions.append(action)
+        return code[action]
+
+    out = np.full(cols.rows, code_of(UNKNOWN), dtype=np.int32)
+    discard = code_of(DISCARD)
+    for g, key in enumerate(cols.keys):
+        rules = index.get(key)
+        if not rules:
+            continue  # no guideline for this key -> UNKNOWN
+        lo, hi = cols.bounds[g], cols.bounds[g + 1]
+        fill, clean = cols.fill[lo:hi], cols.clean[lo:hi]
+        seal, condition = cols.seal[lo:hi], cols.condition[lo:hi]
+        result = np.full(hi - lo, discard, dtype=np.int32)
+        open_ = np.ones(hi - lo, dtype=bool)
+        for rule in rules:
+            hit = (
+                open_
+                & (clean >= rule.min_cleanliness_score)
+                & _member(cols.seal_values, rule.allowed_seal_status)[seal]
+                & _member(cols.condition_values, rule.allowed_bottle_condition)[condition]
+                & (fill >= rule.min_fill_level_threshold)
+            )
+            result[hit] = code_of(rule.recommended_action)
+            open_ &= ~hit
+            if not open_.any():
+                break
+        out[lo:hi] = result
+    return out
+
+
+def replay_slice(since, until, airline_id, base, draft, baseline):
+    """Load and evaluate one time slice; returns counts only."""
+    cols = load_columns(since, until, airline_id)
+    if baseline == "recorded":
+        old_actions = list(cols.recorded_values)
+        old = cols.recorded
+    else:
+        old_actions = []
+        old = evaluate_columns(cols, base, old_actions)
+    new_actions = []
+    new = evaluate_columns(cols, draft, new_actions)
+
+    width = max(len(new_actions), 1)
+    pairs = np.bincount(old.astype(np.int64) * width + new, minlength=len(old_actions) * width)
+    matrix = Counter()
+    for cell in np.flatnonzero(pairs):
+        matrix[(old_actions[cell // width], new_actions[cell % width])] = int(pairs[cell])
+
+    by_key = Counter()
+    samples = []
+    if not cols.rows:
+        return {"rows": 0, "matrix": matrix, "by_key": by_key, "samples": samples}
+    # old codes translated into the new vocabulary (-1: an action the drafts never produce)
+    new_code = {a: i for i, a in enumerate(new_actions)}
+    changed = np.array([new_code.get(a, -1) for a in old_actions], dtype=np.int64)[old] != new
+    if changed.any():
+        per_group = np.add.reduceat(changed.astype(np.int64), cols.bounds[:-1])
+        for g in np.flatnonzero(per_group):
+            by_key[cols.keys[g]] = int(per_group[g])
+        for i in np.flatnonzero(changed)[:REPLAY_SAMPLE]:
+            samples.append({
+                "record_id": int(cols.record_id[i]),
+                "from": old_actions[old[i]],
+                "to": new_actions[new[i]],
+            })
+    return {"rows": cols.rows, "matrix": matrix, "by_key": by_key, "samples": samples}
+
+
+def _slices(since, until, workers):
+    if workers <= 1 or until - since < timedelta(days=REPLAY_PARALLEL_DAYS):
+        return [(since, until)]
+    step = (until - since) / workers
+    edges = [since + step * i for i in range(workers)] + [until]
+    return list(zip(edges, edges[1:]))
+
+
+def replay(drafts, since, until, airline_id=None, baseline="current", workers=REPLAY_WORKERS):
+    """
+    Classify records scanned in [since, until) under the current rules (or
+    their recorded action) and under `drafts`. `drafts` are normalized rows
+    in GUIDELINE_FIELDS order (see normalize_draft / catalog_import.read_rows).
+    """
+    if baseline not in BASELINES:
+        raise ValueError(f"baseline must be one of {', '.join(BASELINES)}")
+    if until <= since:
+        raise ValueError("until must be after since")
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        base = current_index(db)
+        draft, keys = draft_index(base, drafts, db)
+
+    slices = _slices(since, until, workers)
+    args = [(lo, hi, airline_id, base, draft, baseline) for lo, hi in slices]
+    if len(slices) == 1:
+        parts = [replay_slice(*args[0])]
+    else:
+        # spawn: forking a threaded web worker can deadlock the child
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(len(slices), mp_context=context) as pool:
+            parts = list(pool.map(replay_slice, *zip(*args)))
+
+    matrix, by_key, samples, rows = Counter(), Counter(), [], 0
+    for part in parts:
+        rows += part["rows"]
+        matrix.update(part["matrix"])
+        by_key.update(part["by_key"])
+        samples.extend(part["samples"][:REPLAY_SAMPLE - len(samples)])
+
+    table = {}
+    for (old, new), count in sorted(matrix.items()):
+        table.setdefault(old, {})[new] = count
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "baseline": baseline,
+        "records": rows,
+        "changed": sum(c for (old, new), c in matrix.items() if old != new),
+        "matrix": table,
+        "draft_keys": [list(k) for k in sorted(keys, key=str)],
+        "changed_by_key": [
+            {"airline_id": k[0], "liquor_type": k[1], "service_class": k[2], "changed": c}
+            for k, c in by_key.most_common()
+        ],
+        "sample_changes": samples,
+        "slices": len(slices),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def load_drafts(path):
+    """Drafts from a guideline CSV (catalog_import format) or a JSON list."""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as fh:
+            return [normalize_draft(d) for d in json.load(fh)]
+    rows, stats = read_rows(path, GUIDELINE_FIELDS, key=lambda r: r[:-1])
+    if stats["rejected"]:
+        print(f"⚠️ {stats['rejected']} draft rows rejected: {stats['errors']}", file=sys.stderr)
+    return list(rows.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay draft guidelines against historical bottle_records")
+    parser.add_argument("drafts", help="guideline CSV (catalog_import format) or JSON list of drafts")
+    parser.add_argument("--since", help="scan_timestamp >= this ISO date/time (default: a year ago)")
+    parser.add_argument("--until", help="scan_timestamp < this ISO date/time (default: now)")
+    parser.add_argument("--airline", help="only this airline code's records")
+    parser.add_argument("--baseline", choices=BASELINES, default="current",
+                        help="compare against today's rules (default) or each record's stored action")
+    parser.add_argument("--workers", type=int, default=REPLAY_WORKERS)
+    args = parser.parse_args()
+
+    until = datetime.fromisoformat(args.until) if args.until else datetime.utcnow()
+    since = datetime.fromisoformat(args.since) if args.since else until - timedelta(days=365)
+    airline_id = None
+    if args.airline:
+        airline = REFERENCE.airline_by_code(args.airline)
+        if airline is None:
+            raise SystemExit(f"Unknown airline code {args.airline!r}")
+        airline_id = airline.airline_id
+    try:
+        result = replay(load_drafts(args.drafts), since, until, airline_id, args.baseline, args.workers)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+# gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:6060")
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+# gthread: threads share the worker's pool and caches; also serves /scan-stream WebSockets
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+timeout = int(os.getenv("WEB_TIMEOUT", "30"))
+graceful_timeout = 20
+keepalive = 5
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = 500
+# Import the app once in the master; workers fork from it
+preload_app = True
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+
+
+def post_fork(server, worker):
+    # The engine was created in the master; don't share its sockets.
+    from db import apply_statement_timeout, engine, reset_after_fork
+    reset_after_fork()
+    # every connection this worker opens from here on is a web connection
+    apply_statement_timeout(engine)
+
+
+def post_worker_init(worker):
+    from wsgi import warm_up
+    try:
+        warm_up()
+    except Exception:
+        worker.log.exception("Warm-up failed; continuing cold")
+
+
+def worker_exit(server, worker):
+    # Drain deferred registrations; whatever is left is replayed by the next worker.
+    from write_behind import WRITE_BEHIND
+    WRITE_BEHIND.stop(timeout=graceful_timeout / 2)
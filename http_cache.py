@@ -0,0 +1,147 @@
+# http_cache.py
+# Conditional HTTP caching for reference-data routes, plus a faster JSON
+# provider.
+#
+# Reference responses (/airlines, /barcode/check/<barcode>) are serialized
+# once per version of the underlying data. The ETag is a content hash, and
+# when the body is large, a gzip copy is kept next to it. A request whose
+# If-None-Match matches gets a bodyless 304. Any other request is served
+# straight from the precomputed bytes, with no dict building and no JSON
+# encoding. Each route sets its own Cache-Control.
+#
+# The gzip copy is a different representation, so it gets its own strong
+# ETag (the identity ETag with a "-gz" suffix).
+#
+# When orjson is installed, it backs jsonify for every route. Keys are
+# sorted, Decimal becomes a string and dates use the HTTP date format, as
+# with Flask's default provider. Unlike it, non-ASCII text is written as
+# UTF-8 rather than \u escapes, and there are no spaces after separators.
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date
+from decimal import Decimal
+from flask import Response, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+GZIP_MIN_BYTES = int(os.getenv("HTTP_GZIP_MIN_BYTES", "1024"))
+BODY_CACHE_SIZE = int(os.getenv("HTTP_BODY_CACHE_SIZE", "10000"))
+
+# endpoint -> Cache-Control
+CACHE_POLICIES = {
+    "list_airlines": os.getenv("CACHE_CONTROL_AIRLINES", "public, max-age=60, stale-while-revalidate=600"),
+    "check_barcode": os.getenv("CACHE_CONTROL_PRODUCTS", "public, max-age=300"),
+}
+DEFAULT_POLICY = "no-cache"
+
+CachedBody = namedtuple("CachedBody", ["body", "gzipped", "etag"])
+
+
+def _default(o):
+    # same conversions as Flask's default provider
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, Decimal):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+                            | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False,
+                      sort_keys=True).encode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify/get_json through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+
+
+def precompute(payload):
+    """Serialize once: body bytes, gzip copy (if large) and a strong content-hash ETag."""
+    body = dumps_bytes(payload)
+    gzipped = gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    return CachedBody(body, gzipped, etag)
+
+
+def cached_response(cached, status=200, cache_control=None):
+    """Serve a CachedBody honoring If-None-Match and Accept-Encoding."""
+    use_gzip = cached.gzipped is not None and "gzip" in request.accept_encodings
+    etag = cached.etag[:-1] + '-gz"' if use_gzip else cached.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control or CACHE_POLICIES.get(request.endpoint, DEFAULT_POLICY),
+        "Vary": "Accept-Encoding",
+    }
+    # If-None-Match uses weak comparison (RFC 9110 13.1.2); either encoding's
+    # tag means the client already has this content
+    if status == 200 and (request.if_none_match.contains_weak(cached.etag.strip('"'))
+                          or request.if_none_match.contains_weak(cached.etag.strip('"') + "-gz")):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(cached.gzipped, status=status, mimetype="application/json", headers=headers)
+    return Response(cached.body, status=status, mimetype="application/json", headers=headers)
+
+
+class BodyCache:
+    """
+    Precomputed bodies keyed by request key. An entry is reused while the
+    source object it was rendered from is unchanged (compared with ==), so
+    reference-cache reloads re-render automatically.
+    """
+
+    def __init__(self, maxsize=BODY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (source, CachedBody)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    def get(self, key, source, render):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is source or entry[0] == source):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        cached = precompute(render(source))
+        with self._lock:
+            self._data[key] = (source, cached)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self.renders += 1
+        return cached
+
+    def stats(self):
+        return {"entries": len(self._data), "hits": self.hits, "renders": self.renders}
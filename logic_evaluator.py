@@ -1,39 +1,153 @@
 # logic_evaluator.py
-from sqlalchemy import select
+import os
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import func, select
 from models import GuidelineTemplate
+from metrics import span
 
-def evaluate_action(db, *, airline_id, liquor_type, service_class,
-                    fill_level, cleanliness_score, seal_status, bottle_condition):
+# How often each worker checks guideline_templates for changes made
+# elsewhere (another worker's /guidelines/reload, catalog_import.py, SQL).
+GUIDELINE_CHECK_SECONDS = float(os.getenv("GUIDELINE_CHECK_SECONDS", "30"))
+
+# A guideline row reduced to what evaluation needs; allow-lists are pre-split.
+CompiledRule = namedtuple(
+    "CompiledRule",
+    ["guideline_id", "min_cleanliness_score", "allowed_seal_status",
+     "allowed_bottle_condition", "min_fill_level_threshold", "recommended_action"]
+)
+
+
+def parse_allow_list(value):
+    """'Sealed|Resealed' -> frozenset({'sealed', 'resealed'})"""
+    return frozenset(
+        part.strip().lower() for part in (value or "").split("|") if part.strip()
+    )
+
+
+def compile_rule(g):
+    return CompiledRule(
+        guideline_id=g.guideline_id,
+        min_cleanliness_score=int(g.min_cleanliness_score),
+        allowed_seal_status=parse_allow_list(g.allowed_seal_status),
+        allowed_bottle_condition=parse_allow_list(g.allowed_bottle_condition),
+        min_fill_level_threshold=float(g.min_fill_level_threshold),
+        recommended_action=g.recommended_action,
+    )
+
+
+class GuidelineIndex:
     """
-    Evaluate bottle inspection data against airline guidelines.
-    Cleanliness: 1–10 scale
-    Fill level: 0–100 scale
+    In-memory index of active guidelines keyed by
+    (airline_id, liquor_type, service_class). Each bucket is a tuple of
+    CompiledRule sorted by stricter fill threshold first.
+    Built lazily on first use and rebuilt after invalidate().
+
+    invalidate() only reaches this process. So every worker also compares
+    (max(updated_at), count(*)) of guideline_templates with the values seen
+    at load time, at most every check_seconds, and rebuilds on a change.
+    Migration 0006 keeps updated_at current for every writer.
     """
 
-    stmt = select(GuidelineTemplate).where(
-        GuidelineTemplate.airline_id == airline_id,
-        GuidelineTemplate.liquor_type == liquor_type,
-        GuidelineTemplate.service_class == service_class,
-        GuidelineTemplate.is_active == True
-    )
+    def __init__(self, check_seconds=GUIDELINE_CHECK_SECONDS):
+        self._index = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self.check_seconds = check_seconds
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self.refreshes = 0
 
-    rules = db.execute(stmt).scalars().all()
-    if not rules:
-        return {"action": "UNKNOWN", "reason": "No guideline found."}
+    @property
+    def version(self):
+        return self._version
 
-    # Normalize input
-    try:
-        fill_level = float(fill_level)
-        cleanliness_score = int(cleanliness_score)
-    except Exception:
-        return {"action": "ERROR", "reason": "Invalid numeric values."}
+    def invalidate(self):
+        """Drop the compiled index; the next lookup reloads it from the DB."""
+        with self._lock:
+            self._index = None
+            self._version += 1
+            return self._version
+
+    def build(self, rows):
+        buckets = {}
+        for g in rows:
+            key = (g.airline_id, g.liquor_type, g.service_class)
+            buckets.setdefault(key, []).append(compile_rule(g))
+        return {
+            key: tuple(sorted(rules, key=lambda r: r.min_fill_level_threshold, reverse=True))
+            for key, rules in buckets.items()
+        }
+
+    @staticmethod
+    def fingerprint(db):
+        return tuple(db.execute(
+            select(func.max(GuidelineTemplate.updated_at), func.count()).select_from(GuidelineTemplate)
+        ).one())
+
+    def load(self, db, attempts=3):
+        # An invalidate() that lands while we query and build means the rows
+        # may predate the change: only store the index if the version held,
+        # otherwise rebuild. If it keeps changing, serve this build uncached.
+        for _ in range(attempts):
+            version = self._version
+            with span("guideline_index_load"):
+                # read before the rows: a change in between shows up at the next check
+                fingerprint = self.fingerprint(db)
+                rows = db.execute(
+                    select(GuidelineTemplate).where(GuidelineTemplate.is_active == True)
+                ).scalars().all()
+                index = self.build(rows)
+            with self._lock:
+                if self._version == version:
+                    self._index = index
+                    self._fingerprint = fingerprint
+                    self._checked_at = time.monotonic()
+                    return index
+        return index
+
+    def _check(self, db):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now  # one thread per interval runs the query
+        try:
+            changed = self.fingerprint(db) != self._fingerprint
+        except Exception:
+            return  # keep serving the current rules; the next interval retries
+        if changed:
+            self.invalidate()
+            self.refreshes += 1
 
-    seal_status = (seal_status or "").lower()
-    bottle_condition = (bottle_condition or "").lower()
+    def rules_for(self, db, airline_id, liquor_type, service_class):
+        index = self._index
+        if index is not None and self.check_seconds > 0 \
+                and time.monotonic() - self._checked_at >= self.check_seconds:
+            self._check(db)
+            index = self._index
+        if index is None:
+            index = self.load(db)
+        return index.get((airline_id, liquor_type, service_class), ())
 
-    # Sort by stricter fill threshold first
-    rules = sorted(rules, key=lambda g: g.min_fill_level_threshold, reverse=True)
+    def stats(self):
+        index = self._index or {}
+        return {
+            "loaded": self._index is not None,
+            "version": self._version,
+            "check_seconds": self.check_seconds,
+            "refreshes": self.refreshes,
+            "keys": len(index),
+            "rules": sum(len(r) for r in index.values()),
+        }
 
+
+GUIDELINES = GuidelineIndex()
+
+
+def match_rules(rules, *, fill_level, cleanliness_score, seal_status, bottle_condition):
+    """Pure evaluation of already-normalized inputs against compiled rules."""
     for g in rules:
         if (
             cleanliness_score >= g.min_cleanliness_score
@@ -47,3 +161,43 @@ def evaluate_action(db, *, airline_id, liquor_type, service_class,
             }
 
     return {"action": "DISCARD", "reason": "No matching rule; discard enforced."}
+
+
+def evaluate_action(db, *, airline_id, liquor_type, service_class,
+                    fill_level, cleanliness_score, seal_status, bottle_condition):
+    """
+    Evaluate bottle inspection data against airline guidelines.
+    Cleanliness: 1–10 scale
+    Fill level: 0–100 scale
+    Guidelines come from the in-memory GUIDELINES index; `db` is only
+    used to (re)build it after startup or invalidation.
+    """
+
+    with span("evaluate_action"):
+        return _evaluate(
+            GUIDELINES.rules_for(db, airline_id, liquor_type, service_class),
+            fill_level, cleanliness_score, seal_status, bottle_condition
+        )
+
+
+def _evaluate(rules, fill_level, cleanliness_score, seal_status, bottle_condition):
+    if not rules:
+        return {"action": "UNKNOWN", "reason": "No guideline found."}
+
+    # Normalize input
+    try:
+        fill_level = float(fill_level)
+        cleanliness_score = int(cleanliness_score)
+    except Exception:
+        return {"action": "ERROR", "reason": "Invalid numeric values."}
+
+    seal_status = (seal_status or "").strip().lower()
+    bottle_condition = (bottle_condition or "").strip().lower()
+
+    return match_rules(
+        rules,
+        fill_level=fill_level,
+        cleanliness_score=cleanliness_score,
+        seal_status=seal_status,
+        bottle_condition=bottle_condition
+    )
@@ -1,12 +1,13 @@
 # main.py
 
-from barcode_scanner import load_database, get_bottle_info, scan_barcode
+from offline_catalog import load_database, get_bottle_info, scan_barcode
 from sla_engine import evaluate_sla
 
 def main():
     print("=== Sistema de Evaluación de Botellas (SLA-Vision con Cámara) ===\n")
 
-    df = load_database()
+    catalog = load_database()
+    print(f"📦 Catálogo offline: {len(catalog)} botellas")
 
     while True:
         print("\n--- NUEVA BOTELLA ---")
@@ -15,7 +16,7 @@ def main():
             print("⚠️ No se detectó ningún código. Intente nuevamente o presione Ctrl+C para salir.")
             continue
 
-        record = get_bottle_info(barcode, df)
+        record = get_bottle_info(barcode, catalog)
         if not record:
             print(f"❌ Código {barcode} no encontrado en la base de datos.\n")
             continue
@@ -0,0 +1,223 @@
+# metrics.py
+# Minimal in-process Prometheus-style metrics: counters, gauges, fixed-bucket
+# histograms and a `span()` timer for hot-path stages. Each observation is a
+# bisect plus a short lock, cheap enough to leave on in production.
+# Values are per process; under gunicorn each worker reports its own.
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+REGISTRY = []
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{k}="{v}"' for k, v in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            snapshot = list(self._values.items())
+        for labels, value in sorted(snapshot):
+            lines.append(f"{self.name}{_label_str(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _label_str(self.labelnames + ("le",), labels + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_str(self.labelnames + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            base = _label_str(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+def render_all():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ───────────────────── Application metrics ─────────────────────
+
+STAGE_SECONDS = Histogram("scanner_stage_seconds", "Time spent per hot-path stage.", ["stage"])
+REQUEST_SECONDS = Histogram("scanner_request_seconds", "HTTP request latency.", ["endpoint", "status"])
+REQUESTS_IN_FLIGHT = Gauge("scanner_requests_in_flight", "Requests currently being served.")
+DB_QUERY_SECONDS = Histogram("scanner_db_query_seconds", "Latency of individual SQL statements.")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "scanner_db_queries_per_request", "SQL statements issued per request.", ["endpoint"], COUNT_BUCKETS
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "scanner_db_seconds_per_request", "Total SQL time per request.", ["endpoint"]
+)
+POOL_CHECKOUT_WAIT = Histogram("scanner_db_pool_checkout_wait_seconds", "Time waiting for a pooled connection.")
+POOL_CHECKED_OUT = Gauge("scanner_db_pool_checked_out", "Connections currently checked out of the pool.")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# [query_count, query_seconds] for the current request, if one is being tracked
+_request_db = ContextVar("request_db", default=None)
+
+
+@contextmanager
+def span(stage):
+    """with span("pyzbar"): ...  -> scanner_stage_seconds{stage="pyzbar"}"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def begin_request():
+    REQUESTS_IN_FLIGHT.inc()
+    return _request_db.set([0, 0.0]), time.perf_counter()
+
+
+def end_request(token, started, endpoint, status):
+    """Records request latency and per-request SQL totals; returns (elapsed, db_seconds)."""
+    elapsed = time.perf_counter() - started
+    db = _request_db.get() or [0, 0.0]
+    try:
+        _request_db.reset(token)
+    except ValueError:  # token created in another context
+        _request_db.set(None)
+    REQUESTS_IN_FLIGHT.dec()
+    endpoint = endpoint or "unknown"
+    REQUEST_SECONDS.observe(elapsed, endpoint, str(status))
+    DB_QUERIES_PER_REQUEST.observe(db[0], endpoint)
+    DB_TIME_PER_REQUEST.observe(db[1], endpoint)
+    return elapsed, db[1]
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    """Time every statement and attribute it to the current request, if any."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.observe(elapsed)
+        db = _request_db.get()
+        if db is not None:
+            db[0] += 1
+            db[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def update_pool_gauges(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    if checkedout:
+        POOL_CHECKED_OUT.set(checkedout())
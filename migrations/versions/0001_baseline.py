@@ -0,0 +1,74 @@
+"""baseline schema (tables as originally declared in models.py)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "airlines",
+        sa.Column("airline_id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("airline_code", sa.String(10), nullable=False),
+        sa.Column("airline_name", sa.String(100), nullable=False),
+    )
+    op.create_table(
+        "products",
+        sa.Column("product_barcode", sa.String(50), primary_key=True),
+        sa.Column("product_name", sa.String(100), nullable=False),
+        sa.Column("category", sa.String(50), nullable=False),
+        sa.Column("brand", sa.String(50), nullable=False),
+        sa.Column("bottle_size", sa.String(20), nullable=False),
+    )
+    op.create_table(
+        "guideline_templates",
+        sa.Column("guideline_id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("airline_id", sa.Integer, sa.ForeignKey("airlines.airline_id"), nullable=False),
+        sa.Column("liquor_type", sa.String(50), nullable=False),
+        sa.Column("service_class", sa.String(20), nullable=False),
+        sa.Column("min_cleanliness_score", sa.Integer, nullable=False),
+        sa.Column("allowed_seal_status", sa.String(100), nullable=False),
+        sa.Column("allowed_bottle_condition", sa.String(100), nullable=False),
+        sa.Column("min_fill_level_threshold", sa.DECIMAL(5, 2), nullable=False),
+        sa.Column("recommended_action", sa.String(20), nullable=False),
+        sa.Column("is_active", sa.Boolean, default=True),
+    )
+    op.create_table(
+        "flights",
+        sa.Column("flight_id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("airline_id", sa.Integer, sa.ForeignKey("airlines.airline_id"), nullable=False),
+        sa.Column("flight_number", sa.String(20), nullable=False),
+        sa.Column("origin", sa.String(50), nullable=False),
+        sa.Column("destination", sa.String(50), nullable=False),
+        sa.Column("flight_date", sa.Date, nullable=False),
+        sa.Column("service_class", sa.String(20), nullable=False),
+    )
+    op.create_table(
+        "bottle_records",
+        sa.Column("record_id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("product_barcode", sa.String(50), sa.ForeignKey("products.product_barcode"), nullable=False),
+        sa.Column("airline_id", sa.Integer, sa.ForeignKey("airlines.airline_id"), nullable=False),
+        sa.Column("flight_id", sa.Integer, sa.ForeignKey("flights.flight_id"), nullable=False),
+        sa.Column("guideline_id", sa.Integer, sa.ForeignKey("guideline_templates.guideline_id")),
+        sa.Column("fill_level", sa.DECIMAL(5, 2), nullable=False),
+        sa.Column("seal_status", sa.String(50), nullable=False),
+        sa.Column("cleanliness_score", sa.Integer, nullable=False),
+        sa.Column("label_status", sa.String(50), nullable=False),
+        sa.Column("bottle_condition", sa.String(50), nullable=False),
+        sa.Column("recommended_action", sa.String(20), nullable=False),
+        sa.Column("scan_timestamp", sa.DateTime, nullable=False),
+        sa.Column("notes", sa.Text, nullable=True),
+    )
+
+
+def downgrade():
+    for table in ("bottle_records", "flights", "guideline_templates", "products", "airlines"):
+        op.drop_table(table)
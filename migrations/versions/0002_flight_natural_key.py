@@ -0,0 +1,48 @@
+"""unique natural key on flights
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+NATURAL_KEY = ["airline_id", "flight_number", "flight_date", "service_class"]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        # Collapse duplicates created by the old racy SELECT-then-INSERT:
+        # keep the lowest flight_id per key and repoint its bottle records.
+        op.execute("""
+            WITH ranked AS (
+                SELECT flight_id,
+                       min(flight_id) OVER (PARTITION BY airline_id, flight_number,
+                                                         flight_date, service_class) AS keep_id
+                FROM flights
+            )
+            UPDATE bottle_records br
+            SET flight_id = ranked.keep_id
+            FROM ranked
+            WHERE br.flight_id = ranked.flight_id AND ranked.flight_id <> ranked.keep_id
+        """)
+        op.execute("""
+            DELETE FROM flights f
+            USING flights k
+            WHERE f.airline_id = k.airline_id
+              AND f.flight_number = k.flight_number
+              AND f.flight_date = k.flight_date
+              AND f.service_class = k.service_class
+              AND f.flight_id > k.flight_id
+        """)
+    with op.batch_alter_table("flights") as batch:
+        batch.create_unique_constraint("uq_flights_natural_key", NATURAL_KEY)
+
+
+def downgrade():
+    with op.batch_alter_table("flights") as batch:
+        batch.drop_constraint("uq_flights_natural_key", type_="unique")
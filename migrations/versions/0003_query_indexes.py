@@ -0,0 +1,48 @@
+"""indexes for the app's query paths
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+On PostgreSQL the indexes are built CONCURRENTLY so bottle_records stays
+writable while they build. Check them with `python explain_queries.py`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# name -> (table, columns/expressions, extra kwargs)
+INDEXES = {
+    "ix_airlines_airline_code": ("airlines", ["airline_code"], {}),
+    "ix_airlines_lower_name": ("airlines", [sa.text("lower(airline_name)")], {}),
+    "ix_guideline_templates_lookup": (
+        "guideline_templates", ["airline_id", "liquor_type", "service_class"],
+        {"postgresql_where": sa.text("is_active"), "sqlite_where": sa.text("is_active")},
+    ),
+    "ix_bottle_records_flight_scan": ("bottle_records", ["flight_id", "scan_timestamp"], {}),
+    "ix_bottle_records_airline_scan": ("bottle_records", ["airline_id", "scan_timestamp"], {}),
+    "ix_bottle_records_scan_timestamp": ("bottle_records", ["scan_timestamp"], {}),
+    "ix_bottle_records_product_barcode": ("bottle_records", ["product_barcode"], {}),
+    "ix_bottle_records_guideline_id": ("bottle_records", ["guideline_id"], {}),
+}
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    if postgres:
+        with op.get_context().autocommit_block():
+            for name, (table, columns, kwargs) in INDEXES.items():
+                op.create_index(name, table, columns, postgresql_concurrently=True,
+                                if_not_exists=True, **kwargs)
+    else:
+        for name, (table, columns, kwargs) in INDEXES.items():
+            op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade():
+    for name, (table, _, _) in INDEXES.items():
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,32 @@
+"""client-visible scan_uuid on bottle_records
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Write-behind registration hands the scanner a UUID before the row exists,
+and the flusher inserts with ON CONFLICT (scan_uuid) DO NOTHING so a
+replayed journal never duplicates records. Existing rows stay NULL.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("bottle_records", sa.Column("scan_uuid", sa.String(36), nullable=True))
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.create_index("uq_bottle_records_scan_uuid", "bottle_records", ["scan_uuid"], unique=True,
+                            postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.create_index("uq_bottle_records_scan_uuid", "bottle_records", ["scan_uuid"], unique=True)
+
+
+def downgrade():
+    op.drop_index("uq_bottle_records_scan_uuid", table_name="bottle_records")
+    op.drop_column("bottle_records", "scan_uuid")
@@ -0,0 +1,40 @@
+"""analytics summary tables
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+Empty at creation; `python analytics.py refresh --no-settle` backfills
+them from bottle_records in record_id chunks.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "bottle_record_summaries",
+        sa.Column("scope", sa.String(10), primary_key=True),
+        sa.Column("scope_key", sa.String(50), primary_key=True),
+        sa.Column("recommended_action", sa.String(20), primary_key=True),
+        sa.Column("cleanliness_score", sa.Integer, primary_key=True),
+        sa.Column("record_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("fill_level_sum", sa.DECIMAL(18, 2), nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "summary_watermarks",
+        sa.Column("name", sa.String(50), primary_key=True),
+        sa.Column("last_record_id", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("pending_record_id", sa.Integer, nullable=True),
+        sa.Column("pending_since", sa.DateTime, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("summary_watermarks")
+    op.drop_table("bottle_record_summaries")
@@ -0,0 +1,59 @@
+"""updated_at on the replicated reference tables
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+Station replicas (station_sync.py) pull products, airlines and guideline
+templates incrementally with WHERE updated_at > <last seen>. On PostgreSQL
+a BEFORE UPDATE trigger keeps the column current for every writer,
+including catalog_import.py's set-based SQL, which bypasses the ORM.
+Existing rows get the migration time.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+TABLES = ("airlines", "products", "guideline_templates")
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for table in TABLES:
+        # now() is stable, so PostgreSQL 11+ adds this without rewriting the table
+        op.add_column(table, sa.Column("updated_at", sa.DateTime, nullable=False,
+                                       server_default=sa.func.now()))
+    if postgres:
+        op.execute("""
+            CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+            BEGIN
+                NEW.updated_at := now();
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        for table in TABLES:
+            op.execute(f"CREATE TRIGGER {table}_touch_updated_at BEFORE UPDATE ON {table} "
+                       f"FOR EACH ROW EXECUTE FUNCTION touch_updated_at()")
+        with op.get_context().autocommit_block():
+            for table in TABLES:
+                op.create_index(f"ix_{table}_updated_at", table, ["updated_at"],
+                                postgresql_concurrently=True, if_not_exists=True)
+    else:
+        for table in TABLES:
+            op.create_index(f"ix_{table}_updated_at", table, ["updated_at"])
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_updated_at", table_name=table)
+        if postgres:
+            op.execute(f"DROP TRIGGER IF EXISTS {table}_touch_updated_at ON {table}")
+        op.drop_column(table, "updated_at")
+    if postgres:
+        op.execute("DROP FUNCTION IF EXISTS touch_updated_at()")
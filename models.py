@@ -1,6 +1,7 @@
 # models.py
 from sqlalchemy import (
-    Column, Integer, String, Boolean, Date, DateTime, DECIMAL, ForeignKey, Text
+    Column, Integer, String, Boolean, Date, DateTime, DECIMAL, ForeignKey, Text, UniqueConstraint,
+    Index, func, text
 )
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
@@ -13,6 +14,14 @@ class Airline(Base):
     airline_id = Column(Integer, primary_key=True, autoincrement=True)
     airline_code = Column(String(10), nullable=False)
     airline_name = Column(String(100), nullable=False)
+    # Bumped on every write (trigger on PostgreSQL); stations pull changes by it
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_airlines_airline_code", airline_code),
+        Index("ix_airlines_lower_name", func.lower(airline_name)),
+        Index("ix_airlines_updated_at", updated_at),
+    )
 
     def __repr__(self):
         return f"<Airline(code={self.airline_code}, name={self.airline_name})>"
@@ -26,6 +35,11 @@ class Product(Base):
     category = Column(String(50), nullable=False)  # liquor type: Whiskey, Vodka, Wine, etc.
     brand = Column(String(50), nullable=False)
     bottle_size = Column(String(20), nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_products_updated_at", updated_at),
+    )
 
     def __repr__(self):
         return f"<Product(name={self.product_name}, category={self.category})>"
@@ -44,6 +58,13 @@ class GuidelineTemplate(Base):
     min_fill_level_threshold = Column(DECIMAL(5, 2), nullable=False)  # e.g. 75.0
     recommended_action = Column(String(20), nullable=False)  # e.g. "Keep", "Refill", "Discard"
     is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_guideline_templates_lookup", airline_id, liquor_type, service_class,
+              postgresql_where=text("is_active"), sqlite_where=text("is_active")),
+        Index("ix_guideline_templates_updated_at", updated_at),
+    )
 
     airline = relationship("Airline")
 
@@ -57,6 +78,11 @@ class GuidelineTemplate(Base):
 # ───────────────────── FLIGHTS ─────────────────────
 class Flight(Base):
     __tablename__ = "flights"
+    __table_args__ = (
+        # Natural key; get_or_create_flight upserts against it
+        UniqueConstraint("airline_id", "flight_number", "flight_date", "service_class",
+                         name="uq_flights_natural_key"),
+    )
     flight_id = Column(Integer, primary_key=True, autoincrement=True)
     airline_id = Column(Integer, ForeignKey("airlines.airline_id"), nullable=False)
     flight_number = Column(String(20), nullable=False)
@@ -87,6 +113,19 @@ class BottleRecord(Base):
     recommended_action = Column(String(20), nullable=False)
     scan_timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
     notes = Column(Text, nullable=True)
+    # Client-visible id assigned before the row is written (write-behind / offline replay key)
+    scan_uuid = Column(String(36), nullable=True)
+
+    __table_args__ = (
+        Index("ix_bottle_records_flight_scan", flight_id, scan_timestamp),
+        Index("ix_bottle_records_airline_scan", airline_id, scan_timestamp),
+        Index("ix_bottle_records_scan_timestamp", scan_timestamp),
+        Index("ix_bottle_records_product_barcode", product_barcode),
+        Index("ix_bottle_records_guideline_id", guideline_id),
+        Index("uq_bottle_records_scan_uuid", scan_uuid, unique=True),
+        # station replicas prune pushed rows; never hand out a record_id twice
+        {"sqlite_autoincrement": True},
+    )
 
     product = relationship("Product")
     airline = relationship("Airline")
@@ -99,3 +138,35 @@ class BottleRecord(Base):
             f"action={self.recommended_action}, "
             f"condition={self.bottle_condition})>"
         )
+
+
+# ───────────────────── ANALYTICS SUMMARIES ─────────────────────
+class RecordSummary(Base):
+    """
+    Pre-aggregated bottle_records, maintained by analytics.refresh_summaries.
+    One row per (scope, key, action, cleanliness score); per-scope reports
+    fold a few dozen of these instead of scanning bottle_records.
+    """
+    __tablename__ = "bottle_record_summaries"
+    scope = Column(String(10), primary_key=True)  # "flight" | "airline" | "product"
+    scope_key = Column(String(50), primary_key=True)  # flight_id / airline_id / product_barcode
+    recommended_action = Column(String(20), primary_key=True)
+    cleanliness_score = Column(Integer, primary_key=True)
+    record_count = Column(Integer, nullable=False, default=0)
+    fill_level_sum = Column(DECIMAL(18, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return (
+            f"<RecordSummary({self.scope}={self.scope_key}, action={self.recommended_action}, "
+            f"count={self.record_count})>"
+        )
+
+
+class SummaryWatermark(Base):
+    """High-water mark on bottle_records.record_id for each incrementally maintained summary."""
+    __tablename__ = "summary_watermarks"
+    name = Column(String(50), primary_key=True)
+    last_record_id = Column(Integer, nullable=False, default=0)
+    # max(record_id) seen at pending_since; applied once it has settled
+    pending_record_id = Column(Integer, nullable=True)
+    pending_since = Column(DateTime, nullable=True)
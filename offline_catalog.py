@@ -0,0 +1,170 @@
+# offline_catalog.py
+# Offline station backend for main.py: barcode -> manifest row lookups
+# from database.csv without pandas or a database, plus a continuous camera
+# scanner.
+#
+# The CSV is compiled once into a columnar pickle next to it
+# (database.csv.idx): a tuple of columns plus a dict {Bottle_ID: row}.
+# The index is rebuilt only when the CSV's size or mtime changes, so a warm
+# start costs one file read and one unpickle.
+import csv
+import os
+import pickle
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.getenv("CATALOG_CSV", os.path.join(HERE, "database.csv"))
+BARCODE_COLUMN = "Bottle_ID"
+INDEX_FORMAT = 1
+
+
+class Catalog:
+    def __init__(self, columns, data, index):
+        self.columns = columns  # column names
+        self.data = data        # tuple of per-column tuples
+        self.index = index      # barcode -> row number
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, barcode):
+        row = self.index.get((barcode or "").strip())
+        if row is None:
+            return None
+        return {name: col[row] for name, col in zip(self.columns, self.data)}
+
+
+def _signature(path):
+    st = os.stat(path)
+    return (INDEX_FORMAT, st.st_size, st.st_mtime_ns)
+
+
+def build_index(csv_path=CSV_PATH):
+    with open(csv_path, newline="", encoding="utf-8-sig") as fh:
+        reader = csv.reader(fh)
+        columns = tuple(h.strip() for h in next(reader))
+        rows = [r for r in reader if r]
+    key = columns.index(BARCODE_COLUMN)
+    data = tuple(tuple(r[i] if i < len(r) else "" for r in rows) for i in range(len(columns)))
+    # later rows win for repeated barcodes
+    index = {r[key].strip(): n for n, r in enumerate(rows)}
+    return Catalog(columns, data, index)
+
+
+def load_database(csv_path=CSV_PATH, index_path=None):
+    """Return the Catalog for `csv_path`, reusing the on-disk index when it is current."""
+    index_path = index_path or csv_path + ".idx"
+    signature = _signature(csv_path)
+    try:
+        with open(index_path, "rb") as fh:
+            cached_signature, columns, data, index = pickle.load(fh)
+        if cached_signature == signature:
+            return Catalog(columns, data, index)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    catalog = build_index(csv_path)
+    tmp = index_path + ".tmp"
+    try:
+        with open(tmp, "wb") as fh:
+            pickle.dump((signature, catalog.columns, catalog.data, catalog.index), fh,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, index_path)
+    except OSError:
+        pass  # read-only checkout: still works, just rebuilds next time
+    return catalog
+
+
+def get_bottle_info(barcode, catalog):
+    """Manifest row for `barcode` as a dict, or None."""
+    return catalog.get(barcode)
+
+
+# ───────────────────── Camera ─────────────────────
+
+class CameraScanner:
+    """
+    Keeps the camera open and reads frames continuously until a barcode
+    decodes. The last reported barcode is only reported again after it has
+    been out of view for `clear_frames` consecutive frames, so a bottle left
+    in front of the camera while the operator answers prompts isn't scanned
+    twice.
+    """
+
+    def __init__(self, camera_index=None, clear_frames=5, max_failures=50, reopen_after=10):
+        self.camera_index = int(os.getenv("CAMERA_INDEX", "0")) if camera_index is None else camera_index
+        self.clear_frames = clear_frames
+        self.max_failures = max_failures  # consecutive failed reads before giving up
+        self.reopen_after = reopen_after  # consecutive failed reads before reopening the device
+        self._cap = None
+        self._last = None
+
+    def _open(self):
+        import cv2
+        if self._cap is None or not self._cap.isOpened():
+            self._cap = cv2.VideoCapture(self.camera_index)
+            # keep latency low: don't let stale frames queue up in the driver
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return self._cap
+
+    def _flush(self, cap, frames=5):
+        """Drop frames buffered while nobody was reading (e.g. during input())."""
+        for _ in range(frames):
+            if not cap.grab():
+                break
+
+    def scan(self, timeout=None):
+        """Block until a new barcode is seen, `timeout` seconds pass, or the camera keeps failing."""
+        import cv2
+        from pyzbar.pyzbar import decode
+
+        cap = self._open()
+        if not cap.isOpened():
+            print("❌ No se pudo abrir la cámara.")
+            return None
+        self._flush(cap)
+        deadline = time.monotonic() + timeout if timeout else None
+        failures = 0
+        absent = 0  # consecutive frames without the last reported barcode
+        while deadline is None or time.monotonic() < deadline:
+            ok, frame = cap.read()
+            if not ok:
+                failures += 1
+                if failures >= self.max_failures:
+                    print("❌ La cámara dejó de entregar imágenes.")
+                    return None
+                if failures % self.reopen_after == 0:
+                    self.close()
+                    cap = self._open()
+                time.sleep(0.05)
+                continue
+            failures = 0
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            values = {result.data.decode("utf-8").strip() for result in decode(gray)}
+            if self._last in values:
+                absent = 0
+                values.discard(self._last)
+            else:
+                absent += 1
+                if absent >= self.clear_frames:
+                    self._last = None  # it left the frame; it may be scanned again
+            if values:
+                self._last = min(values)
+                return self._last
+        return None
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+_SCANNER = None
+
+
+def scan_barcode(timeout=None):
+    """Read the next barcode from the shared camera scanner."""
+    global _SCANNER
+    if _SCANNER is None:
+        _SCANNER = CameraScanner()
+    return _SCANNER.scan(timeout)
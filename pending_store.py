@@ -1,34 +1,334 @@
 # pending_store.py
+# Short-lived intake records (scan now, fill in details later).
+#
+# Entries expire PENDING_TTL_SECONDS after creation. Expired entries are
+# removed by a background sweeper (and on read), not only when someone
+# asks for them. The store is bounded: when it is full, the entry closest
+# to expiry is evicted. Every TTL is the same, so creation order is
+# deadline order: the memory backend keeps an OrderedDict and expires from
+# the front in O(1), and the SQLite backend reads from a deadline index.
+#
+# PENDING_BACKEND=memory  per-process (default)
+# PENDING_BACKEND=sqlite  shared by every worker on the host via PENDING_SQLITE_PATH
+#
+# scan_session.py keeps HTTP scan sessions in a second store (own table,
+# same file) and uses apply() for atomic read-modify-write per frame.
+import json
+import os
+import sqlite3
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime
+
+PENDING_BACKEND = os.getenv("PENDING_BACKEND", "memory")
+PENDING_SQLITE_PATH = os.getenv("PENDING_SQLITE_PATH", "pending.sqlite3")
+PENDING_TTL_SECONDS = float(os.getenv("PENDING_TTL_SECONDS", "1800"))
+PENDING_MAX_ENTRIES = int(os.getenv("PENDING_MAX_ENTRIES", "10000"))
+PENDING_SWEEP_INTERVAL = float(os.getenv("PENDING_SWEEP_INTERVAL", "60"))
+
+
+def _dumps(item):
+    return json.dumps(item, default=str, separators=(",", ":"))
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # intake_id -> (deadline, item, approx bytes), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _drop(self, intake_id):
+        _, item, size = self._data.pop(intake_id)
+        self._bytes -= size
+        return item
+
+    def _expire(self, now):
+        removed = 0
+        while self._data:
+            intake_id, (deadline, _, _) = next(iter(self._data.items()))
+            if deadline > now:
+                break
+            self._drop(intake_id)
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def put(self, intake_id, item, deadline):
+        size = len(_dumps(item))
+        with self._lock:
+            self._expire(time.time())
+            while len(self._data) >= self.max_entries:
+                self._drop(next(iter(self._data)))
+                self.evicted += 1
+            self._data[intake_id] = (deadline, item, size)
+            self._bytes += size
+
+    def get(self, intake_id):
+        with self._lock:
+            entry = self._data.get(intake_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._drop(intake_id)
+                self.expired += 1
+                return None
+            return entry[1]
+
+    def update(self, intake_id, updates):
+        with self._lock:
+            entry = self._data.get(intake_id)
+            if entry is None or entry[0] <= time.time():
+                return None
+            deadline, item, size = entry
+            item.update(updates)
+            new_size = len(_dumps(item))
+            self._data[intake_id] = (deadline, item, new_size)
+            self._bytes += new_size - size
+            return item
+
+    def apply(self, intake_id, fn, deadline=None):
+        """item = fn(item) atomically; `deadline` (if given) replaces the expiry."""
+        with self._lock:
+            entry = self._data.get(intake_id)
+            if entry is None or entry[0] <= time.time():
+                return None
+            old_deadline, item, size = entry
+            item = fn(item)
+            new_size = len(_dumps(item))
+            self._data[intake_id] = (deadline or old_deadline, item, new_size)
+            self._bytes += new_size - size
+            if deadline is not None:
+                self._data.move_to_end(intake_id)  # same TTL for all, so still deadline order
+            return item
+
+    def pop(self, intake_id):
+        with self._lock:
+            entry = self._data.get(intake_id)
+            if entry is None:
+                return None
+            item = self._drop(intake_id)
+            return item if entry[0] > time.time() else None
+
+    def sweep(self):
+        with self._lock:
+            return self._expire(time.time())
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes,
+                    "expired": self.expired, "evicted": self.evicted}
+
+
+class SQLiteBackend:
+    """
+    One small WAL-mode SQLite file shared by all workers on a host.
+    Each thread gets its own connection, and read-modify-write runs inside
+    BEGIN IMMEDIATE, so update/pop are atomic across processes.
+    """
+    name = "sqlite"
+
+    def __init__(self, max_entries, path=PENDING_SQLITE_PATH, table="pending_intakes"):
+        self.max_entries = max_entries
+        self.path = path
+        self.table = table  # fixed identifiers from our own code, never user input
+        self._local = threading.local()
+        self.expired = 0
+        self.evicted = 0
+        with self._conn() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " intake_id TEXT PRIMARY KEY, deadline REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_deadline ON {table} (deadline)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return _Transaction(conn)
+
+    @staticmethod
+    def _load(payload):
+        item = json.loads(payload)
+        item["created_at"] = datetime.fromisoformat(item["created_at"])
+        return item
+
+    def put(self, intake_id, item, deadline):
+        with self._conn() as conn:
+            self.expired += conn.execute(f"DELETE FROM {self.table} WHERE deadline <= ?", (time.time(),)).rowcount
+            over = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries + 1
+            if over > 0:
+                self.evicted += conn.execute(
+                    f"DELETE FROM {self.table} WHERE intake_id IN"
+                    f" (SELECT intake_id FROM {self.table} ORDER BY deadline LIMIT ?)", (over,)
+                ).rowcount
+            conn.execute(f"INSERT INTO {self.table} VALUES (?, ?, ?)", (intake_id, deadline, _dumps(item)))
+
+    def get(self, intake_id):
+        row = self._conn().conn.execute(
+            f"SELECT payload FROM {self.table} WHERE intake_id = ? AND deadline > ?", (intake_id, time.time())
+        ).fetchone()
+        return self._load(row[0]) if row else None
+
+    def update(self, intake_id, updates):
+        with self._conn() as conn:
+            row = conn.execute(
+                f"SELECT payload FROM {self.table} WHERE intake_id = ? AND deadline > ?", (intake_id, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            item = self._load(row[0])
+            item.update(updates)
+            conn.execute(f"UPDATE {self.table} SET payload = ? WHERE intake_id = ?", (_dumps(item), intake_id))
+            return item
+
+    def apply(self, intake_id, fn, deadline=None):
+        with self._conn() as conn:
+            row = conn.execute(
+                f"SELECT payload FROM {self.table} WHERE intake_id = ? AND deadline > ?", (intake_id, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            item = fn(self._load(row[0]))
+            if deadline is None:
+                conn.execute(f"UPDATE {self.table} SET payload = ? WHERE intake_id = ?", (_dumps(item), intake_id))
+            else:
+                conn.execute(f"UPDATE {self.table} SET payload = ?, deadline = ? WHERE intake_id = ?",
+                             (_dumps(item), deadline, intake_id))
+            return item
+
+    def pop(self, intake_id):
+        with self._conn() as conn:
+            row = conn.execute(
+                f"SELECT payload, deadline FROM {self.table} WHERE intake_id = ?", (intake_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(f"DELETE FROM {self.table} WHERE intake_id = ?", (intake_id,))
+            return self._load(row[0]) if row[1] > time.time() else None
+
+    def sweep(self):
+        with self._conn() as conn:
+            removed = conn.execute(f"DELETE FROM {self.table} WHERE deadline <= ?", (time.time(),)).rowcount
+        self.expired += removed
+        return removed
+
+    def stats(self):
+        entries, size = self._conn().conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM {self.table}"
+        ).fetchone()
+        # expired/evicted count this process's removals only
+        return {"entries": entries, "bytes": size, "expired": self.expired, "evicted": self.evicted,
+                "path": self.path}
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def make_backend(name=PENDING_BACKEND, max_entries=PENDING_MAX_ENTRIES, table="pending_intakes"):
+    if name == "sqlite":
+        return SQLiteBackend(max_entries, table=table)
+    return MemoryBackend(max_entries)
+
 
 class PendingStore:
-    def __init__(self):
-        self._data = {}  # intake_id -> payload
-        self._ttl = timedelta(minutes=30)
+    def __init__(self, backend=None, ttl=PENDING_TTL_SECONDS, sweep_interval=PENDING_SWEEP_INTERVAL,
+                 backend_name=PENDING_BACKEND, max_entries=PENDING_MAX_ENTRIES, table="pending_intakes"):
+        self._backend = backend
+        self._backend_name = backend_name
+        self._max_entries = max_entries
+        self._table = table
+        self._ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        # built on first use so a preloaded app opens its SQLite file per worker
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = make_backend(self._backend_name, self._max_entries, self._table)
+        return self._backend
+
+    def _ensure_sweeper(self):
+        # threads don't survive fork, so (re)start per process
+        if self.sweep_interval <= 0 or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="pending-sweeper", daemon=True)
+            self._sweeper.start()
+            self._sweeper_pid = os.getpid()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.backend.sweep()
+            except Exception:
+                pass  # e.g. SQLite busy; next round retries
 
     def create(self, payload):
+        self._ensure_sweeper()
         intake_id = str(uuid.uuid4())
-        self._data[intake_id] = {"created_at": datetime.utcnow(), **payload}
+        self.backend.put(intake_id, {"created_at": datetime.utcnow(), **payload}, time.time() + self._ttl)
         return intake_id
 
     def get(self, intake_id):
-        item = self._data.get(intake_id)
-        if not item:
-            return None
-        # optional TTL cleanup
-        if datetime.utcnow() - item["created_at"] > self._ttl:
-            self._data.pop(intake_id, None)
-            return None
-        return item
+        return self.backend.get(intake_id)
 
     def update(self, intake_id, updates):
-        if intake_id not in self._data:
-            return None
-        self._data[intake_id].update(updates)
-        return self._data[intake_id]
+        return self.backend.update(intake_id, updates)
+
+    def apply(self, intake_id, fn, touch=False):
+        """Atomic item = fn(item); with touch=True the entry's TTL restarts."""
+        return self.backend.apply(intake_id, fn, time.time() + self._ttl if touch else None)
 
     def pop(self, intake_id):
-        return self._data.pop(intake_id, None)
+        return self.backend.pop(intake_id)
+
+    def sweep(self):
+        """Drop every expired entry now; returns how many were removed."""
+        return self.backend.sweep()
+
+    def stats(self):
+        backend = self.backend
+        return {
+            "backend": backend.name,
+            "capacity": backend.max_entries,
+            "ttl_seconds": self._ttl,
+            "sweeper_running": self._sweeper_pid == os.getpid(),
+            **backend.stats(),
+        }
+
+    def close(self):
+        self._stop.set()
+        self._sweeper_pid = None
+
 
 PENDING = PendingStore()
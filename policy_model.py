@@ -0,0 +1,279 @@
+# policy_model.py
+# Serving side of train_model.py: loads bottle_policy_model.pkl and its
+# encoders once per process and predicts Recommended_Action.
+#
+# - Categorical features go through plain dict lookup tables built from each
+#   LabelEncoder's classes_ (unseen or missing values encode as -1).
+# - Batches use the sklearn forest directly.
+# - Single rows use CompiledForest: every tree flattened into shared numpy
+#   arrays and traversed for all trees at once, one step per depth level,
+#   which avoids sklearn's per-call validation/joblib overhead.
+#
+# Versioned artifacts written by retrain_model.py live in models/<version>/
+# and models/CURRENT names the live one. Workers re-check CURRENT every
+# POLICY_RELOAD_CHECK seconds and swap models in place; without a registry
+# the legacy root-level .pkl files are served.
+#
+# Cleanliness_Score is label-encoded ("Excellent", "Good", ...) by the
+# legacy model but numeric (1–10, as stored in bottle_records) in retrained
+# ones. Requests may send either form: encode_row converts to whatever the
+# live model expects, and /policy/model reports each feature's type.
+import json
+import os
+import threading
+import time
+import joblib
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POLICY_MODEL_DIR = os.getenv("POLICY_MODEL_DIR", HERE)
+POLICY_REGISTRY_DIR = os.getenv("POLICY_REGISTRY_DIR", os.path.join(HERE, "models"))
+POLICY_RELOAD_CHECK = float(os.getenv("POLICY_RELOAD_CHECK", "30"))
+
+# Qualitative cleanliness grades -> 1–10 score (database.csv uses the words)
+CLEANLINESS_WORDS = {"excellent": 9, "good": 7, "fair": 5, "poor": 3}
+
+UNSEEN = -1.0
+
+
+def format_feature(name, value):
+    """Match the string form the encoders were fitted on (see train_model.py)."""
+    if value is None:
+        return None
+    if name == "Fill_Level" and not isinstance(value, str):
+        return f"{float(value):g}%"
+    return str(value).strip()
+
+
+def parse_number(value):
+    """'90%' / '750' / 7 -> float; anything else -> UNSEEN."""
+    if value is None:
+        return UNSEEN
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except ValueError:
+        return UNSEEN
+
+
+def cleanliness_score(value):
+    """'Excellent' / 'good' / '7' / 7 -> score; anything else -> UNSEEN."""
+    if isinstance(value, str) and value.strip().lower() in CLEANLINESS_WORDS:
+        return float(CLEANLINESS_WORDS[value.strip().lower()])
+    return parse_number(value)
+
+
+def cleanliness_word(value):
+    """7 / '7' -> 'good': the best grade the score reaches; None if not a number."""
+    score = parse_number(value)
+    if score == UNSEEN:
+        return None
+    for word, floor in sorted(CLEANLINESS_WORDS.items(), key=lambda kv: -kv[1]):
+        if score >= floor:
+            return word
+    return min(CLEANLINESS_WORDS, key=CLEANLINESS_WORDS.get)
+
+
+class CompiledForest:
+    """Array-backed copy of a fitted RandomForestClassifier for one-row inference."""
+
+    def __init__(self, forest):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for est in forest.estimators_:
+            t = est.tree_
+            n = t.node_count
+            idx = np.arange(n)
+            leaf = t.children_left == -1
+            # leaves point at themselves so extra iterations are no-ops
+            lefts.append(np.where(leaf, idx, t.children_left) + offset)
+            rights.append(np.where(leaf, idx, t.children_right) + offset)
+            features.append(np.where(leaf, 0, t.feature))
+            thresholds.append(np.where(leaf, np.inf, t.threshold))
+            v = t.value[:, 0, :]
+            values.append(v / np.maximum(v.sum(axis=1, keepdims=True), 1e-12))
+            roots.append(offset)
+            offset += n
+            depth = max(depth, t.max_depth)
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.max_depth = depth
+        self.n_trees = len(roots)
+
+    def predict_proba_one(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        node = self.roots
+        for _ in range(self.max_depth):
+            go_left = x[self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node].mean(axis=0)
+
+
+class PolicyModel:
+    def __init__(self, model, encoders, target_encoder, version=None, manifest=None):
+        self.model = model
+        self.version = version
+        self.manifest = manifest
+        self.features = list(getattr(model, "feature_names_in_", []))
+        self.encoded = {
+            col: {str(c): float(i) for i, c in enumerate(enc.classes_)}
+            for col, enc in encoders.items()
+        }
+        # case-insensitive fallback ("excellent" vs the fitted "Excellent")
+        self.folded = {col: {k.casefold(): v for k, v in table.items()} for col, table in self.encoded.items()}
+        numeric = set((manifest or {}).get("numeric", ()))
+        self.feature_types = {
+            name: "numeric" if name in numeric or name not in self.encoded else "categorical"
+            for name in self.features
+        }
+        mismatched = [n for n in numeric if n in self.encoded]
+        if mismatched:
+            raise ValueError(f"manifest lists {mismatched} as numeric but the artifacts label-encode them")
+        self.labels = target_encoder.inverse_transform(model.classes_)
+        self.compiled = CompiledForest(model)
+
+    @classmethod
+    def load(cls, directory=POLICY_MODEL_DIR, version=None):
+        manifest_path = os.path.join(directory, "manifest.json")
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fh:
+                manifest = json.load(fh)
+        return cls(
+            joblib.load(os.path.join(directory, "bottle_policy_model.pkl")),
+            joblib.load(os.path.join(directory, "label_encoders.pkl")),
+            joblib.load(os.path.join(directory, "target_encoder.pkl")),
+            version=version,
+            manifest=manifest,
+        )
+
+    def encode_row(self, record):
+        """dict of feature -> raw value  ->  (float32 vector, unseen feature names)"""
+        row = np.empty(len(self.features), dtype=np.float32)
+        unseen = []
+        for j, name in enumerate(self.features):
+            value = record.get(name)
+            if self.feature_types[name] == "categorical":
+                code = self._category_code(name, format_feature(name, value))
+                if code is None:
+                    unseen.append(name)
+                    code = UNSEEN
+                row[j] = code
+            else:
+                row[j] = cleanliness_score(value) if name == "Cleanliness_Score" else parse_number(value)
+                if row[j] == UNSEEN:
+                    unseen.append(name)
+        return row, unseen
+
+    def _category_code(self, name, raw):
+        if raw is None:
+            return None
+        code = self.encoded[name].get(raw)
+        if code is None:
+            code = self.folded[name].get(raw.casefold())
+        if code is None and name == "Cleanliness_Score":
+            word = cleanliness_word(raw)  # numeric score sent to a word-encoded model
+            code = self.folded[name].get(word) if word else None
+        return code
+
+    def encode_batch(self, records):
+        X = np.empty((len(records), len(self.features)), dtype=np.float32)
+        unseen = []
+        for i, record in enumerate(records):
+            X[i], u = self.encode_row(record)
+            unseen.append(u)
+        return X, unseen
+
+    def result(self, proba, unseen):
+        best = int(np.argmax(proba))
+        return {
+            "action": str(self.labels[best]),
+            "confidence": round(float(proba[best]), 4),
+            "probabilities": {str(l): round(float(p), 4) for l, p in zip(self.labels, proba)},
+            "unseen_features": unseen,
+        }
+
+    def predict_one(self, record):
+        x, unseen = self.encode_row(record)
+        return self.result(self.compiled.predict_proba_one(x), unseen)
+
+    def predict_batch(self, records):
+        if not records:
+            return []
+        X, unseen = self.encode_batch(records)
+        # DataFrame keeps sklearn's feature-name check quiet
+        proba = self.model.predict_proba(pd.DataFrame(X, columns=self.features))
+        return [self.result(p, u) for p, u in zip(proba, unseen)]
+
+
+class PolicyService:
+    """
+    Process-wide holder; loads artifacts on first use and hot-swaps when
+    models/CURRENT changes. In-flight predictions keep the model they started with.
+    """
+
+    def __init__(self, directory=POLICY_MODEL_DIR, registry=POLICY_REGISTRY_DIR):
+        self.directory = directory
+        self.registry = registry
+        self._model = None
+        self._source = None  # directory the live model came from
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """-> (directory, version) of the model that should be live."""
+        try:
+            with open(os.path.join(self.registry, "CURRENT")) as fh:
+                version = fh.read().strip()
+        except OSError:
+            return self.directory, None
+        return os.path.join(self.registry, version), version
+
+    def reload(self, force=False):
+        """Swap in the published version if it changed. Returns True on swap."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            directory, version = self.resolve()
+            if not force and self._model is not None and directory == self._source:
+                return False
+            model = PolicyModel.load(directory, version=version)
+            self._model, self._source = model, directory
+            return True
+
+    @property
+    def model(self):
+        model = self._model
+        if model is None:
+            self.reload()
+        elif time.monotonic() - self._checked_at > POLICY_RELOAD_CHECK:
+            try:
+                self.reload()
+            except Exception:
+                # keep serving the current model; the next check retries
+                self._checked_at = time.monotonic()
+        return self._model
+
+    def info(self):
+        model = self._model
+        if model is None:
+            return {"loaded": False, "directory": self.resolve()[0]}
+        return {
+            "loaded": True,
+            "directory": self._source,
+            "version": model.version,
+            "metrics": (model.manifest or {}).get("metrics"),
+            "features": model.features,
+            "feature_types": model.feature_types,
+            "labels": [str(l) for l in model.labels],
+            "trees": model.compiled.n_trees,
+            "max_depth": model.compiled.max_depth,
+        }
+
+
+POLICY = PolicyService()
@@ -0,0 +1,230 @@
+# reference_cache.py
+# Read-through cache for the small, rarely changing reference tables
+# (products and airlines). Entries are immutable snapshots, so they can be
+# shared between requests and threads without touching a Session.
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from sqlalchemy import event, select
+from db import SessionLocal
+from models import Airline, Product
+
+# Snapshots keep the ORM attribute names so callers can use them interchangeably.
+ProductRef = namedtuple(
+    "ProductRef", ["product_barcode", "product_name", "category", "brand", "bottle_size"]
+)
+AirlineRef = namedtuple("AirlineRef", ["airline_id", "airline_code", "airline_name"])
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "600"))
+PRODUCT_NEGATIVE_TTL = float(os.getenv("PRODUCT_NEGATIVE_TTL", "30"))
+AIRLINE_TABLE_TTL = float(os.getenv("AIRLINE_TABLE_TTL", "600"))
+
+_MISSING = object()
+
+
+def product_ref(p):
+    return ProductRef(p.product_barcode, p.product_name, p.category, p.brand, p.bottle_size)
+
+
+def airline_ref(a):
+    return AirlineRef(a.airline_id, a.airline_code, a.airline_name)
+
+
+class LRUTTLCache:
+    """Bounded LRU with per-entry expiry. `None` values are cached as negatives."""
+
+    def __init__(self, maxsize, ttl, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class ReferenceData:
+    """Products: LRU+TTL per barcode. Airlines: whole table, reloaded on TTL/invalidate."""
+
+    def __init__(self):
+        self.products = LRUTTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, PRODUCT_NEGATIVE_TTL)
+        self._airlines = None  # (loaded_at, by_id, by_code, by_name, ordered)
+        self._airline_lock = threading.Lock()
+        self.airline_loads = 0
+        self.version = 0
+
+    # ───────────── products ─────────────
+
+    def get_product(self, barcode, db=None):
+        """barcode -> ProductRef or None. Only opens a session on a cache miss."""
+        cached = self.products.get(barcode)
+        if cached is not _MISSING:
+            return cached
+        if db is None:
+            with SessionLocal() as session:
+                return self.get_product(barcode, session)
+        p = db.execute(
+            select(Product).where(Product.product_barcode == barcode)
+        ).scalars().first()
+        ref = product_ref(p) if p else None
+        self.products.set(barcode, ref)
+        return ref
+
+    def get_products(self, barcodes, db=None):
+        """Bulk variant: one IN query for all misses. Returns {barcode: ProductRef}."""
+        found, missing = {}, []
+        for b in set(barcodes):
+            cached = self.products.get(b)
+            if cached is _MISSING:
+                missing.append(b)
+            elif cached is not None:
+                found[b] = cached
+        if not missing:
+            return found
+        if db is None:
+            with SessionLocal() as session:
+                return {**found, **self._load_products(session, missing)}
+        return {**found, **self._load_products(db, missing)}
+
+    def _load_products(self, db, barcodes):
+        loaded = {
+            p.product_barcode: product_ref(p)
+            for p in db.execute(
+                select(Product).where(Product.product_barcode.in_(barcodes))
+            ).scalars()
+        }
+        for b in barcodes:
+            self.products.set(b, loaded.get(b))
+        return loaded
+
+    # ───────────── airlines ─────────────
+
+    def _airline_table(self, db=None):
+        table = self._airlines
+        if table is not None and time.monotonic() - table[0] < AIRLINE_TABLE_TTL:
+            return table
+        with self._airline_lock:
+            table = self._airlines
+            if table is not None and time.monotonic() - table[0] < AIRLINE_TABLE_TTL:
+                return table
+            if db is None:
+                with SessionLocal() as session:
+                    rows = session.execute(select(Airline)).scalars().all()
+            else:
+                rows = db.execute(select(Airline)).scalars().all()
+            ordered = tuple(airline_ref(a) for a in rows)
+            by_name = {}
+            for a in ordered:
+                by_name.setdefault(a.airline_name.casefold(), a)
+            table = (
+                time.monotonic(),
+                {a.airline_id: a for a in ordered},
+                {a.airline_code: a for a in ordered},
+                by_name,
+                ordered,
+            )
+            self._airlines = table
+            self.airline_loads += 1
+            return table
+
+    def list_airlines(self, db=None):
+        return self._airline_table(db)[4]
+
+    def airline_by_id(self, airline_id, db=None):
+        return self._airline_table(db)[1].get(airline_id)
+
+    def airline_by_code(self, airline_code, db=None):
+        return self._airline_table(db)[2].get(airline_code)
+
+    def airline_by_name(self, name, db=None):
+        return self._airline_table(db)[3].get((name or "").strip().casefold())
+
+    # ───────────── maintenance ─────────────
+
+    def invalidate(self, barcode=None, airlines=True, products=True):
+        """Drop cached entries. With `barcode`, only that product is dropped."""
+        if barcode is not None:
+            self.products.discard(barcode)
+        else:
+            if products:
+                self.products.clear()
+            if airlines:
+                self._airlines = None
+        self.version += 1
+        return self.version
+
+    def warm(self, db=None):
+        self._airline_table(db)
+
+    def stats(self):
+        table = self._airlines
+        return {
+            "version": self.version,
+            "products": self.products.stats(),
+            "airlines": {
+                "loaded": table is not None,
+                "size": len(table[4]) if table else 0,
+                "loads": self.airline_loads,
+            },
+        }
+
+
+REFERENCE = ReferenceData()
+
+
+# ORM writes made by this process invalidate the affected entries immediately.
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _product_changed(mapper, connection, target):
+    REFERENCE.invalidate(barcode=target.product_barcode)
+
+
+@event.listens_for(Airline, "after_insert")
+@event.listens_for(Airline, "after_update")
+@event.listens_for(Airline, "after_delete")
+def _airline_changed(mapper, connection, target):
+    REFERENCE.invalidate(products=False)
@@ -0,0 +1,235 @@
+# retrain_model.py
+# Retrains the policy model from bottle_records (joined to products,
+# flights and airlines) instead of database.csv.
+#
+#   python retrain_model.py                      # train + publish a new version
+#   python retrain_model.py --since 2025-01-01 --max-samples 0.5 --no-publish
+#
+# Rows are streamed through a server-side cursor in chunks. Each chunk is
+# encoded straight into compact int32/float32 arrays, and the category
+# vocabularies grow as chunks arrive, so memory is ~4 bytes per cell
+# instead of a pandas object frame. Training uses every core (n_jobs=-1).
+# Artifacts go to models/<version>/ with a manifest.json, and models/CURRENT
+# is switched atomically. Running API workers pick up the new version
+# without a restart (see policy_model.PolicyService).
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+from sqlalchemy import select
+from db import engine
+from models import Airline, BottleRecord, Flight, Product
+from policy_model import POLICY_REGISTRY_DIR, parse_number
+
+CHUNK_ROWS = int(os.getenv("RETRAIN_CHUNK_ROWS", "50000"))
+
+# Feature name (database.csv vocabulary) -> column. Unlike train_model.py,
+# Fill_Level and Cleanliness_Score are numeric here; policy_model converts
+# requests to whichever form the live model expects (see its header).
+CATEGORICAL = {
+    "Customer_Name": Airline.airline_name,
+    "Customer_Code": Airline.airline_code,
+    "Service_Class": Flight.service_class,
+    "Product_Name": Product.product_name,
+    "Category": Product.category,
+    "Brand": Product.brand,
+    "Seal_Status": BottleRecord.seal_status,
+    "Label_Status": BottleRecord.label_status,
+    "Bottle_Condition": BottleRecord.bottle_condition,
+    "Inbound_Flight": Flight.flight_number,
+    "Origin": Flight.origin,
+    "Destination": Flight.destination,
+}
+NUMERIC = {
+    "Bottle_Size": Product.bottle_size,
+    "Fill_Level": BottleRecord.fill_level,
+    "Cleanliness_Score": BottleRecord.cleanliness_score,
+}
+TARGET = BottleRecord.recommended_action
+
+
+class IncrementalEncoder:
+    """Grows a vocabulary chunk by chunk; codes are remapped to sorted order at the end."""
+
+    def __init__(self):
+        self.codes = {}  # value -> provisional code (first-seen order)
+
+    def encode(self, values):
+        uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+        mapping = np.array([self.codes.setdefault(u, len(self.codes)) for u in uniques], dtype=np.int32)
+        return mapping[inverse]
+
+    def finalize(self):
+        """-> (LabelEncoder with sorted classes_, provisional->final remap array)"""
+        classes = sorted(self.codes)
+        enc = LabelEncoder()
+        enc.classes_ = np.array(classes, dtype=object)
+        final = {v: i for i, v in enumerate(classes)}
+        remap = np.empty(len(self.codes), dtype=np.int32)
+        for value, provisional in self.codes.items():
+            remap[provisional] = final[value]
+        return enc, remap
+
+
+def training_query(since=None, until=None):
+    stmt = (
+        select(*CATEGORICAL.values(), *NUMERIC.values(), TARGET)
+        .join(Product, Product.product_barcode == BottleRecord.product_barcode)
+        .join(Flight, Flight.flight_id == BottleRecord.flight_id)
+        .join(Airline, Airline.airline_id == BottleRecord.airline_id)
+        .order_by(BottleRecord.record_id)
+    )
+    if since:
+        stmt = stmt.where(BottleRecord.scan_timestamp >= since)
+    if until:
+        stmt = stmt.where(BottleRecord.scan_timestamp < until)
+    return stmt
+
+
+def load_matrix(since=None, until=None, chunk_rows=CHUNK_ROWS):
+    """Stream rows into a float32 feature matrix + int target vector."""
+    features = list(CATEGORICAL) + list(NUMERIC)
+    n_cat = len(CATEGORICAL)
+    encoders = {name: IncrementalEncoder() for name in CATEGORICAL}
+    target_encoder = IncrementalEncoder()
+    blocks, targets = [], []
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(
+            training_query(since, until)
+        )
+        for rows in result.partitions(chunk_rows):
+            cols = list(zip(*rows))
+            block = np.empty((len(rows), len(features)), dtype=np.float32)
+            for j, name in enumerate(CATEGORICAL):
+                block[:, j] = encoders[name].encode(cols[j])
+            for j in range(n_cat, len(features)):
+                block[:, j] = [parse_number(v) for v in cols[j]]
+            blocks.append(block)
+            targets.append(target_encoder.encode(cols[-1]))
+            print(f"  … {sum(len(b) for b in blocks):,} rows", flush=True)
+
+    if not blocks:
+        raise SystemExit("No bottle_records matched; nothing to train on.")
+
+    X = np.concatenate(blocks)
+    y = np.concatenate(targets)
+    del blocks, targets
+
+    label_encoders = {}
+    for j, name in enumerate(CATEGORICAL):
+        enc, remap = encoders[name].finalize()
+        X[:, j] = remap[X[:, j].astype(np.int32)]
+        label_encoders[name] = enc
+    target_enc, remap = target_encoder.finalize()
+    y = remap[y]
+    return X, y, features, label_encoders, target_enc
+
+
+def encoder_version(enc):
+    digest = hashlib.sha1("\x1f".join(map(str, enc.classes_)).encode("utf-8")).hexdigest()
+    return {"classes": len(enc.classes_), "sha1": digest[:12]}
+
+
+def split(X, y, test_size, seed):
+    try:
+        return train_test_split(X, y, test_size=test_size, random_state=seed, stratify=y)
+    except ValueError:  # a class with a single sample
+        return train_test_split(X, y, test_size=test_size, random_state=seed)
+
+
+def publish(version_dir, version):
+    """Point models/CURRENT at `version` atomically."""
+    current = os.path.join(os.path.dirname(version_dir), "CURRENT")
+    tmp = current + ".tmp"
+    with open(tmp, "w") as fh:
+        fh.write(version + "\n")
+    os.replace(tmp, current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the policy model from bottle_records")
+    parser.add_argument("--since", help="only records scanned on/after this ISO date")
+    parser.add_argument("--until", help="only records scanned before this ISO date")
+    parser.add_argument("--trees", type=int, default=300)
+    parser.add_argument("--max-samples", type=float, default=None,
+                        help="bootstrap sample fraction per tree (speeds up very large sets)")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--registry", default=POLICY_REGISTRY_DIR)
+    parser.add_argument("--no-publish", action="store_true", help="write artifacts but keep CURRENT")
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    until = datetime.fromisoformat(args.until) if args.until else None
+
+    t0 = time.perf_counter()
+    print("📥 Streaming bottle_records …")
+    X, y, features, label_encoders, target_encoder = load_matrix(since, until)
+    t_load = time.perf_counter() - t0
+    print(f"📊 {len(X):,} rows × {len(features)} features in {t_load:.1f}s")
+
+    X_train, X_test, y_train, y_test = split(X, y, args.test_size, args.seed)
+    model = RandomForestClassifier(
+        n_estimators=args.trees,
+        random_state=args.seed,
+        class_weight="balanced_subsample",
+        max_samples=args.max_samples,
+        n_jobs=-1,
+    )
+    t1 = time.perf_counter()
+    # DataFrame over the float32 block (no copy) so feature names are recorded
+    model.fit(pd.DataFrame(X_train, columns=features, copy=False), y_train)
+    t_fit = time.perf_counter() - t1
+
+    y_pred = model.predict(pd.DataFrame(X_test, columns=features, copy=False))
+    metrics = {
+        "accuracy": round(float(accuracy_score(y_test, y_pred)), 4),
+        "f1_macro": round(float(f1_score(y_test, y_pred, average="macro", zero_division=0)), 4),
+        "train_rows": int(len(X_train)),
+        "test_rows": int(len(X_test)),
+    }
+    print(f"📈 accuracy={metrics['accuracy']} f1_macro={metrics['f1_macro']} (fit {t_fit:.1f}s)")
+
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    version_dir = os.path.join(args.registry, version)
+    os.makedirs(version_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(version_dir, "bottle_policy_model.pkl"))
+    joblib.dump(label_encoders, os.path.join(version_dir, "label_encoders.pkl"))
+    joblib.dump(target_encoder, os.path.join(version_dir, "target_encoder.pkl"))
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(),
+        "source": {"table": "bottle_records", "since": args.since, "until": args.until, "rows": int(len(X))},
+        "features": features,
+        "categorical": list(CATEGORICAL),
+        "numeric": list(NUMERIC),
+        "target": {"name": "Recommended_Action", **encoder_version(target_encoder),
+                   "labels": [str(c) for c in target_encoder.classes_]},
+        "encoders": {name: encoder_version(enc) for name, enc in label_encoders.items()},
+        "params": {"n_estimators": args.trees, "max_samples": args.max_samples, "seed": args.seed},
+        "metrics": metrics,
+        "timings_s": {"load": round(t_load, 2), "fit": round(t_fit, 2)},
+    }
+    with open(os.path.join(version_dir, "manifest.json"), "w") as fh:
+        json.dump(manifest, fh, indent=2)
+
+    if not args.no_publish:
+        publish(version_dir, version)
+        print(f"✅ Published model version {version}")
+    else:
+        print(f"✅ Wrote model version {version} (not published)")
+
+
+if __name__ == "__main__":
+    main()
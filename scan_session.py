@@ -0,0 +1,253 @@
+# scan_session.py
+# Per-station streaming scan sessions: near-duplicate frames are skipped
+# using a 64-bit difference hash of the reduced frame, and each barcode is
+# reported once per debounce window.
+#
+# WebSocket sessions live in this process (the socket is pinned to one
+# worker anyway). HTTP sessions (/scan-session) can land on any gunicorn
+# worker, so their state is kept in a pending_store table shared by every
+# worker on the host (SCAN_SESSION_BACKEND=sqlite, the default). Across
+# several hosts, route a session's requests to one host (sticky sessions).
+import os
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+from barcode_decode import prepare_fast_frame, decode_prepared, ImagePayloadError
+from pending_store import PendingStore
+from reference_cache import REFERENCE
+
+SESSION_DEBOUNCE_SECONDS = float(os.getenv("SCAN_DEBOUNCE_SECONDS", "3"))
+SESSION_HASH_HISTORY = int(os.getenv("SCAN_HASH_HISTORY", "4"))
+SESSION_HASH_DISTANCE = int(os.getenv("SCAN_HASH_DISTANCE", "4"))  # bits out of 64
+SESSION_IDLE_TTL = float(os.getenv("SCAN_SESSION_IDLE_TTL", "300"))
+SESSION_BACKEND = os.getenv("SCAN_SESSION_BACKEND", "sqlite")
+SESSION_MAX_ENTRIES = int(os.getenv("SCAN_SESSION_MAX", "1000"))
+
+
+def frame_hash(gray):
+    """dHash: compare neighbouring pixels of a 9x8 thumbnail -> 64-bit int."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def read_frame(image_bytes):
+    buf = np.frombuffer(image_bytes, np.uint8)
+    gray, reduced = prepare_fast_frame(buf)
+    if gray is None:
+        raise ImagePayloadError("Could not decode image")
+    return buf, gray, reduced
+
+
+def decode_values(buf, gray, reduced):
+    values = []
+    for b in decode_prepared(buf, gray, reduced):
+        value = b.data.decode("utf-8").strip()
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+class ScanSession:
+    def __init__(self, session_id, *, debounce_seconds=SESSION_DEBOUNCE_SECONDS,
+                 hash_history=SESSION_HASH_HISTORY, hash_distance=SESSION_HASH_DISTANCE):
+        self.session_id = session_id
+        self.debounce_seconds = debounce_seconds
+        self.hash_history = hash_history
+        self.hash_distance = hash_distance
+        self._recent_hashes = []
+        self._last_reported = {}  # barcode -> wall-clock time (shared sessions cross processes)
+        self._lock = threading.Lock()
+        self.created_at = self.last_seen = time.time()
+        self.frames = self.skipped = self.decoded = self.reported = 0
+
+    def to_state(self):
+        return {
+            "debounce_seconds": self.debounce_seconds,
+            "hash_history": self.hash_history,
+            "hash_distance": self.hash_distance,
+            "recent_hashes": list(self._recent_hashes),
+            "last_reported": dict(self._last_reported),
+            "last_seen": self.last_seen,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "decoded": self.decoded,
+            "reported": self.reported,
+        }
+
+    @classmethod
+    def from_state(cls, session_id, state):
+        session = cls(session_id, debounce_seconds=state["debounce_seconds"],
+                      hash_history=state["hash_history"], hash_distance=state["hash_distance"])
+        session._recent_hashes = list(state["recent_hashes"])
+        session._last_reported = dict(state["last_reported"])
+        session.last_seen = state["last_seen"]
+        session.frames, session.skipped = state["frames"], state["skipped"]
+        session.decoded, session.reported = state["decoded"], state["reported"]
+        return session
+
+    def _is_duplicate(self, h):
+        return any(hamming(h, prev) <= self.hash_distance for prev in self._recent_hashes)
+
+    def _remember(self, h):
+        self._recent_hashes.append(h)
+        if len(self._recent_hashes) > self.hash_history:
+            self._recent_hashes.pop(0)
+
+    def _debounce(self, values, now):
+        fresh = []
+        for value in values:
+            last = self._last_reported.get(value)
+            if last is None or now - last >= self.debounce_seconds:
+                fresh.append(value)
+            self._last_reported[value] = now
+        # forget barcodes that have been out of view for a while
+        stale = now - 10 * self.debounce_seconds
+        for value in [v for v, t in self._last_reported.items() if t < stale]:
+            del self._last_reported[value]
+        return fresh
+
+    def admit(self, h, values, now):
+        """
+        Count one frame whose hash is `h` and whose decoded barcodes are
+        `values` (None when the caller already saw it was a duplicate).
+        Returns the reply with raw barcode strings.
+        """
+        self.last_seen = now
+        self.frames += 1
+        if values is None or self._is_duplicate(h):
+            self.skipped += 1
+            return {"frame": self.frames, "skipped": True, "barcodes": []}
+        self._remember(h)
+        self.decoded += 1
+        fresh = self._debounce(values, now)
+        self.reported += len(fresh)
+        return {"frame": self.frames, "skipped": False, "barcodes": fresh}
+
+    def process(self, image_bytes):
+        """One frame in -> {"frame", "skipped", "barcodes": [new detections]}."""
+        with self._lock:
+            buf, gray, reduced = read_frame(image_bytes)
+            h = frame_hash(gray)
+            values = None if self._is_duplicate(h) else decode_values(buf, gray, reduced)
+            result = self.admit(h, values, time.time())
+        return describe_result(result)
+
+    def stats(self):
+        return {
+            "session_id": self.session_id,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "decoded": self.decoded,
+            "reported": self.reported,
+            "debounce_seconds": self.debounce_seconds,
+            "idle_seconds": round(time.time() - self.last_seen, 3),
+        }
+
+
+def describe_result(result):
+    return {**result, "barcodes": [describe_barcode(v) for v in result["barcodes"]]}
+
+
+def describe_barcode(value):
+    product = REFERENCE.get_product(value)
+    if not product:
+        return {"barcode": value, "found": False}
+    return {
+        "barcode": value,
+        "found": True,
+        "product_name": product.product_name,
+        "brand": product.brand,
+        "category": product.category,
+        "bottle_size": product.bottle_size
+    }
+
+
+class ScanSessionStore:
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._idle_ttl = idle_ttl
+
+    def create(self, **options):
+        session = ScanSession(str(uuid.uuid4()), **options)
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self._idle_ttl
+        for sid in [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]:
+            del self._sessions[sid]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SharedScanSessions:
+    """
+    HTTP scan sessions, visible to every worker that shares the backend.
+    Each frame is decoded outside any lock; only the small admit step
+    (duplicate check, debounce, counters) runs as one atomic update, so two
+    workers handling frames of the same session never lose each other's state.
+    """
+
+    def __init__(self, backend_name=SESSION_BACKEND, idle_ttl=SESSION_IDLE_TTL,
+                 max_entries=SESSION_MAX_ENTRIES):
+        self._store = PendingStore(ttl=idle_ttl, backend_name=backend_name,
+                                   max_entries=max_entries, table="scan_sessions")
+
+    def create(self, **options):
+        session = ScanSession(None, **options)
+        session.session_id = self._store.create(session.to_state())
+        return session
+
+    def get(self, session_id):
+        state = self._store.get(session_id)
+        return ScanSession.from_state(session_id, state) if state else None
+
+    def close(self, session_id):
+        state = self._store.pop(session_id)
+        return ScanSession.from_state(session_id, state) if state else None
+
+    def process(self, session_id, image_bytes):
+        """Like ScanSession.process; None if the session is gone."""
+        snapshot = self.get(session_id)
+        if snapshot is None:
+            return None
+        buf, gray, reduced = read_frame(image_bytes)
+        h = frame_hash(gray)
+        # the snapshot may be a frame behind; admit() re-checks against the stored state
+        values = None if snapshot._is_duplicate(h) else decode_values(buf, gray, reduced)
+        result = {}
+
+        def admit(state):
+            session = ScanSession.from_state(session_id, state)
+            result.update(session.admit(h, values, time.time()))
+            return {**state, **session.to_state()}
+
+        if self._store.apply(session_id, admit, touch=True) is None:
+            return None
+        return describe_result(result)
+
+    def stats(self):
+        return self._store.stats()
+
+
+SESSIONS = ScanSessionStore()  # WebSocket sessions, this process only
+HTTP_SESSIONS = SharedScanSessions()
@@ -1,36 +1,137 @@
 # sla_engine.py
+from collections import namedtuple
+from functools import lru_cache
+
+# Forma compilada de una política SLA: un flag por patrón reconocido.
+CompiledPolicy = namedtuple("CompiledPolicy", [
+    "discard_opened", "refill", "refill_below_90", "refill_above_60",
+    "keep_only_sealed", "add_bottle", "discard", "clean",
+])
+
+ACTION_COLORS = {"Discard": "🔴", "Refill": "🟡", "Keep": "🟢", "Add Bottle": "🔵"}
+
+
+@lru_cache(maxsize=1024)
+def compile_policy(sla_policy):
+    """Analiza el texto de la política una sola vez (cacheado por texto)."""
+    policy = (sla_policy or "").lower()
+    return CompiledPolicy(
+        discard_opened="discard all opened" in policy,
+        refill="refill" in policy,
+        refill_below_90="fill < 90" in policy,
+        refill_above_60="fill > 60" in policy,
+        keep_only_sealed="keep only if sealed" in policy,
+        add_bottle="add 1 additional sealed" in policy,
+        discard="discard" in policy,
+        clean="clean" in policy,
+    )
+
 
 def evaluate_sla(customer, sla_policy, fill, seal, cleanliness="Good"):
     """
     Evalúa la política SLA según el cliente y condiciones de la botella.
     Retorna la acción recomendada y un color indicador.
     """
-    policy = sla_policy.lower()
+    p = compile_policy(sla_policy)
     fill = float(fill)
     seal = seal.lower()
     cleanliness = cleanliness.lower()
 
     # --- Lógica basada en patrones comunes de SLA ---
-    if "discard all opened" in policy and "opened" in seal:
+    if p.discard_opened and "opened" in seal:
         return "Discard", "🔴"
 
-    if "refill" in policy:
-        if "fill < 90" in policy and fill < 90:
+    if p.refill:
+        if p.refill_below_90 and fill < 90:
             return "Refill", "🟡"
-        elif "fill > 60" in policy and fill > 60:
+        elif p.refill_above_60 and fill > 60:
             return "Refill", "🟡"
 
-    if "keep only if sealed" in policy and seal == "sealed" and fill >= 95:
+    if p.keep_only_sealed and seal == "sealed" and fill >= 95:
         return "Keep", "🟢"
 
-    if "add 1 additional sealed" in policy and 60 <= fill < 80:
+    if p.add_bottle and 60 <= fill < 80:
         return "Add Bottle", "🔵"
 
-    if "discard" in policy and fill < 60:
+    if p.discard and fill < 60:
         return "Discard", "🔴"
 
-    if "clean" in policy and cleanliness not in ["good", "excellent"]:
+    if p.clean and cleanliness not in ["good", "excellent"]:
         return "Discard", "🔴"
 
     # Valor por defecto si no entra en ninguna condición
     return "Keep", "🟢"
+
+
+def evaluate_sla_bulk(sla_policy, fill, seal, cleanliness):
+    """
+    Versión vectorizada de evaluate_sla sobre arreglos (misma semántica, mismo orden de reglas).
+    Cada política distinta se compila una vez; el resto son máscaras de NumPy.
+    Retorna (acciones, colores) como arreglos de objetos.
+    """
+    import numpy as np
+
+    policies, policy_idx = np.unique(np.asarray(sla_policy, dtype=object).astype(str), return_inverse=True)
+    flags = np.array([compile_policy(p) for p in policies], dtype=bool).reshape(
+        len(policies), len(CompiledPolicy._fields)  # ancho explícito: con 0 filas -1 no se puede inferir
+    )
+    f = {name: flags[policy_idx, i] for i, name in enumerate(CompiledPolicy._fields)}
+
+    fill = np.asarray(fill, dtype=np.float64)
+    seals, seal_idx = np.unique(np.asarray(seal, dtype=object).astype(str), return_inverse=True)
+    seals = np.char.lower(seals.astype(str))
+    seal_opened = np.char.find(seals, "opened")[seal_idx] >= 0
+    seal_sealed = (seals == "sealed")[seal_idx]
+    cleans, clean_idx = np.unique(np.asarray(cleanliness, dtype=object).astype(str), return_inverse=True)
+    clean_ok = np.isin(np.char.lower(cleans.astype(str)), ["good", "excellent"])[clean_idx]
+
+    conditions = [
+        f["discard_opened"] & seal_opened,
+        f["refill"] & f["refill_below_90"] & (fill < 90),
+        f["refill"] & f["refill_above_60"] & (fill > 60),
+        f["keep_only_sealed"] & seal_sealed & (fill >= 95),
+        f["add_bottle"] & (fill >= 60) & (fill < 80),
+        f["discard"] & (fill < 60),
+        f["clean"] & ~clean_ok,
+    ]
+    choices = ["Discard", "Refill", "Refill", "Keep", "Add Bottle", "Discard", "Discard"]
+    actions = np.select(conditions, choices, default="Keep").astype(object)
+    colors = np.vectorize(ACTION_COLORS.get, otypes=[object])(actions) if len(actions) else actions
+    return actions, colors
+
+
+def evaluate_sla_frame(df, policy_col="SLA_Reuse_Policy", fill_col="Fill_Level",
+                       seal_col="Seal_Status", cleanliness_col="Cleanliness_Score"):
+    """
+    Re-evalúa un DataFrame completo (p. ej. database.csv). Acepta niveles
+    como "90%". Retorna una copia con columnas SLA_Action y SLA_Color.
+    """
+    import pandas as pd
+
+    fill = df[fill_col]
+    if fill.dtype == object:
+        fill = pd.to_numeric(fill.astype(str).str.rstrip("%"), errors="coerce")
+    actions, colors = evaluate_sla_bulk(
+        df[policy_col].to_numpy(), fill.to_numpy(), df[seal_col].to_numpy(), df[cleanliness_col].to_numpy()
+    )
+    out = df.copy()
+    out["SLA_Action"] = actions
+    out["SLA_Color"] = colors
+    return out
+
+
+if __name__ == "__main__":
+    # python sla_engine.py database.csv [salida.csv]
+    import sys
+    import time
+    import pandas as pd
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "database.csv"
+    df = pd.read_csv(source, encoding="utf-8-sig")
+    start = time.perf_counter()
+    scored = evaluate_sla_frame(df)
+    elapsed = time.perf_counter() - start
+    print(scored["SLA_Action"].value_counts().to_string())
+    print(f"\n{len(scored)} filas evaluadas en {elapsed * 1000:.1f} ms")
+    if len(sys.argv) > 2:
+        scored.to_csv(sys.argv[2], index=False)
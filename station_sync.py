@@ -0,0 +1,403 @@
+# station_sync.py
+# Offline-capable station mode: the galley station runs against a local
+# SQLite replica and syncs with the central database in the background.
+#
+# With STATION_MODE=1, db.py points SessionLocal at STATION_DB_PATH. The
+# app code is unchanged: register_barcode, evaluate_action, REFERENCE and
+# GUIDELINES all read the local file, and new BottleRecords commit
+# locally. Every request then costs local-disk latency, and a central
+# outage no longer stops the line.
+#
+# This module moves data both ways:
+#   pull  products, airlines and guideline_templates rows whose updated_at
+#         (kept current by a trigger, migration 0006) is past the last one
+#         seen, minus STATION_PULL_OVERLAP to catch slow commits. Every
+#         STATION_RECONCILE_EVERY pulls it copies the whole table and drops
+#         local rows that are gone upstream.
+#   push  local bottle_records above the push watermark, STATION_PUSH_BATCH
+#         at a time. Flights are matched upstream by natural key (local
+#         flight_ids are station-private). Rows are inserted with ON
+#         CONFLICT (scan_uuid) DO NOTHING, so a batch retried after a lost
+#         commit never duplicates. Rows upstream rejects outright are set
+#         aside in push_rejects and the rest continue.
+# Pushed records older than STATION_KEEP_DAYS are pruned from the replica.
+#
+# Run the station as a single process (python app.py, or gunicorn -w 1).
+# Each process syncs on its own, and pulls only invalidate its own caches.
+#
+#   python station_sync.py pull [--full]
+#   python station_sync.py push
+#   python station_sync.py status
+#   python station_sync.py run            # sync loop without the API
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, Text, bindparam, create_engine, delete, func,
+    select, update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import sessionmaker
+from db import STATION_MODE, UPSTREAM_DATABASE_URL, dialect_insert, engine, engine_options
+from logic_evaluator import GUIDELINES
+from metrics import Counter, Gauge
+from models import Airline, Base, BottleRecord, Flight, GuidelineTemplate, Product
+from reference_cache import REFERENCE
+from write_behind import COLUMNS
+
+STATION_PULL_INTERVAL = float(os.getenv("STATION_PULL_INTERVAL", "60"))
+STATION_PUSH_INTERVAL = float(os.getenv("STATION_PUSH_INTERVAL", "5"))
+STATION_PUSH_BATCH = int(os.getenv("STATION_PUSH_BATCH", "500"))
+STATION_PULL_OVERLAP = float(os.getenv("STATION_PULL_OVERLAP", "600"))
+STATION_RECONCILE_EVERY = int(os.getenv("STATION_RECONCILE_EVERY", "60"))
+STATION_KEEP_DAYS = float(os.getenv("STATION_KEEP_DAYS", "7"))
+STATION_MAX_BACKOFF = float(os.getenv("STATION_MAX_BACKOFF", "60"))
+STATION_CONNECT_TIMEOUT = int(os.getenv("STATION_CONNECT_TIMEOUT", "3"))
+
+# airlines first: guideline rows reference them
+REPLICATED = (Airline, Product, GuidelineTemplate)
+FLIGHT_KEY = ("airline_id", "flight_number", "flight_date", "service_class")
+PUSH_STATE = "push:record_id"
+WRITE_CHUNK = 500
+
+PENDING_ROWS = Gauge("scanner_station_pending_rows", "Local bottle_records not yet pushed upstream.")
+PUSHED_ROWS = Counter("scanner_station_pushed_rows_total", "Local bottle_records pushed upstream.")
+SYNC_FAILURES = Counter("scanner_station_sync_failures_total", "Failed station pull/push cycles.")
+
+# Replica bookkeeping; lives only in the station's SQLite file
+_meta = MetaData()
+REPLICA_STATE = Table(
+    "replica_state", _meta,
+    Column("name", String(50), primary_key=True),
+    Column("value", String(64), nullable=False),
+)
+PUSH_REJECTS = Table(
+    "push_rejects", _meta,
+    Column("record_id", Integer, primary_key=True),
+    Column("error", Text, nullable=False),
+    Column("rejected_at", DateTime, nullable=False),
+)
+
+
+def _chunks(items, size=WRITE_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_state(conn, name, default=None):
+    value = conn.execute(select(REPLICA_STATE.c.value).where(REPLICA_STATE.c.name == name)).scalar()
+    return default if value is None else value
+
+
+def set_state(conn, name, value):
+    stmt = sqlite_insert(REPLICA_STATE).values(name=name, value=str(value))
+    conn.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"value": stmt.excluded.value}))
+
+
+class StationSync:
+    def __init__(self, local=engine, upstream_url=UPSTREAM_DATABASE_URL, pull_interval=STATION_PULL_INTERVAL,
+                 push_interval=STATION_PUSH_INTERVAL, batch_size=STATION_PUSH_BATCH,
+                 max_backoff=STATION_MAX_BACKOFF):
+        self.local = local
+        self.upstream_url = upstream_url
+        self.pull_interval = pull_interval
+        self.push_interval = push_interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._upstream = None
+        self._upstream_session = None
+        self._lock = threading.Lock()  # one pull/push at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.pulls = 0
+        self.pushed = 0
+        self.rejected = 0
+        self.failures = 0
+        self.online = None
+        self.last_error = None
+        self.last_pull_at = None
+        self.last_push_at = None
+
+    # ── plumbing ──
+
+    def upstream(self):
+        if self._upstream is None:
+            options = engine_options(self.upstream_url)
+            if self.upstream_url.startswith("postgresql"):
+                # fail fast while the link is down instead of holding the sync thread
+                options["connect_args"] = {**options["connect_args"], "connect_timeout": STATION_CONNECT_TIMEOUT}
+                options.update(pool_size=1, max_overflow=1)
+            self._upstream = create_engine(self.upstream_url, **options)
+            self._upstream_session = sessionmaker(bind=self._upstream, autoflush=False)
+        return self._upstream
+
+    def ensure_schema(self):
+        Base.metadata.create_all(self.local)
+        _meta.create_all(self.local)
+
+    # ── lifecycle ──
+
+    def start(self):
+        """Create the replica schema and start the sync thread (station mode only, once per process)."""
+        if not STATION_MODE or self._pid == os.getpid():
+            return
+        self.ensure_schema()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="station-sync", daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def stop(self, timeout=10.0):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._pid = None
+
+    def _run(self):
+        backoff = 0.0
+        next_pull = 0.0
+        while True:
+            try:
+                self.push()
+                if time.monotonic() >= next_pull:
+                    self.pull()
+                    self.prune()
+                    next_pull = time.monotonic() + self.pull_interval
+                self.online = True
+                backoff = 0.0
+            except Exception as e:
+                self.online = False
+                self.failures += 1
+                SYNC_FAILURES.inc()
+                self.last_error = f"{type(e).__name__}: {e}"
+                backoff = min(self.max_backoff, max(1.0, backoff * 2))
+            delay = backoff * random.uniform(0.5, 1.0) if backoff else self.push_interval
+            if self._stop.wait(delay):
+                return
+
+    # ── pull ──
+
+    def pull(self, full=None):
+        """Copy changed reference rows into the replica; `full` also drops rows deleted upstream."""
+        with self._lock:
+            if full is None:
+                full = self.pulls % STATION_RECONCILE_EVERY == 0
+            result = {model.__tablename__: self._pull_table(model, full) for model in REPLICATED}
+            self.pulls += 1
+            self.last_pull_at = datetime.utcnow()
+
+        changed = {name for name, r in result.items() if r["changed"] or r["deleted"]}
+        if changed & {"airlines", "products"}:
+            REFERENCE.invalidate(airlines="airlines" in changed, products="products" in changed)
+        if "guideline_templates" in changed:
+            GUIDELINES.invalidate()
+        return {"full": full, "tables": result}
+
+    def _pull_table(self, model, full):
+        table = model.__table__
+        pk = next(iter(table.primary_key.columns))
+        state_name = f"pull:{table.name}"
+        with self.local.connect() as lc:
+            since = get_state(lc, state_name)
+        since = datetime.fromisoformat(since) if since else None
+
+        stmt = select(table)
+        if since is not None and not full:
+            stmt = stmt.where(table.c.updated_at > since - timedelta(seconds=STATION_PULL_OVERLAP))
+        with self.upstream().connect() as up:
+            rows = [dict(r) for r in up.execute(stmt).mappings()]
+
+        # the overlap window re-reads rows we already have; only newer ones count as changes
+        changed = len(rows) if since is None or full else sum(r["updated_at"] > since for r in rows)
+        deleted = 0
+        with self.local.begin() as lc:
+            upsert = sqlite_insert(table)
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[pk.name],
+                set_={c.name: upsert.excluded[c.name] for c in table.columns if not c.primary_key},
+            )
+            for part in _chunks(rows):
+                lc.execute(upsert, part)
+            if full and rows:  # an empty upstream table is more likely a wrong URL than a wipe
+                gone = sorted(set(lc.scalars(select(pk))) - {r[pk.name] for r in rows})
+                for part in _chunks(gone):
+                    deleted += lc.execute(delete(table).where(pk.in_(part))).rowcount
+            newest = max((r["updated_at"] for r in rows), default=None)
+            if newest is not None and (since is None or newest > since):
+                set_state(lc, state_name, newest.isoformat())
+        return {"rows": len(rows), "changed": changed, "deleted": deleted}
+
+    # ── push ──
+
+    def push(self):
+        """Push every unpushed local record upstream, one batch per transaction."""
+        with self._lock:
+            total = 0
+            while True:
+                count = self._push_batch()
+                total += count
+                if count < self.batch_size:
+                    break
+            if total:
+                self.last_push_at = datetime.utcnow()
+            return total
+
+    def _push_batch(self):
+        records = BottleRecord.__table__
+        with self.local.begin() as lc:
+            watermark = int(get_state(lc, PUSH_STATE, 0))
+            # rows written without a scan_uuid (e.g. register-batch before it set one) get a stable
+            # key locally before they leave, so a retried push hits the conflict target
+            missing = lc.scalars(
+                select(records.c.record_id).where(records.c.record_id > watermark, records.c.scan_uuid.is_(None))
+            ).all()
+            if missing:
+                lc.execute(
+                    update(records).where(records.c.record_id == bindparam("rid")).values(scan_uuid=bindparam("uid")),
+                    [{"rid": rid, "uid": str(uuid.uuid4())} for rid in missing],
+                )
+            rows = lc.execute(
+                select(records.c.record_id, *(records.c[c] for c in COLUMNS),
+                       Flight.flight_number, Flight.origin, Flight.destination, Flight.flight_date,
+                       Flight.service_class)
+                .join(Flight, Flight.flight_id == records.c.flight_id)
+                .where(records.c.record_id > watermark)
+                .order_by(records.c.record_id)
+                .limit(self.batch_size)
+            ).mappings().all()
+        if not rows:
+            PENDING_ROWS.set(0)
+            return 0
+
+        self.upstream()
+        try:
+            self._insert_upstream(rows)
+        except (IntegrityError, DataError):
+            for row in rows:  # find the row(s) upstream refuses; the rest go through
+                try:
+                    self._insert_upstream([row])
+                except (IntegrityError, DataError) as e:
+                    self._reject(row, e)
+
+        with self.local.begin() as lc:
+            set_state(lc, PUSH_STATE, rows[-1]["record_id"])
+        self.pushed += len(rows)
+        PUSHED_ROWS.inc(len(rows))
+        return len(rows)
+
+    def _insert_upstream(self, rows):
+        with self._upstream_session() as up:
+            flight_ids = {}
+            for row in rows:
+                key = tuple(row[c] for c in FLIGHT_KEY)
+                if key in flight_ids:
+                    continue
+                up.execute(
+                    dialect_insert(up, Flight).values(
+                        **dict(zip(FLIGHT_KEY, key)), origin=row["origin"], destination=row["destination"]
+                    ).on_conflict_do_nothing(index_elements=FLIGHT_KEY)
+                )
+                flight_ids[key] = up.execute(
+                    select(Flight.flight_id).where(*(getattr(Flight, c) == v for c, v in zip(FLIGHT_KEY, key)))
+                ).scalar_one()
+            params = [
+                {**{c: row[c] for c in COLUMNS}, "flight_id": flight_ids[tuple(row[c] for c in FLIGHT_KEY)]}
+                for row in rows
+            ]
+            up.execute(dialect_insert(up, BottleRecord).on_conflict_do_nothing(index_elements=["scan_uuid"]), params)
+            up.commit()
+
+    def _reject(self, row, error):
+        with self.local.begin() as lc:
+            lc.execute(sqlite_insert(PUSH_REJECTS).values(
+                record_id=row["record_id"],
+                error=str(error.orig if hasattr(error, "orig") else error),
+                rejected_at=datetime.utcnow(),
+            ).on_conflict_do_nothing(index_elements=["record_id"]))
+        self.rejected += 1
+
+    def prune(self, keep_days=STATION_KEEP_DAYS):
+        """Delete pushed records older than keep_days; rejected ones stay for inspection."""
+        records = BottleRecord.__table__
+        cutoff = datetime.utcnow() - timedelta(days=keep_days)
+        with self.local.begin() as lc:
+            watermark = int(get_state(lc, PUSH_STATE, 0))
+            return lc.execute(
+                delete(records).where(
+                    records.c.record_id <= watermark,
+                    records.c.scan_timestamp < cutoff,
+                    records.c.record_id.not_in(select(PUSH_REJECTS.c.record_id)),
+                )
+            ).rowcount
+
+    # ── introspection ──
+
+    def stats(self):
+        records = BottleRecord.__table__
+        with self.local.connect() as lc:
+            state = dict(lc.execute(select(REPLICA_STATE.c.name, REPLICA_STATE.c.value)).all())
+            watermark = int(state.get(PUSH_STATE, 0))
+            pending = lc.scalar(select(func.count()).select_from(records).where(records.c.record_id > watermark))
+            replica = {m.__tablename__: lc.scalar(select(func.count()).select_from(m.__table__)) for m in REPLICATED}
+            rejects = lc.scalar(select(func.count()).select_from(PUSH_REJECTS))
+        PENDING_ROWS.set(pending)
+        return {
+            "station_mode": STATION_MODE,
+            "running": self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(),
+            "online": self.online,
+            "pending_rows": pending,
+            "pushed_rows": self.pushed,
+            "push_watermark": watermark,
+            "rejected_rows": rejects,
+            "replica_rows": replica,
+            "pull_watermarks": {k.split(":", 1)[1]: v for k, v in state.items() if k.startswith("pull:")},
+            "pulls": self.pulls,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_pull_at": self.last_pull_at.isoformat() if self.last_pull_at else None,
+            "last_push_at": self.last_push_at.isoformat() if self.last_push_at else None,
+        }
+
+
+STATION = StationSync()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync this station's SQLite replica with the central database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pull = sub.add_parser("pull", help="copy changed products / airlines / guidelines down")
+    pull.add_argument("--full", action="store_true", help="copy whole tables and drop rows deleted upstream")
+    sub.add_parser("push", help="push unpushed bottle_records up")
+    sub.add_parser("status", help="replica and queue state")
+    sub.add_parser("run", help="pull/push loop in the foreground")
+    args = parser.parse_args()
+
+    if not STATION_MODE:
+        raise SystemExit("STATION_MODE=1 is required (DATABASE_URL is the central DB, STATION_DB_PATH the replica)")
+    STATION.ensure_schema()
+    if args.command == "pull":
+        print(json.dumps(STATION.pull(full=True if args.full else None)))
+    elif args.command == "push":
+        print(json.dumps({"pushed": STATION.push(), "pruned": STATION.prune()}))
+    elif args.command == "status":
+        print(json.dumps(STATION.stats(), indent=2))
+    else:
+        STATION.start()
+        try:
+            while True:
+                time.sleep(STATION_PULL_INTERVAL)
+                print(json.dumps(STATION.stats()), flush=True)
+        except KeyboardInterrupt:
+            STATION.stop()
+
+
+if __name__ == "__main__":
+    main()
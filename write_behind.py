@@ -0,0 +1,328 @@
+# write_behind.py
+# Deferred BottleRecord inserts for /barcode/register?deferred=1.
+#
+# submit() appends the row to a local append-only journal (JSON lines,
+# fsync'd by default) and returns. The caller answers the scanner right
+# away with the row's scan_uuid. A background thread drains the queue into
+# the database: it flushes when WRITE_BEHIND_BATCH rows are waiting or
+# WRITE_BEHIND_INTERVAL seconds have passed, using one INSERT ... ON
+# CONFLICT (scan_uuid) DO NOTHING per batch.
+#
+# - Connection errors back off exponentially (with jitter, capped at
+#   WRITE_BEHIND_MAX_BACKOFF) and retry the same batch.
+# - Any other failure (integrity/data error, a bad bind value, an
+#   unparseable journal row) is treated as a bad row: the batch is split
+#   until the row is isolated. That row goes to deadletter.jsonl once (keyed
+#   by scan_uuid), and the rest continue.
+# - Journal segments are deleted once every row in them is committed. On
+#   start, segments left by dead processes (crash, kill -9, deploy) are
+#   claimed and replayed. Duplicate inserts are harmless thanks to the
+#   scan_uuid conflict target.
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from db import SessionLocal, dialect_insert
+from metrics import Counter, Gauge
+from models import BottleRecord
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", os.path.join(HERE, "journal"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", "30"))
+WRITE_BEHIND_SEGMENT_ROWS = int(os.getenv("WRITE_BEHIND_SEGMENT_ROWS", "5000"))
+# 0 trades a few ms per submit for possibly losing the last writes on power loss
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+
+QUEUE_DEPTH = Gauge("scanner_write_behind_queue_rows", "Rows journaled but not yet committed.")
+FLUSHED_ROWS = Counter("scanner_write_behind_flushed_rows_total", "Rows committed by the write-behind flusher.")
+FLUSH_FAILURES = Counter("scanner_write_behind_flush_failures_total", "Failed write-behind flush attempts.")
+DEAD_LETTERED = Counter("scanner_write_behind_dead_letter_total", "Rows moved to the dead-letter file.")
+
+def is_connectivity_error(error):
+    """Errors worth retrying the whole batch for; anything else is blamed on the rows."""
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+COLUMNS = (
+    "scan_uuid", "product_barcode", "airline_id", "flight_id", "guideline_id",
+    "fill_level", "seal_status", "cleanliness_score", "label_status",
+    "bottle_condition", "recommended_action", "scan_timestamp", "notes",
+)
+
+
+def _owner_alive(pid):
+    if pid == os.getpid():
+        return False  # a previous process that had our pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Segment:
+    def __init__(self, path, fh=None):
+        self.path = path
+        self.fh = fh          # open while this is the active segment
+        self.rows = 0         # rows written to it
+        self.outstanding = 0  # rows not yet committed
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class WriteBehindQueue:
+    def __init__(self, directory=WRITE_BEHIND_DIR, batch_size=WRITE_BEHIND_BATCH,
+                 interval=WRITE_BEHIND_INTERVAL, max_backoff=WRITE_BEHIND_MAX_BACKOFF,
+                 segment_rows=WRITE_BEHIND_SEGMENT_ROWS, fsync=WRITE_BEHIND_FSYNC):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.segment_rows = segment_rows
+        self.fsync = fsync
+        self._queue = deque()  # (Segment, row) in journal order
+        self._current = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.flushed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.replayed = 0
+        self.last_error = None
+        self.last_flush_at = None
+        self._dead_uuids = set()  # scan_uuids already in deadletter.jsonl
+
+    # ── lifecycle ──
+
+    def start(self):
+        """Replay orphaned journals and start the flusher (once per process)."""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            # state inherited through fork belongs to the parent
+            self._queue.clear()
+            self._current = None
+            self._stopping = False
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_dead_letters()
+            self._replay()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=10.0):
+        """Flush what we can within `timeout`; anything left is replayed on the next start."""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._pid = None
+
+    def _replay(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("wal-") and name.endswith(".jsonl")):
+                continue
+            try:
+                owner = int(name.split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if _owner_alive(owner):
+                continue
+            # claim by rename so two workers starting together don't both replay it
+            claimed = os.path.join(self.directory, self._segment_name())
+            try:
+                os.rename(os.path.join(self.directory, name), claimed)
+            except FileNotFoundError:
+                continue
+            segment = Segment(claimed)
+            with open(claimed) as fh:
+                for line in fh:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    self._queue.append((segment, row))
+                    segment.rows += 1
+            segment.outstanding = segment.rows
+            if segment.rows == 0:
+                segment.remove()
+            self.replayed += segment.rows
+        QUEUE_DEPTH.set(len(self._queue))
+
+    def _load_dead_letters(self):
+        try:
+            with open(os.path.join(self.directory, "deadletter.jsonl"), encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        self._dead_uuids.add(json.loads(line)["row"].get("scan_uuid"))
+                    except (ValueError, KeyError, AttributeError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        self._dead_uuids.discard(None)
+
+    def _segment_name(self):
+        return f"wal-{os.getpid()}-{time.time_ns()}.jsonl"
+
+    # ── producer side ──
+
+    def submit(self, row):
+        """Journal one BottleRecord row (dict of COLUMNS); returns once it is durable locally."""
+        self.start()
+        line = json.dumps(row, default=str, separators=(",", ":")) + "\n"
+        with self._cond:
+            segment = self._current
+            if segment is None or segment.rows >= self.segment_rows:
+                if segment is not None:
+                    segment.close()
+                    if segment.outstanding == 0:
+                        segment.remove()
+                path = os.path.join(self.directory, self._segment_name())
+                segment = self._current = Segment(path, open(path, "a", encoding="utf-8"))
+            segment.fh.write(line)
+            segment.fh.flush()
+            if self.fsync:
+                os.fsync(segment.fh.fileno())
+            segment.rows += 1
+            segment.outstanding += 1
+            self._queue.append((segment, row))
+            QUEUE_DEPTH.set(len(self._queue))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    # ── flusher ──
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while len(self._queue) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._queue:
+                    if self._stopping:
+                        return
+                    continue
+                batch = [entry for _, entry in zip(range(self.batch_size), self._queue)]
+
+            try:
+                self._write([row for _, row in batch])
+            except Exception as e:
+                self.failures += 1
+                FLUSH_FAILURES.inc()
+                self.last_error = f"{type(e).__name__}: {e}"
+                if self._stopping:
+                    return  # leave the rest in the journal for replay
+                backoff = min(self.max_backoff, max(0.25, backoff * 2))
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+                continue
+            backoff = 0.0
+            self._done(len(batch))
+
+    def _done(self, count):
+        with self._cond:
+            for _ in range(count):
+                segment, _ = self._queue.popleft()
+                segment.outstanding -= 1
+                if segment.outstanding == 0:
+                    # every row in it is committed: the file is no longer needed
+                    segment.remove()
+                    if segment is self._current:
+                        self._current = None
+            QUEUE_DEPTH.set(len(self._queue))
+        self.flushed += count
+        FLUSHED_ROWS.inc(count)
+        self.last_flush_at = datetime.utcnow()
+
+    def _write(self, rows):
+        """
+        Insert rows; isolates and dead-letters rows that fail for any reason
+        other than connectivity, which propagates so the batch is retried.
+        """
+        rows = [r for r in rows if r.get("scan_uuid") not in self._dead_uuids]
+        if not rows:
+            return
+        try:
+            self._insert(rows)
+        except Exception as e:
+            if is_connectivity_error(e):
+                raise
+            if len(rows) == 1:
+                self._dead_letter(rows[0], e)
+                return
+            mid = len(rows) // 2
+            self._write(rows[:mid])
+            self._write(rows[mid:])
+
+    @staticmethod
+    def _insert(rows):
+        params = []
+        for row in rows:
+            values = {c: row.get(c) for c in COLUMNS}
+            if isinstance(values["scan_timestamp"], str):
+                values["scan_timestamp"] = datetime.fromisoformat(values["scan_timestamp"])
+            params.append(values)
+        with SessionLocal() as db:
+            stmt = dialect_insert(db, BottleRecord).on_conflict_do_nothing(index_elements=["scan_uuid"])
+            db.execute(stmt, params)
+            db.commit()
+
+    def _dead_letter(self, row, error):
+        if row.get("scan_uuid") in self._dead_uuids:
+            return
+        with open(os.path.join(self.directory, "deadletter.jsonl"), "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({"row": row, "error": str(error.orig if hasattr(error, "orig") else error),
+                                 "at": datetime.utcnow().isoformat()}, default=str) + "\n")
+        if row.get("scan_uuid"):
+            self._dead_uuids.add(row["scan_uuid"])
+        self.dead_lettered += 1
+        DEAD_LETTERED.inc()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._queue)
+            segments = len({id(s) for s, _ in self._queue})
+        return {
+            "running": self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(),
+            "pending_rows": pending,
+            "journal_segments": segments,
+            "flushed_rows": self.flushed,
+            "replayed_rows": self.replayed,
+            "failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "last_error": self.last_error,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "directory": self.directory,
+        }
+
+
+WRITE_BEHIND = WriteBehindQueue()
@@ -0,0 +1,23 @@
+# wsgi.py
+# Production entry point:  gunicorn -c gunicorn.conf.py wsgi:app
+from app import app
+from db import SessionLocal, warm_pool
+from logic_evaluator import GUIDELINES
+from reference_cache import REFERENCE
+from airline_search import AIRLINE_SEARCH
+from write_behind import WRITE_BEHIND
+from station_sync import STATION
+
+
+def warm_up():
+    """Open pool connections and preload reference data before taking traffic."""
+    # replay journals left by crashed/stopped workers, even if the DB is down right now
+    WRITE_BEHIND.start()
+    # station mode: create the local replica schema and start syncing (no-op otherwise)
+    STATION.start()
+    opened = warm_pool()
+    with SessionLocal() as db:
+        REFERENCE.warm(db)
+        AIRLINE_SEARCH.index(db)
+        GUIDELINES.load(db)
+    app.logger.info("Worker warmed: %d connections, %s", opened, GUIDELINES.stats())